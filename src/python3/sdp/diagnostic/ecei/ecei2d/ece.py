@@ -57,6 +57,10 @@ from ....geometry.grid import Cartesian1D, FinePatch1D
 from ....settings.unitsystem import cgs
 from ....settings.exception import ECEIWarning
 
+# besides one stencil for each X1D point, the propagator evaluates the plasma 
+# along its central ray, and view_spot on the whole (Y2D, X2D) plane
+_EXTRA_STENCILS = 2
+
 class ECE2D_property(object):
     """Serializable container for main ECE2D properties
     
@@ -277,6 +281,13 @@ class ECE2D(object):
         self.X2D = np.zeros((self.NY, self.NX)) + self.X1D
         self.Y2D = np.zeros_like(self.X2D) + self.Y1D[:, np.newaxis]
         self.dZ = self.Z1D[1]-self.Z1D[0]
+        # plasma quantities are evaluated on the same (Y1D, X) lines for 
+        # every frequency and time step, keep their compiled stencils. Only 
+        # profiles with interpolation stencils support this.
+        if hasattr(self.plasma, 'stencil_cache_size'):
+            self.plasma.stencil_cache_size = \
+                max(self.plasma.stencil_cache_size, 
+                    self.NX + _EXTRA_STENCILS)
         self._set_detector()
         self._auto_coords_adjusted = False
         
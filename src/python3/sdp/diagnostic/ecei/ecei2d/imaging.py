@@ -14,8 +14,11 @@ Created on Fri Mar 18 11:07:24 2016
 """
 
 from os import path
+import os
+import io
 import sys
 import json
+import pickle
 import time as systime
 
 import numpy as np
@@ -23,6 +26,88 @@ import numpy as np
 from .ece import ECE2D
 from .detector2d import Detector2D, GaussianAntenna
 from ....plasma.profile import ECEI_Profile
+from ....plasma.shared import SharedProfile
+from ....io.forkpool import ForkPool, fork_available
+
+
+def _channel_models(system, channel):
+    """objects of a channel built on the plasma profile in ECE2D.__init__
+    
+    They are never changed by the channel methods, and some of them can not be
+    pickled, so they are passed between processes by reference.
+    """
+    return {'plasma': system.plasma, 
+            'scct': channel.scct,
+            'main_dielectric': channel.propagator.main_dielectric,
+            'fluc_dielectric': channel.propagator.fluc_dielectric}
+
+class _ChannelPickler(pickle.Pickler):
+    """Pickler replacing the plasma profile and the models built on it by 
+    references, so channel states can be sent back from the workers
+    """
+    def __init__(self, file, models):
+        super(_ChannelPickler, self).__init__(file, pickle.HIGHEST_PROTOCOL)
+        self.models = dict((id(obj), name) for name, obj in models.items())
+        
+    def persistent_id(self, obj):
+        return self.models.get(id(obj))
+        
+class _ChannelUnpickler(pickle.Unpickler):
+    """Unpickler restoring the references with the local objects
+    """
+    def __init__(self, file, models):
+        super(_ChannelUnpickler, self).__init__(file)
+        self.models = models
+        
+    def persistent_load(self, pid):
+        try:
+            return self.models[pid]
+        except KeyError:
+            raise pickle.UnpicklingError('Unknown persistent id: {}'.\
+                                         format(pid))
+        
+def _dump_channel(system, channel):
+    """return the pickled state of *channel*, without the plasma models
+    """
+    state = io.BytesIO()
+    _ChannelPickler(state, _channel_models(system, channel)).\
+        dump(channel.__dict__)
+    return state.getvalue()
+    
+def _load_channel(system, channel, state):
+    """update *channel* with the *state* returned by :py:func:`_dump_channel`
+    """
+    channel.__dict__.update(_ChannelUnpickler(io.BytesIO(state), 
+                            _channel_models(system, channel)).load())
+    
+def _update_stencil_cache_size(plasma, size):
+    """raise the stencil cache size of *plasma* to *size*
+    
+    Channels raise it in :py:meth:`.ece.ECE2D.set_coords`, the size is passed
+    between processes together with the channel states.
+    """
+    if size is not None:
+        plasma.stencil_cache_size = max(plasma.stencil_cache_size, size)
+        
+def _run_channel(context, channel_idx, state, cache_size, method, kwargs):
+    """worker of the local parallel backend, call *method* of chosen channel
+    
+    The imaging system is inherited through fork as the pool context, so the
+    plasma profile is never pickled. The workers are kept for later calls, so
+    the current state of the channel and the stencil cache size of the plasma
+    are sent with each call.
+    
+    :return: index of the channel, pickled state of the channel, without the 
+             plasma models, stencil cache size of the plasma, and the returned
+             value of *method*
+    """
+    system = context['system']
+    channel = system._channels[channel_idx]
+    _load_channel(system, channel, state)
+    _update_stencil_cache_size(system.plasma, cache_size)
+    result = getattr(channel, method)(**kwargs)
+    return (channel_idx, _dump_channel(system, channel), 
+            getattr(system.plasma, 'stencil_cache_size', None), result)
 
 
 class ECEImagingSystem(object):
@@ -33,7 +118,7 @@ class ECEImagingSystem(object):
         __init__(plasma, detectors, polarization='X', 
                  weakly_relativistic=True, isotropic=True, 
                  max_harmonic=4, max_power=4, parallel=False, 
-                 client=None)
+                 client=None, n_workers=None, shared_plasma=False)
     
     :param plasma: plasma to be diagnosed
     :type plasma: :py:class:`sdp.plasma.PlasmaProfile.ECEIProfile` object
@@ -54,9 +139,26 @@ class ECEImagingSystem(object):
                            anisotropic formula is needed. Default is True.
                            
     :param bool parallel: parallel run flag. Default is False.
-    :param client: ipcluster client handler, only needed for parallel 
-                   runs.
+    :param client: ipcluster client handler. If not given, parallel runs use 
+                   local worker processes instead of an Ipython cluster.
     :type client: Handler of Ipython cluster. object created by Client()
+    :param int n_workers: number of local worker processes. Default is the
+                          number of CPUs. Only used in parallel runs without
+                          *client*.
+    :param bool shared_plasma: if True, ipcluster engines attach the plasma 
+                               profile from shared memory instead of each 
+                               creating its own copy. All engines must run on
+                               this machine. Default is False.
+                          
+    Local parallel runs fork worker processes at the first call of 
+    :py:meth:`auto_adjust_mesh` or :py:meth:`diagnose`, and keep them until 
+    :py:meth:`close` is called. The workers inherit the plasma profile through
+    fork, so the profile is never copied. Each channel runs in a worker, its 
+    current state is sent with the call, and its updated state is sent back 
+    as soon as it finishes. Changes of the plasma profile made after the 
+    workers are forked are not seen by them, call :py:meth:`close` after 
+    changing the profile. Fork is required, on platforms without it channels 
+    are run serially.
                            
     
     Methods
@@ -71,13 +173,17 @@ class ECEImagingSystem(object):
     diagnose(time, detectorID='all'): 
         diagnose plasma of using chosen 
         time steps using chosen channels.
+        
+    close():
+        shut down local worker processes
     
     
     """
     
     def __init__(self, plasma, detectors, polarization='X', 
                  weakly_relativistic=True, isotropic=True, 
-                 max_harmonic=4, max_power=4, parallel=False, client=None):
+                 max_harmonic=4, max_power=4, parallel=False, client=None,
+                 n_workers=None, shared_plasma=False):
         """Initialize ecei System
         
         :param plasma: plasma to be diagnosed
@@ -104,9 +210,14 @@ class ECEImagingSystem(object):
                               model.
                                
         :param bool parallel: parallel run flag. Default is False.
-        :param client: ipcluster client handler, only needed for parallel 
-                   runs.
+        :param client: ipcluster client handler. If not given, parallel runs 
+                       use local worker processes.
         :type client: Handler of Ipython cluster. object created by Client()
+        :param int n_workers: number of local worker processes. Default is 
+                              the number of CPUs.
+        :param bool shared_plasma: if True, ipcluster engines attach the 
+                                   plasma profile from shared memory. All 
+                                   engines must run on this machine.
         """
         
         self.plasma = plasma
@@ -118,19 +229,31 @@ class ECEImagingSystem(object):
         self.max_harmonic = max_harmonic
         self.max_power = max_power
         
-        if (parallel):
+        self._local = False
+        self._pool = None
+        if (parallel and client is None):
+            # channels are kept here, and run by local worker processes
+            self._parallel = False
+            self._local = fork_available()
+            if n_workers is None:
+                n_workers = os.cpu_count()
+            self._n_workers = n_workers
+            # interpolators are created before forking, so all workers 
+            # inherit them
+            plasma.setup_interps()
+        elif (parallel):
             self._parallel = True
             self._client = client
             self._engine_num = len(client.ids)
             # import and initialize useful modules and variables
             dv = self._client[:]
             dv.execute('\
-import sdp.plasma.PlasmaProfile\n\
-PlasmaProfile = sdp.plasma.PlasmaProfile\n\
-import sdp.diagnostic.ecei.ecei2d.Detector2D\n\
-Detector2D = sdp.diagnostic.ecei.ecei2d.Detector2D\n\
-import sdp.diagnostic.ecei.ecei2d.Reciprocity\n\
-ECE2D = sdp.diagnostic.ecei.ecei2d.Reciprocity.ECE2D')
+import sdp.plasma.profile\n\
+PlasmaProfile = sdp.plasma.profile\n\
+import sdp.diagnostic.ecei.ecei2d.detector2d\n\
+Detector2D = sdp.diagnostic.ecei.ecei2d.detector2d\n\
+import sdp.diagnostic.ecei.ecei2d.ece\n\
+ECE2D = sdp.diagnostic.ecei.ecei2d.ece.ECE2D')
         else:
             self._parallel = False
             
@@ -149,8 +272,15 @@ ids = []\n\
 detector_parameters = {}\n\
 detectors = {}\n\
 eces = {}\n')
-            dv.push({'p_param':plasma.parameters})
-            dv.execute('\
+            if shared_plasma:
+                # the handle keeps the shared memory until this system is 
+                # deleted
+                self._shared_plasma = SharedProfile(plasma)
+                dv.push({'p_shared':self._shared_plasma})
+                dv.execute('plasma=p_shared.attach()', block=True)
+            else:
+                dv.push({'p_param':plasma.parameters})
+                dv.execute('\
 plasma=PlasmaProfile.{0}(**p_param)\n\
 plasma.setup_interps()'.format(plasma.class_name), block=True)
             for i,d in enumerate(detectors):
@@ -180,6 +310,41 @@ eces[i] = ECE2D(plasma=plasma, detector=detectors[i], **e_param)'\
 Check if something went wrong! Time elapsed: {0}s'.format(wait_time))
         self._debug_mode = np.zeros((self._ND,), dtype='bool')
                              
+    def _run_local(self, method, channelID, kwargs, mute=False):
+        """run *method* of chosen channels on local worker processes
+        
+        Workers are forked at the first call, and kept for later calls. 
+        Channels are updated in this process in the order they finish.
+        
+        :return: dictionary of the returned values of *method*, keyed by 
+                 channel indices
+        """
+        if self._pool is None:
+            self._pool = ForkPool(min(self._n_workers, self._ND), system=self)
+        cache_size = getattr(self.plasma, 'stencil_cache_size', None)
+        results = {}
+        for i, state, worker_cache_size, result in self._pool.imap_unordered(\
+                _run_channel, [(i, _dump_channel(self, self._channels[i]), 
+                                cache_size, method, kwargs) 
+                               for i in channelID]):
+            results[i] = result
+            _load_channel(self, self._channels[i], state)
+            # the channels may have changed the plasma in the worker
+            _update_stencil_cache_size(self.plasma, worker_cache_size)
+            if not mute:
+                print('Channel #{} finished.'.format(i))
+        return results
+        
+    def close(self):
+        """shut down the local worker processes
+        
+        New workers are forked at the next local parallel run, they inherit 
+        the plasma profile at that time.
+        """
+        if self._pool is not None:
+            self._pool.close()
+            self._pool = None
+        
         
     def set_coords(self, coordinates, channelID='all'):
         """setup initial calculation mesh in Z,Y,X for chosen channels
@@ -233,11 +398,20 @@ something went wrong. Time elapsed: {0}s'.format(wait_time))
                                        parallel mode to avoid infinite waiting.
         :param bool mute: if True, no output during execution, except warnings.
         """
-        tstart = systime.clock()
+        tstart = systime.perf_counter()
         
         if str(channelID) == 'all':
             channelID = np.arange(self._ND)
-        if not self._parallel:
+        if self._local:
+            if not mute:
+                print('Local parallel run of channel {0} on {1} processes.'.\
+                       format(channelID, self._n_workers))
+            self._run_local('auto_adjust_mesh', channelID, 
+                            dict(fine_coeff=fine_coeff, mute=mute), mute)
+            tend = systime.perf_counter()
+            if not mute:
+                print('Walltime: {0:.4}s'.format(tend-tstart))
+        elif not self._parallel:
             if not mute:
                 print('Serial run of channel {0} out of total {1} channels.'.\
                        format(channelID, self._ND))
@@ -246,7 +420,7 @@ something went wrong. Time elapsed: {0}s'.format(wait_time))
                     print('Channel {}:'.format(channel_idx))
                 self.channels[channel_idx].auto_adjust_mesh\
                                            (fine_coeff=fine_coeff, mute=mute)
-            tend = systime.clock()
+            tend = systime.perf_counter()
             if not mute:
                 print('Walltime: {0:.4}s'.format(tend-tstart))
         else:
@@ -272,7 +446,7 @@ eces[{0}].auto_adjust_mesh(fine_coeff=fine_coeff, mute=mute)'.format(i))
             if wait_time >= wait_time_single*len(channelID):
                 raise Exception('Parallel auto_adjust_mesh takes too long. \
 Check if something went wrong. Time elapsed: {0}s'.format(wait_time))
-            tend = systime.clock()
+            tend = systime.perf_counter()
             if not mute:
                 print('Walltime: {0:.4}s'.format(tend-tstart))
             return status
@@ -305,7 +479,7 @@ Check if something went wrong. Time elapsed: {0}s'.format(wait_time))
                                        parallel mode to avoid infinite waiting.
         :param bool mute: if True, no printed output.
         """
-        tstart = systime.clock()
+        tstart = systime.perf_counter()
         if str(channelID) == 'all':
                 channelID = np.arange(self._ND)
         if time is not None:
@@ -317,7 +491,22 @@ Check if something went wrong. Time elapsed: {0}s'.format(wait_time))
         else:
             self.Te = np.empty((self._ND,), dtype='float')
                 
-        if not self._parallel:
+        if self._local:
+            if not mute:
+                print('Local parallel run for {0} channels on {1} processes.'\
+                      .format(len(channelID), self._n_workers))
+            self._debug_mode[channelID] = debug
+            Te = self._run_local('diagnose', channelID, 
+                                 dict(time=time, debug=debug, 
+                                      auto_patch=auto_patch,
+                                      oblique_correction=oblique_correction,
+                                      mute=mute), mute)
+            for channel_idx, channel_Te in Te.items():
+                self.Te[channel_idx] = np.asarray(channel_Te)
+            tend = systime.perf_counter()
+            if not mute:
+                print('Walltime: {0:.4}s'.format(tend-tstart))
+        elif not self._parallel:
             # single CPU version
             # if no previous Te, initialize with np.nan
             if not mute:
@@ -333,7 +522,7 @@ Check if something went wrong. Time elapsed: {0}s'.format(wait_time))
                                                   oblique_correction=\
                                                   oblique_correction,
                                                   mute=mute))
-            tend = systime.clock()
+            tend = systime.perf_counter()
             if not mute:
                 print('Walltime: {0:.4}s'.format(tend-tstart))                                                  
         else:
@@ -367,7 +556,7 @@ oblique_correction=oblique_correction, mute=mute)'.format(i))
             if wait_time >= wait_time_single*len(channelID):
                 raise Exception('Parallel diagnose() takes too long. Check if \
 something went wrong. Time elapsed: {0}s'.format(wait_time))
-            tend = systime.clock()
+            tend = systime.perf_counter()
             if not mute:
                 print('Walltime: {0:.4}s'.format(tend-tstart))    
             return status
@@ -8,7 +8,7 @@ Created on Fri Oct 16 10:35:35 2015
 """
 import numpy as np
 from matplotlib.tri import TriFinder
-from scipy.spatial import Delaunay
+from scipy.spatial import Delaunay, ConvexHull, cKDTree
 
 
 # A helper class for using matplotlib.tri.CubicTriInterpolator over a complicated mesh where the default TriFinder doesn't work very well, and scipy.spatial.Delaunay's finder needs to be used.
@@ -41,3 +41,55 @@ class DelaunayTriFinder(TriFinder):
         p = np.array([x,y]).transpose(axes)
         
         return self.delaunay.find_simplex(p)
+
+
+class NearestHullVertexFinder(object):
+    
+    def __init__(self, points):
+        """ Finder of the nearest convex hull vertex of a 2D point set, for points outside the hull.
+        The vertices are stored in a KD-tree, so all the queries are done in one vectorized call.
+        
+        :param points: coordinates of the point set, the last dimension is the 2 coordinates
+        :type points: numpy array of float, shape (N, 2)
+        """
+        self.points = np.asarray(points)
+        self.hull = ConvexHull(self.points)
+        self.vertices = self.hull.vertices
+        self.tree = cKDTree(self.points[self.vertices])
+        
+    def __call__(self, x, y):
+        """ find the nearest hull vertex for each specified point
+            :param x: first coordinates of specified points
+            :type x: numpy array of float
+            :param y: second coordinates of specified points
+            :type y: numpy array of float
+            :return n: indices in the original point set of the nearest vertices, same shape as *x*
+            :rtype n: numpy array of int
+        """
+        
+        assert np.shape(x) == np.shape(y)
+        
+        p = np.stack([np.asarray(x), np.asarray(y)], axis=-1)
+        
+        dist, nearest = self.tree.query(p)
+        
+        return self.vertices[nearest]
+
+
+def nodes_in_box(points, wanted, margin=0):
+    """ find the nodes inside the bounding box of the wanted points, used to crop a simulation mesh to the region a diagnostic needs
+    
+    :param points: coordinates of the mesh nodes
+    :type points: numpy array of float, shape (N, ndim)
+    :param wanted: coordinates of the points where values are wanted
+    :type wanted: numpy array of float, shape (M, ndim)
+    :param float margin: the bounding box is enlarged by *margin* on every side, so the triangles containing the wanted points near the box boundary are kept
+    :return nodes: sorted indices of the nodes inside the enlarged box
+    :rtype nodes: numpy array of int
+    """
+    points = np.asarray(points)
+    wanted = np.asarray(wanted)
+    lower = np.min(wanted, axis=0) - margin
+    upper = np.max(wanted, axis=0) + margin
+    inside = np.all((points >= lower) & (points <= upper), axis=1)
+    return np.nonzero(inside)[0]
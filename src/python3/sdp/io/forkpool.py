@@ -0,0 +1,128 @@
+"""Pools of worker processes forked from the current process
+
+Some parallel work can not be sent to worker processes by pickling: the
+inputs are large arrays, or the state lives in the globals of a compiled
+extension, e.g. the parameters of Map_Mod_C. The workers of
+:py:class:`ForkPool` are forked when the pool is created, so they inherit the
+objects given as the pool *context*, and the whole state of this process at
+that moment. Results can be written by the workers directly into arrays
+created by :py:func:`shared_zeros` before the pool, instead of being pickled
+back.
+
+Example::
+
+    out = shared_zeros((n_points, n_column))
+    with ForkPool(4, values=values, out=out) as pool:
+        pool.map(interpolate_block, [(start, stop) for start, stop in blocks])
+
+where the module level function ``interpolate_block(context, start, stop)``
+writes into ``context['out'][:, start:stop]``.
+"""
+import mmap
+import itertools
+import multiprocessing as mp
+
+import numpy as np
+
+# contexts of the open pools, inherited by their workers
+_contexts = {}
+_pool_ids = itertools.count()
+
+
+def fork_available():
+    """return True if worker processes can be forked on this platform
+    """
+    return 'fork' in mp.get_all_start_methods()
+
+
+def shared_zeros(shape, dtype=np.float64):
+    """return a zero filled array in anonymous shared memory
+
+    Worker processes forked after the array is created use the same memory,
+    so values written by them are seen by this process. The memory is
+    released when the array is deleted in all processes.
+
+    :param shape: shape of the array
+    :type shape: tuple of int
+    :param dtype: data type of the array
+    """
+    dtype = np.dtype(dtype)
+    size = int(np.prod(shape))
+    buf = mmap.mmap(-1, max(size*dtype.itemsize, 1))
+    return np.frombuffer(buf, dtype=dtype, count=size).reshape(shape)
+
+
+def _call(args):
+    """worker side of :py:class:`ForkPool`, call the function with the
+    inherited context of its pool
+    """
+    pool_id, func, func_args = args
+    return func(_contexts[pool_id], *func_args)
+
+
+class ForkPool(object):
+    """Pool of worker processes forked from the current process
+
+    __init__(n_workers, **context)
+
+    The functions run by the pool are module level functions called as
+    ``func(context, *args)``. Their *args* and returned values are pickled,
+    the *context* is inherited through fork. Changes made to the context
+    after the pool is created are not seen by the workers, except for the
+    values in arrays created by :py:func:`shared_zeros`.
+
+    If *n_workers* is 1 or less, or fork is not available on the platform,
+    no process is created, and the functions are called in this process.
+
+    :param int n_workers: number of worker processes
+    :param context: objects used by the functions run by the pool
+    :var bool parallel: True if worker processes are used
+    """
+
+    def __init__(self, n_workers, **context):
+        self.n_workers = n_workers
+        self.context = context
+        self.parallel = n_workers > 1 and fork_available()
+        self._pool = None
+        if self.parallel:
+            self._id = next(_pool_ids)
+            _contexts[self._id] = context
+            self._pool = mp.get_context('fork').Pool(n_workers)
+
+    def _tasks(self, func, args_list):
+        return [(self._id, func, tuple(args)) for args in args_list]
+
+    def map(self, func, args_list):
+        """call *func* for each *args* in *args_list*
+
+        :return: returned values, in the order of *args_list*
+        :rtype: list
+        """
+        if not self.parallel:
+            return [func(self.context, *args) for args in args_list]
+        return self._pool.map(_call, self._tasks(func, args_list), chunksize=1)
+
+    def imap_unordered(self, func, args_list):
+        """call *func* for each *args* in *args_list*, and iterate over the
+        returned values in the order the calls finish
+        """
+        if not self.parallel:
+            return (func(self.context, *args) for args in args_list)
+        return self._pool.imap_unordered(_call,
+                                         self._tasks(func, args_list))
+
+    def close(self):
+        """wait for the running calls, and shut down the workers
+        """
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+            _contexts.pop(self._id, None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
@@ -0,0 +1,83 @@
+"""Prefetching readers for series of output files
+
+Simulation outputs are usually one file per time step. Reading them one after
+another serializes the I/O with the processing of each step.
+:py:class:`PrefetchReader` keeps the next few reads in flight on a background
+pool, so the reading of later steps overlaps with the processing of the
+current one, and parallel filesystems can serve several reads at once.
+
+Example::
+
+    reader = PrefetchReader(load_step, [(fname,) for fname in files],
+                            n_prefetch=4)
+    for data in reader:
+        process(data)
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+
+class PrefetchReader(object):
+    """Iterate over ``read_func(*args)`` for each *args* in *args_list*, in
+    order, with up to *n_prefetch* reads running ahead on a background pool
+
+    __init__(read_func, args_list, n_prefetch=2, max_workers=None,
+             use_processes=False)
+
+    :param read_func: function that reads one item, e.g. one time step file
+    :param args_list: sequence of argument tuples for *read_func*
+    :param int n_prefetch: number of reads kept in flight ahead of the
+                           consumer. If 0, items are read synchronously when
+                           requested.
+    :param int max_workers: Optional, number of background workers. Default to
+                            be *n_prefetch*.
+    :param bool use_processes: If True, a process pool is used, *read_func*
+                               and its results must be picklable. Useful when
+                               the reading itself holds the GIL, e.g. HDF5
+                               decompression through h5py. Default to be
+                               False, a thread pool is used.
+    """
+
+    def __init__(self, read_func, args_list, n_prefetch=2, max_workers=None,
+                 use_processes=False):
+        assert n_prefetch >= 0
+        self.read_func = read_func
+        self.args_list = list(args_list)
+        self.n_prefetch = n_prefetch
+        if max_workers is None:
+            max_workers = max(n_prefetch, 1)
+        self.max_workers = max_workers
+        self.use_processes = use_processes
+
+    def __len__(self):
+        return len(self.args_list)
+
+    def __iter__(self):
+        if self.n_prefetch == 0:
+            for args in self.args_list:
+                yield self.read_func(*args)
+            return
+        if self.use_processes:
+            executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        else:
+            executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        pending = deque()
+        next_item = 0
+        try:
+            while next_item < len(self.args_list) and \
+                  len(pending) < self.n_prefetch:
+                pending.append(executor.submit(self.read_func,
+                                               *self.args_list[next_item]))
+                next_item += 1
+            while pending:
+                result = pending.popleft().result()
+                if next_item < len(self.args_list):
+                    pending.append(executor.submit(self.read_func,
+                                                *self.args_list[next_item]))
+                    next_item += 1
+                yield result
+        finally:
+            # stopped early or failed, drop the reads not started yet
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
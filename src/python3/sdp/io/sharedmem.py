@@ -0,0 +1,93 @@
+"""Map shared memory blocks by name
+
+:py:class:`multiprocessing.shared_memory.SharedMemory` ties the mapping of a
+block to the SharedMemory object, which can not be closed while arrays still
+use the mapping. Before Python 3.13, every process opening a block also
+registers it with its resource tracker, and a process with its own tracker
+unlinks the block when it exits. :py:func:`attach_memory` returns a mapping
+that stays valid exactly as long as any view of it, and on Linux the block is
+mapped from ``/dev/shm`` without touching the resource tracker at all.
+
+Example::
+
+    shm = create_memory(nbytes)
+    # in any process on this machine
+    buf = attach_memory(shm.name)
+    data = np.ndarray(shape, dtype=dtype, buffer=buf)
+    # in the creating process, when no new process needs to attach
+    shm.unlink()
+"""
+import os
+import mmap
+import multiprocessing as mp
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+# POSIX shared memory blocks are files in this directory on Linux
+_SHM_DIR = '/dev/shm'
+
+
+class _AttachedMemory(object):
+    """Owner of a SharedMemory object, exposing its mapping as an array
+
+    Arrays and memoryviews created from it keep the owner alive, so the
+    SharedMemory object is only closed when none of them is left.
+    """
+
+    def __init__(self, shm):
+        self._shm = shm
+        view = np.frombuffer(shm.buf, dtype=np.uint8)
+        self.__array_interface__ = dict(view.__array_interface__)
+        del view
+
+    def __del__(self):
+        self._shm.close()
+
+
+def create_memory(nbytes):
+    """create a new shared memory block
+
+    The returned SharedMemory object is already closed, it is only used for
+    the name of the block, and to unlink it. Use :py:func:`attach_memory` to
+    access the data.
+
+    :param int nbytes: size of the block in bytes
+    :rtype: :py:class:`multiprocessing.shared_memory.SharedMemory`
+    """
+    shm = SharedMemory(create=True, size=max(nbytes, 1))
+    shm.close()
+    return shm
+
+
+def attach_memory(name, owner=False):
+    """map an existing shared memory block without taking ownership of it
+
+    :param string name: name of the block
+    :param bool owner: True if called in the process that created the block.
+                       Only used before Python 3.13 on platforms without
+                       ``/dev/shm``, where the block has to be removed from
+                       the resource tracker of other independent processes.
+
+    :return: a new writable mapping of the whole block. The mapping is
+             released when the last view of it is deleted.
+    :rtype: memoryview
+    """
+    if os.path.isdir(_SHM_DIR):
+        fd = os.open(os.path.join(_SHM_DIR, name.lstrip('/')), os.O_RDWR)
+        try:
+            return memoryview(mmap.mmap(fd, 0))
+        finally:
+            os.close(fd)
+    try:
+        # Python 3.13 and later
+        shm = SharedMemory(name=name, track=False)
+    except TypeError:
+        shm = SharedMemory(name=name)
+        # Processes started by multiprocessing share the tracker of their
+        # parent, removing the block there would also remove the
+        # registration of the creating process.
+        if not owner and mp.parent_process() is None:
+            resource_tracker.unregister(shm._name, 'shared_memory')
+    return memoryview(np.asarray(_AttachedMemory(shm)))
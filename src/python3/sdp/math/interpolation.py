@@ -1,8 +1,11 @@
 """This module contains some useful interpolation methods
 """
 
+from itertools import product
+
 import numpy as np
-from scipy.interpolate import BarycentricInterpolator
+from scipy.interpolate import BarycentricInterpolator, make_interp_spline
+from scipy.sparse import csr_matrix
 
 class InterpolationError(Exception):
     def __init__(self,value):
@@ -143,6 +146,38 @@ def trilinear_interp(X,Y,Z,F,x, fill_value=0.0):
         raise NameError('Error: wrong shape of the position to interpolate')
         
 
+def barycentric_matrix(delaunay, xi):
+    """ Sparse matrix of the linear (barycentric) interpolation on a Delaunay
+    triangulation
+    
+    The simplex lookup and the barycentric weights are calculated once for all
+    the points *xi*. Values at the triangulation nodes are then interpolated 
+    by a matrix product, ``M.dot(values)``, where *values* has shape 
+    (npoints, ...). Any number of quantities and time steps can be stacked in 
+    the trailing dimensions. Points outside the convex hull get 0.
+    
+    Arguments:
+    delaunay -- :py:class:`scipy.spatial.Delaunay` object
+    xi -- coordinates of the wanted points, shape (n, ndim)
+
+    return value:
+    :py:class:`scipy.sparse.csr_matrix` of shape (n, delaunay.npoints)
+    """
+    xi = np.asarray(xi, dtype=float)
+    ndim = delaunay.ndim
+    simplex = delaunay.find_simplex(xi)
+    inside = simplex >= 0
+    transform = delaunay.transform[simplex[inside]]
+    bary = np.einsum('ijk,ik->ij', transform[:, :ndim, :],
+                     xi[inside] - transform[:, ndim, :])
+    weights = np.concatenate([bary, 1-bary.sum(axis=1, keepdims=True)], 
+                             axis=1)
+    rows = np.repeat(np.nonzero(inside)[0], ndim+1)
+    cols = delaunay.simplices[simplex[inside]].ravel()
+    return csr_matrix((weights.ravel(), (rows, cols)), 
+                      shape=(len(xi), delaunay.npoints))
+        
+
 # BarycentricInterpolator with boundary check
 class BoundaryWarnBarycentricInterpolator(BarycentricInterpolator):
     """Barycentric Interpolator with Boundary Check. Based on 
@@ -207,6 +242,466 @@ class BoundaryWarnBarycentricInterpolator(BarycentricInterpolator):
         if not self._bound_error:
             assert yi.ndim == 1
         super(BoundaryWarnBarycentricInterpolator, self).set_yi(yi, axis)
-        
 
-            
\ No newline at end of file
+
+class GridStencil(object):
+    """Precompiled interpolation stencil for a fixed set of points on a grid
+
+    Created by :py:meth:`StackedGridInterpolator.compile_stencil`. The stencil
+    indices and weights are stored as a sparse matrix, so interpolating any
+    field, or any time step, on these points is one sparse matrix-vector
+    product. A stencil can be passed to any interpolator of the same class on
+    the same grid in place of the points.
+
+    :var matrix: interpolation matrix, shape ``(npoints, grid size)``
+    :vartype matrix: :py:class:`scipy.sparse.csr_matrix`
+    :var gradient_matrices: derivative matrices along each dimension, None if
+                            the stencil is compiled without gradient.
+    :var shape: shape of the point set, without the last *dim* axis
+    :var out_of_bounds: bool array marking the out of bound points
+    """
+
+    def __init__(self, interpolator, matrix, out_of_bounds, shape,
+                 gradient_matrices=None):
+        self.interp_class = type(interpolator)
+        self.grid = interpolator.grid
+        self.matrix = matrix
+        self.out_of_bounds = out_of_bounds
+        self.shape = tuple(shape)
+        self.gradient_matrices = gradient_matrices
+
+    @property
+    def npoints(self):
+        return self.matrix.shape[0]
+
+    def is_compatible(self, interpolator):
+        """check if the stencil can be used by *interpolator*
+        """
+        if type(interpolator) is not self.interp_class:
+            return False
+        if len(interpolator.grid) != len(self.grid):
+            return False
+        for g1, g2 in zip(interpolator.grid, self.grid):
+            if not (g1 is g2 or np.array_equal(g1, g2)):
+                return False
+        return True
+
+
+class StackedGridInterpolator(object):
+    """Multilinear interpolator for a stack of fields sharing one regular grid.
+
+    Typical use is a time series of fluctuations, where all time steps are
+    given on the same grid. The cell indices and the linear weights of the
+    requested points are calculated only once, and then applied to all the
+    chosen fields in a single vectorized contraction. For a single field, the
+    result is the same as :py:class:`scipy.interpolate.RegularGridInterpolator`
+    with 'linear' method.
+
+    __init__(points, values, bounds_error=True, fill_value=np.nan)
+
+    :param points: 1D coordinates of the grid along each dimension. Each one
+                   must be strictly ascending or strictly descending.
+    :type points: tuple of *dim* 1D arrays
+    :param values: field values on the grid. If ``values.ndim == dim``, it is a
+                   single field. If ``values.ndim == dim+1``, the first axis is
+                   the stack axis, e.g. time.
+    :type values: ndarray, or array-like stack readable one field at a time,
+                  e.g. :py:class:`sdp.plasma.storage.TimeSeriesStorage`
+    :param bool bounds_error: If True, out of bound points will raise a
+                              ValueError. Otherwise fill_value is used.
+    :param float fill_value: value used for out of bound points when
+                             bounds_error is False.
+    """
+
+    # minimum number of grid points along each dimension
+    _min_points = 2
+
+    def __init__(self, points, values, bounds_error=True, fill_value=np.nan):
+        self.grid = tuple([np.asarray(p, dtype=float) for p in points])
+        self.ndim = len(self.grid)
+        self.grid_shape = tuple([len(p) for p in self.grid])
+        self.bounds_error = bounds_error
+        self.fill_value = fill_value
+
+        self._descending = []
+        self._ascending_grid = []
+        for i, p in enumerate(self.grid):
+            if p.ndim != 1 or len(p) < self._min_points:
+                raise ValueError('There are {} points in dimension {}, at \
+least {} points are required.'.format(p.size, i, self._min_points))
+            dp = np.diff(p)
+            if np.all(dp > 0):
+                self._descending.append(False)
+                self._ascending_grid.append(p)
+            elif np.all(dp < 0):
+                self._descending.append(True)
+                self._ascending_grid.append(p[::-1])
+            else:
+                raise ValueError('The points in dimension {} must be strictly \
+ascending or descending.'.format(i))
+        # strides of each dimension in the flattened grid
+        self._strides = np.cumprod((self.grid_shape[1:] + (1,))[::-1])[::-1]
+        self.values = values
+
+    @property
+    def values(self):
+        return self._values
+
+    @values.setter
+    def values(self, values):
+        if tuple(values.shape) == self.grid_shape:
+            self.stacked = False
+        elif tuple(values.shape[1:]) == self.grid_shape:
+            self.stacked = True
+        else:
+            raise ValueError('values shape {} is not compatible with grid \
+shape {}.'.format(values.shape, self.grid_shape))
+        self._values = values
+        self._coefficients = self._prefilter(values)
+
+    def _prefilter(self, values):
+        """return the coefficients to be contracted with the stencil weights.
+        For linear interpolation, they are the values themselves.
+        """
+        return values
+
+    def _check_points(self, xi):
+        """reshape xi into (npoints, dim), and find the out of bound points
+        """
+        xi = np.asarray(xi, dtype=float)
+        if xi.shape[-1] != self.ndim:
+            raise ValueError('The requested points have dimension {}, but the \
+grid has dimension {}.'.format(xi.shape[-1], self.ndim))
+        xi = xi.reshape(-1, self.ndim)
+        out_of_bounds = np.zeros(xi.shape[0], dtype=bool)
+        for i, grid in enumerate(self._ascending_grid):
+            out = ~((xi[:, i] >= grid[0]) & (xi[:, i] <= grid[-1]))
+            if self.bounds_error and np.any(out):
+                raise ValueError('One of the requested xi is out of bounds in \
+dimension {}'.format(i))
+            out_of_bounds |= out
+        return xi, out_of_bounds
+
+    def _axis_stencil(self, i, x):
+        """return the grid indices, weights, and derivative weights along
+        dimension *i* for coordinates *x*. Each has shape (nw, npoints).
+        """
+        grid = self._ascending_grid[i]
+        n = len(grid)
+        idx = np.searchsorted(grid, x) - 1
+        idx = np.clip(idx, 0, n-2)
+        h = grid[idx+1] - grid[idx]
+        w = (x - grid[idx])/h
+        if self._descending[i]:
+            indices = np.array([n-1-idx, n-2-idx])
+        else:
+            indices = np.array([idx, idx+1])
+        weights = np.array([1-w, w])
+        dweights = np.array([-1/h, 1/h])
+        return indices, weights, dweights
+
+    def _stencil(self, xi, gradient=False):
+        """calculate the stencil for points xi
+
+        :return: (indices, weights, dweights, out_of_bounds), dweights is None
+                 if gradient is False, otherwise it has shape
+                 ``(dim, nstencil, npoints)``.
+        """
+        xi, out_of_bounds = self._check_points(xi)
+        axis_stencils = [self._axis_stencil(i, xi[:, i])
+                         for i in range(self.ndim)]
+        nw = [len(st[0]) for st in axis_stencils]
+        nstencil = int(np.prod(nw))
+        npoints = xi.shape[0]
+        indices = np.zeros((nstencil, npoints), dtype=np.intp)
+        weights = np.ones((nstencil, npoints))
+        if gradient:
+            dweights = np.ones((self.ndim, nstencil, npoints))
+        else:
+            dweights = None
+        for c, corner in enumerate(product(*[range(n) for n in nw])):
+            for i, a in enumerate(corner):
+                ind, w, dw = axis_stencils[i]
+                indices[c] += ind[a]*self._strides[i]
+                weights[c] *= w[a]
+                if gradient:
+                    for j in range(self.ndim):
+                        if j == i:
+                            dweights[j, c] *= dw[a]
+                        else:
+                            dweights[j, c] *= w[a]
+        weights[:, out_of_bounds] = 0
+        if gradient:
+            dweights[:, :, out_of_bounds] = 0
+        return indices, weights, dweights, out_of_bounds
+
+    def find_stencil(self, xi):
+        """calculate the stencil indices and weights for given points
+
+        :param xi: points to interpolate, last axis has length *dim*
+        :type xi: ndarray of shape (..., dim)
+
+        :return: (indices, weights, out_of_bounds). indices and weights have
+                 shape ``(nstencil, npoints)``, indices are the flattened grid
+                 indices of the stencil points, ``nstencil = 2**dim`` for
+                 linear interpolation. out_of_bounds is a bool array of shape
+                 ``(npoints, )``.
+        :raises ValueError: if any point is out of bound and
+                            ``bounds_error`` is True.
+        """
+        indices, weights, dweights, out_of_bounds = self._stencil(xi)
+        return indices, weights, out_of_bounds
+
+    def __call__(self, xi, index=None):
+        """interpolate the stacked fields at xi
+
+        :param xi: points to interpolate, last axis has length *dim*
+        :type xi: ndarray of shape (..., dim)
+        :param index: Optional, chosen fields in the stack. If None, all fields
+                      are used. Must be None if values is not stacked.
+        :type index: int or 1D array of int
+
+        :return: interpolated values. Shape is ``(nidx, ...)`` if index is 1D
+                 or None, ``(...)`` if index is scalar or values not stacked.
+        """
+        if isinstance(xi, GridStencil):
+            self._check_stencil(xi)
+            return self._apply_matrix(xi.matrix, xi.out_of_bounds, xi.shape,
+                                      index)
+        xi = np.asarray(xi)
+        shape = xi.shape[:-1]
+        indices, weights, dweights, out_of_bounds = self._stencil(xi)
+        return self._evaluate(indices, weights, out_of_bounds, shape, index)
+
+    def value_and_gradient(self, xi, index=None):
+        """interpolate the stacked fields and their gradients at xi
+
+        Both are calculated from the same stencil.
+
+        :param xi: points to interpolate, last axis has length *dim*
+        :type xi: ndarray of shape (..., dim)
+        :param index: Optional, chosen fields in the stack. See
+                      :py:meth:`__call__`.
+        :type index: int or 1D array of int
+
+        :return: (values, gradient), values is the same as returned by
+                 :py:meth:`__call__`. gradient has an additional first axis
+                 of length *dim*, containing the derivatives along each
+                 dimension in the order of *points*.
+        """
+        if isinstance(xi, GridStencil):
+            self._check_stencil(xi)
+            if xi.gradient_matrices is None:
+                raise ValueError('Stencil is compiled without gradient.')
+            values = self._apply_matrix(xi.matrix, xi.out_of_bounds, xi.shape,
+                                        index)
+            gradient = np.array([self._apply_matrix(m, xi.out_of_bounds,
+                                                    xi.shape, index)
+                                 for m in xi.gradient_matrices])
+            return values, gradient
+        xi = np.asarray(xi)
+        shape = xi.shape[:-1]
+        indices, weights, dweights, out_of_bounds = self._stencil(xi, True)
+        values = self._evaluate(indices, weights, out_of_bounds, shape, index)
+        gradient = np.array([self._evaluate(indices, dw, out_of_bounds, shape,
+                                            index) for dw in dweights])
+        return values, gradient
+
+    def compile_stencil(self, xi, gradient=False):
+        """compile the points xi into a reusable :py:class:`GridStencil`
+
+        :param xi: points to interpolate, last axis has length *dim*
+        :type xi: ndarray of shape (..., dim)
+        :param bool gradient: if True, the derivative matrices are also
+                              compiled, so the stencil can be used with
+                              :py:meth:`value_and_gradient`.
+
+        :return: stencil that can be passed in place of xi
+        :rtype: :py:class:`GridStencil`
+        """
+        xi = np.asarray(xi)
+        shape = xi.shape[:-1]
+        indices, weights, dweights, out_of_bounds = self._stencil(xi,
+                                                                  gradient)
+        npoints = indices.shape[1]
+        rows = np.broadcast_to(np.arange(npoints), indices.shape).ravel()
+        cols = indices.ravel()
+        matrix_shape = (npoints, int(np.prod(self.grid_shape)))
+        matrix = csr_matrix((weights.ravel(), (rows, cols)),
+                            shape=matrix_shape)
+        if gradient:
+            gradient_matrices = [csr_matrix((dw.ravel(), (rows, cols)),
+                                            shape=matrix_shape)
+                                 for dw in dweights]
+        else:
+            gradient_matrices = None
+        return GridStencil(self, matrix, out_of_bounds, shape,
+                           gradient_matrices)
+
+    def _check_stencil(self, stencil):
+        if not stencil.is_compatible(self):
+            raise ValueError('Stencil is compiled for another interpolator \
+class or grid.')
+
+    def _check_index(self, index):
+        """return chosen fields as a 1D array, and if index is scalar
+        """
+        if not self.stacked:
+            if index is not None:
+                raise ValueError('index can only be used with stacked values.')
+            return None, True
+        if index is None:
+            index = np.arange(self._coefficients.shape[0])
+        index = np.asarray(index)
+        if index.ndim > 1:
+            raise ValueError('index can only be int or 1D array of int.')
+        return np.atleast_1d(index), index.ndim == 0
+
+    def _apply_matrix(self, matrix, out_of_bounds, shape, index):
+        """interpolate the chosen fields with a compiled sparse matrix, one
+        matrix-vector product for each field
+        """
+        coeffs = self._coefficients
+        steps, scalar = self._check_index(index)
+        if steps is None:
+            result = matrix.dot(np.ravel(coeffs))
+        else:
+            result = np.empty((len(steps), matrix.shape[0]),
+                              dtype=np.result_type(coeffs.dtype, matrix.dtype))
+            for i, t in enumerate(steps):
+                result[i] = matrix.dot(np.ravel(coeffs[t]))
+            if scalar:
+                result = result[0]
+            else:
+                shape = (len(steps),) + tuple(shape)
+        if np.any(out_of_bounds):
+            result[..., out_of_bounds] = self.fill_value
+        return result.reshape(shape)
+
+    def _evaluate(self, indices, weights, out_of_bounds, shape, index):
+        """contract the stencil with the chosen fields
+        """
+        coeffs = self._coefficients
+        steps, scalar = self._check_index(index)
+        if steps is None:
+            flat = np.ravel(coeffs)
+            result = np.sum(flat[indices]*weights, axis=0)
+            result_shape = shape
+        else:
+            if isinstance(coeffs, np.ndarray):
+                flat = coeffs.reshape(coeffs.shape[0], -1)
+                corner_values = flat[np.ix_(steps, indices.ravel())]
+                corner_values = corner_values.reshape((-1,) + indices.shape)
+                result = np.einsum('tkn,kn->tn', corner_values, weights)
+            else:
+                # array-like storage read on demand, e.g.
+                # :py:class:`sdp.plasma.storage.TimeSeriesStorage`, only the
+                # chosen fields are read, one at a time.
+                result = np.empty((len(steps), indices.shape[1]),
+                                  dtype=np.result_type(coeffs.dtype,
+                                                       weights.dtype))
+                for i, t in enumerate(steps):
+                    flat = np.ravel(coeffs[t])
+                    result[i] = np.sum(flat[indices]*weights, axis=0)
+            if scalar:
+                result = result[0]
+                result_shape = shape
+            else:
+                result_shape = (len(steps),) + shape
+        if np.any(out_of_bounds):
+            result[..., out_of_bounds] = self.fill_value
+        return result.reshape(result_shape)
+
+
+def cubic_bspline_basis(t, x):
+    """values and first derivatives of the non-zero cubic B-spline basis
+    functions on knots *t* at locations *x*
+
+    The Cox-de Boor recursion is carried out for all locations at once.
+
+    :param t: knots, ascending
+    :type t: 1D array of float
+    :param x: locations, should be within ``[t[3], t[-4]]``
+    :type x: 1D array of float
+
+    :return: (first, basis, dbasis). first is the index of the first non-zero
+             basis function at each location, shape ``(npoints,)``. basis and
+             dbasis are the values and derivatives of the 4 non-zero basis
+             functions ``first, first+1, first+2, first+3``, shape
+             ``(4, npoints)``.
+    """
+    k = 3
+    t = np.asarray(t, dtype=float)
+    x = np.asarray(x, dtype=float)
+    nbasis = len(t) - k - 1
+    m = np.searchsorted(t, x, side='right') - 1
+    m = np.clip(m, k, nbasis-1)
+    npoints = len(x)
+    left = np.empty((k+1, npoints))
+    right = np.empty((k+1, npoints))
+    basis = np.zeros((k+1, npoints))
+    basis[0] = 1
+    for j in range(1, k+1):
+        if j == k:
+            # keep degree k-1 basis for derivatives
+            lower = basis[:k].copy()
+        left[j] = x - t[m+1-j]
+        right[j] = t[m+j] - x
+        saved = np.zeros(npoints)
+        for r in range(j):
+            temp = basis[r]/(right[r+1] + left[j-r])
+            basis[r] = saved + right[r+1]*temp
+            saved = left[j-r]*temp
+        basis[j] = saved
+    # derivative of degree k basis from degree k-1 basis:
+    # N_i' = k*(N_{i,k-1}/(t_{i+k}-t_i) - N_{i+1,k-1}/(t_{i+k+1}-t_{i+1}))
+    first = m - k
+    dbasis = np.zeros((k+1, npoints))
+    for a in range(k+1):
+        i = first + a
+        if a > 0:
+            dbasis[a] += k*lower[a-1]/(t[i+k] - t[i])
+        if a < k:
+            dbasis[a] -= k*lower[a]/(t[i+k+1] - t[i+1])
+    return first, basis, dbasis
+
+
+class CubicSplineGridInterpolator(StackedGridInterpolator):
+    """Tensor product cubic B-spline interpolator for a stack of fields on one
+    regular grid.
+
+    The B-spline coefficients are calculated once at creation, with
+    not-a-knot end conditions along each dimension. Each evaluation then only
+    needs the 4**dim non-zero basis functions around each point, which also
+    give the gradients without another search. Use
+    :py:meth:`value_and_gradient` to get both in one call.
+
+    Arguments and returned shapes are the same as
+    :py:class:`StackedGridInterpolator`. Grids can be non-uniform, and at least
+    4 points are required in each dimension. Array-like storages are loaded
+    into memory at creation.
+
+    __init__(points, values, bounds_error=True, fill_value=np.nan)
+    """
+
+    _min_points = 4
+
+    def _prefilter(self, values):
+        """calculate the B-spline coefficients on the ascending grids
+        """
+        offset = 1 if self.stacked else 0
+        coeffs = np.asarray(values)
+        self._knots = []
+        for i, grid in enumerate(self._ascending_grid):
+            axis = i + offset
+            if self._descending[i]:
+                coeffs = np.flip(coeffs, axis=axis)
+            spl = make_interp_spline(grid, coeffs, k=3, axis=axis)
+            coeffs = np.moveaxis(spl.c, 0, axis)
+            self._knots.append(spl.t)
+        return np.ascontiguousarray(coeffs)
+
+    def _axis_stencil(self, i, x):
+        first, basis, dbasis = cubic_bspline_basis(self._knots[i], x)
+        indices = first + np.arange(4)[:, np.newaxis]
+        return indices, basis, dbasis
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""
+This module provides an on-disk cache of interpolated plasma profiles.
+
+Simulation loaders read the raw output files and interpolate them onto the
+requested grid every time a profile is created. :py:class:`ProfileCache`
+stores the resulting :py:class:`..profile.ECEI_Profile` arrays in a HDF5 file,
+one file per set of inputs. The key of a cached profile is the hash of
+
+    * the size and modification time of the source files
+    * the coordinates of the grid
+    * the loader options that change the interpolated values
+
+so a cached profile is used only when none of these have changed.
+Perturbed quantities are chunked with one time step per chunk, and by default
+are read back as :py:class:`..storage.HDF5TimeSeries`, so only the requested
+time steps are read from disk.
+
+Example::
+
+    cache = ProfileCache()
+    loader = GTC_Loader(gtc_path, grid, tsteps)
+    # interpolated on first call, read from the cache afterwards
+    profile = loader.create_profile('ecei2d', cache=cache)
+
+"""
+import os
+import hashlib
+import numbers
+
+import numpy as np
+import h5py as h5
+
+from .profile import ECEI_Profile
+from .storage import HDF5TimeSeries
+
+PROFILE_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.sdp_cache',
+                                 'profiles')
+
+
+def files_signature(fnames):
+    """return a string identifying the current state of files *fnames*
+
+    Only the size and modification time are used, the content is not read.
+    Files that don't exist are marked as missing.
+
+    :param fnames: paths of the source files
+    :type fnames: list of strings
+    """
+    signature = []
+    for fname in sorted(os.path.abspath(f) for f in fnames):
+        if os.path.exists(fname):
+            stat = os.stat(fname)
+            signature.append('{0} {1} {2}'.format(fname, stat.st_size,
+                                                  stat.st_mtime))
+        else:
+            signature.append('{0} missing'.format(fname))
+    return '\n'.join(signature)
+
+
+def grid_signature(grid):
+    """return bytes identifying the type and coordinates of *grid*
+
+    All array and number attributes of the grid are used, so grids of the
+    same type with the same coordinates have the same signature.
+    """
+    sha = hashlib.sha1(type(grid).__name__.encode())
+    for name in sorted(vars(grid)):
+        value = getattr(grid, name)
+        if isinstance(value, np.ndarray) and value.dtype.kind in 'biuf':
+            sha.update(name.encode())
+            sha.update(str(value.shape).encode())
+            sha.update(np.ascontiguousarray(value,
+                                            dtype=np.float64).tobytes())
+        elif isinstance(value, (numbers.Number, str)):
+            sha.update('{0}={1!r}'.format(name, value).encode())
+    return sha.digest()
+
+
+class ProfileCache(object):
+    """On-disk cache of :py:class:`..profile.ECEI_Profile` objects
+
+    __init__(cache_dir=PROFILE_CACHE_DIR, compression='gzip', lazy=True)
+
+    :param string cache_dir: directory where cached profiles are stored,
+                             created if not exist
+    :param compression: compression filter passed to h5py, None for no
+                        compression
+    :param bool lazy: if True, perturbed quantities of loaded profiles are
+                      :py:class:`..storage.HDF5TimeSeries`, read one time step
+                      at a time. Otherwise they are read into memory.
+    :var int hits: number of profiles loaded from the cache
+    :var int misses: number of profiles created and stored
+
+    Methods
+    --------
+
+    key(source_files, grid, options):
+        hash key of the inputs of a profile
+
+    load(key, grid):
+        return the cached profile, or None if it's not cached
+
+    store(key, profile):
+        save *profile* under *key*
+
+    get_or_create(source_files, grid, options, create):
+        return the cached profile, create and store it if not cached
+
+    clear():
+        remove all cached profiles
+    """
+
+    _quantities = ('ne0', 'Te0', 'B0')
+    _perturbed_quantities = ('dne', 'dTe_para', 'dTe_perp', 'dB')
+
+    def __init__(self, cache_dir=PROFILE_CACHE_DIR, compression='gzip',
+                 lazy=True):
+        self.cache_dir = cache_dir
+        self.compression = compression
+        self.lazy = lazy
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, source_files, grid, options):
+        """hash key of the inputs of a profile
+
+        :param source_files: paths of the simulation files the profile is
+                             created from
+        :type source_files: list of strings
+        :param grid: grid on which the profile is created
+        :type grid: :py:class:`...geometry.grid.Grid` derived class
+        :param options: loader options that affect the profile values, their
+                        ``repr`` is hashed
+        :return: hex digest
+        :rtype: string
+        """
+        sha = hashlib.sha1()
+        sha.update(files_signature(source_files).encode())
+        sha.update(grid_signature(grid))
+        sha.update(repr(options).encode())
+        return sha.hexdigest()
+
+    def filename(self, key):
+        """path of the cache file for *key*
+        """
+        return os.path.join(self.cache_dir, '{0}.h5'.format(key))
+
+    def __contains__(self, key):
+        return os.path.exists(self.filename(key))
+
+    def load(self, key, grid):
+        """return the profile cached under *key*, or None if it's not cached
+
+        :param string key: hash key from :py:meth:`key`
+        :param grid: grid of the profile, it is not stored in the cache
+        """
+        fname = self.filename(key)
+        if not os.path.exists(fname):
+            return None
+        kwargs = {}
+        with h5.File(fname, 'r') as f:
+            for name in self._quantities:
+                kwargs[name] = f[name][()]
+            if 'time' in f:
+                kwargs['time'] = f['time'][()]
+            for name in self._perturbed_quantities:
+                if name in f and not self.lazy:
+                    kwargs[name] = f[name][()]
+            interp_method = f.attrs['interp_method']
+            if isinstance(interp_method, bytes):
+                interp_method = interp_method.decode()
+            perturbed = [name for name in self._perturbed_quantities
+                         if name in f]
+        if self.lazy:
+            for name in perturbed:
+                kwargs[name] = HDF5TimeSeries(fname, name)
+        self.hits += 1
+        return ECEI_Profile(grid, interp_method=interp_method, **kwargs)
+
+    def store(self, key, profile):
+        """save *profile* under *key*
+
+        The file is written under a temporary name first, so an interrupted
+        write never leaves a partial cache entry.
+
+        :param string key: hash key from :py:meth:`key`
+        :param profile: the profile to be cached
+        :type profile: :py:class:`..profile.ECEI_Profile`
+        """
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        fname = self.filename(key)
+        tmp_fname = '{0}.{1}.tmp'.format(fname, os.getpid())
+        try:
+            with h5.File(tmp_fname, 'w') as f:
+                f.attrs['interp_method'] = profile.interp_method
+                for name in self._quantities:
+                    f.create_dataset(name, data=np.asarray(getattr(profile,
+                                                                   name)),
+                                     compression=self.compression)
+                written = {}
+                for name in self._perturbed_quantities:
+                    if not getattr(profile, 'has_' + name):
+                        continue
+                    data = getattr(profile, name)
+                    if 'time' not in f:
+                        f.create_dataset('time', data=np.asarray(profile.time))
+                    # the same array used for several quantities, e.g.
+                    # isotropic temperature perturbation, is stored once
+                    if id(data) in written:
+                        f[name] = f[written[id(data)]]
+                        continue
+                    shape = tuple(data.shape)
+                    dset = f.create_dataset(name, shape=shape,
+                                            dtype=data.dtype,
+                                            chunks=(1,)+shape[1:],
+                                            compression=self.compression)
+                    for t in range(shape[0]):
+                        dset[t] = data[t]
+                    written[id(data)] = name
+            os.replace(tmp_fname, fname)
+        finally:
+            if os.path.exists(tmp_fname):
+                os.remove(tmp_fname)
+        self.misses += 1
+
+    def get_or_create(self, source_files, grid, options, create):
+        """return the cached profile, create and store it if not cached
+
+        :param source_files: paths of the simulation files the profile is
+                             created from
+        :param grid: grid on which the profile is created
+        :param options: loader options that affect the profile values
+        :param create: function creates the profile, called without arguments
+                       only when the profile is not cached
+        """
+        key = self.key(source_files, grid, options)
+        profile = self.load(key, grid)
+        if profile is None:
+            profile = create()
+            self.store(key, profile)
+        return profile
+
+    def clear(self):
+        """remove all cached profiles
+        """
+        if not os.path.exists(self.cache_dir):
+            return
+        for fname in os.listdir(self.cache_dir):
+            if fname.endswith('.h5'):
+                os.remove(os.path.join(self.cache_dir, fname))
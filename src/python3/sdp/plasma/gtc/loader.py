@@ -16,19 +16,25 @@ import json
 import re
 import os
 import warnings
+from collections import OrderedDict
 
 import numpy as np
-from scipy.spatial import Delaunay, ConvexHull
-from scipy.interpolate import LinearNDInterpolator, interp1d
+import h5py as h5
+from scipy.spatial import Delaunay
+from scipy.interpolate import interp1d
 from matplotlib.tri import triangulation 
 from matplotlib.tri import LinearTriInterpolator as linear_interp
 
 from ...geometry.grid import Cartesian2D, Cartesian3D
-from ...geometry.support import DelaunayTriFinder
+from ...geometry.support import DelaunayTriFinder, NearestHullVertexFinder, \
+                               nodes_in_box
 from ...io import f90nml
+from ...io.prefetch import PrefetchReader
 from ...math.funcs import poly2_curve
+from ...math.interpolation import barycentric_matrix
 from ...diagnostic.availdiags import Available_Diagnostics
 from ..profile import ECEI_Profile, IonClass
+from ..storage import ComputedTimeSeries
 from ...settings.exception import PlasmaError, PlasmaWarning
 from ...settings.unitsystem import cgs
 
@@ -53,6 +59,9 @@ GTC_to_cgs = {
         # normalization is explicitly done in interpolate_fluc_2D method
     'pressure': 1}
 
+# name of the binary snapshot store created by :py:func:`convert_snapshots`
+SNAPSHOT_STORE = 'snapshots_fpsdp.h5'
+
 class GTC_Loader_Error(PlasmaError):
     def __init__(self,message):
         self.message = message
@@ -63,6 +72,79 @@ class GTC_Loader_Warning(PlasmaWarning):
     """class for GTC_Loader induced Warnings
     """
 
+class _SourceField(object):
+    """Descriptor for loaded fields that derived quantities depend on.
+    
+    Assigning a new value to the field drops the cached derived quantities 
+    that depend on it.
+    """
+    
+    def __init__(self, name, default=None):
+        self.name = name
+        self.default = default
+        
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        try:
+            return obj.__dict__[self.name]
+        except KeyError:
+            if self.default is not None:
+                return self.default
+            raise AttributeError('GTC_Loader has no attribute {}'.\
+                                 format(self.name))
+        
+    def __set__(self, obj, value):
+        obj.__dict__[self.name] = value
+        obj.invalidate_derived(self.name)
+
+
+class _DerivedQuantity(object):
+    """Descriptor for quantities derived from loaded fields.
+    
+    The derived array is calculated on first access and cached, until one of 
+    the fields in *depends* is assigned a new value. *func* is called as 
+    ``func(loader, time)``, and returns the whole time series if *time* is 
+    None, or only time step *time* otherwise. If the loader's *lazy_derived* 
+    is True, a :py:class:`..storage.ComputedTimeSeries` is returned instead, 
+    which calculates the time steps on request.
+    """
+    
+    def __init__(self, func, depends):
+        self.func = func
+        self.name = func.__name__
+        self.depends = depends
+        self.__doc__ = func.__doc__
+        
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        derived = obj.__dict__.setdefault('_derived', {})
+        try:
+            return derived[self.name]
+        except KeyError:
+            pass
+        if obj.lazy_derived and 'phi' in obj.__dict__:
+            func = lambda t: self.func(obj, t)
+            first = np.asarray(func(0))
+            value = ComputedTimeSeries(func, (len(obj.tsteps),)+first.shape,
+                                       first.dtype)
+        else:
+            value = np.asarray(self.func(obj, None))
+            value.flags.writeable = False
+        derived[self.name] = value
+        return value
+        
+
+def derived_quantity(*depends):
+    """decorator creates a :py:class:`_DerivedQuantity` depending on fields
+    *depends*
+    """
+    def decorator(func):
+        return _DerivedQuantity(func, depends)
+    return decorator
+
+
 def get_interp_planes(loader):
     """Get the plane numbers used for interpolation for each point 
     """
@@ -116,6 +198,94 @@ def check_time_availability(path, required_times, fname_pattern):
                                     time_all))
     print('All time available.')
     return time_all
+
+
+def check_store_time_availability(store_fname, required_times):
+    """Check a snapshot store created by :py:func:`convert_snapshots` for 
+    available time steps
+    
+    :param string store_fname: path to the HDF5 snapshot store
+    :param required_times: time steps that are expected to be existing
+    :type required_times: python or numpy array of int.
+    """
+    with h5.File(store_fname, 'r') as f:
+        time_all = np.sort(f['time'][()])
+    for t in required_times:
+        if t not in time_all:
+            raise GTC_Loader_Error(('Time {} not available!'.format(t), 
+                                    time_all))
+    print('All time available.')
+    return time_all
+
+
+def read_snapshot(snap_fname, fields=None):
+    """Read one **snap{time}_fpsdp.json** file
+    
+    :param string snap_fname: path to the snapshot file
+    :param fields: names of the fields to read. If None, all fields are read.
+    :type fields: list of string
+    
+    :return: dictionary of 1D arrays, in GTC units
+    """
+    with open(snap_fname,'r') as snap_file:
+        raw_snap = json.load(snap_file)
+    if fields is None:
+        fields = raw_snap.keys()
+    return dict((name, np.array(raw_snap[name], dtype=float)) 
+                for name in fields)
+
+
+def convert_snapshots(gtc_path, tsteps=None, 
+                      fname_pattern=r'snap(?P<time>\d+)_fpsdp.json', 
+                      store_fname=SNAPSHOT_STORE, compression='gzip', 
+                      n_workers=4):
+    """Convert **snap{time}_fpsdp.json** files into one chunked HDF5 store
+    
+    Each field is saved as a dataset with shape (NT, Ngrid_gtc), chunked by 
+    time step, in GTC units. The time steps are saved in dataset *time*. The 
+    JSON files are parsed by *n_workers* processes, and written one time step 
+    at a time, so the whole series never needs to be in memory. 
+    :py:meth:`GTC_Loader.load_fluctuations_2D` reads the store directly when
+    it exists in *gtc_path*.
+    
+    :param string gtc_path: the path where GTC output files are located
+    :param tsteps: time steps to convert. If None, all time steps found.
+    :type tsteps: list or 1D numpy array of int
+    :param fname_pattern: regular expression pattern of the snapshot files,
+                          see :py:func:`check_time_availability`
+    :type fname_pattern: raw string
+    :param string store_fname: name of the store file, relative to 
+                               *gtc_path*
+    :param compression: compression filter passed to h5py, None for no 
+                        compression
+    :param int n_workers: number of processes parsing JSON files
+    """
+    fname_re = re.compile(fname_pattern)
+    snap_fnames = {}
+    for name in os.listdir(gtc_path):
+        m = fname_re.match(name)
+        if m:
+            snap_fnames[int(m.group('time'))] = os.path.join(gtc_path, name)
+    if tsteps is None:
+        tsteps = sorted(snap_fnames.keys())
+    else:
+        check_time_availability(gtc_path, tsteps, fname_pattern)
+    NT = len(tsteps)
+    reader = PrefetchReader(read_snapshot, 
+                            [(snap_fnames[t],) for t in tsteps], 
+                            n_prefetch=n_workers, use_processes=True)
+    store_path = os.path.join(gtc_path, store_fname)
+    with h5.File(store_path, 'w') as f:
+        f.create_dataset('time', data=np.asarray(tsteps, dtype=int))
+        for i, snap in enumerate(reader):
+            for name, data in snap.items():
+                if i == 0:
+                    f.create_dataset(name, shape=(NT,)+data.shape, 
+                                     dtype=data.dtype, 
+                                     chunks=(1,)+data.shape,
+                                     compression=compression)
+                f[name][i] = data
+    print('{0} snapshots converted into {1}.'.format(NT, store_path))
     
 
 class GTC_Loader:
@@ -131,7 +301,7 @@ class GTC_Loader:
     __init__(self, gtc_path, grid, tsteps, 
              fname_pattern_2D=r'snap(?P<time>\d+)_fpsdp.json', 
              fname_pattern_3D = r'PHI_(?P<time>\d+)_\d+.ncd', 
-             Mode = 'full')
+             Mode = 'full', crop_margin = None, cache = None)
         
     :param string gtc_path: The path where GTC output files are located. 
     :param grid: User defined spatial grid. All GTC data will be 
@@ -162,6 +332,17 @@ class GTC_Loader:
         **least**: 
             DO NOT load any GTC output files, only initialize the loader 
             with initial parameters. This mode is mainly used for debug.
+    :param float crop_margin:
+        (Optional) if given, only GTC grid points inside the bounding box of 
+        *grid*, enlarged by *crop_margin* on each side, are kept, and 
+        fluctuations are only read on these points. In cm. Default to be 
+        None, the whole GTC grid is used. 2D only.
+    :param cache:
+        (Optional) profile cache used by :py:meth:`create_profile`. If given,
+        GTC output files are not loaded at initialization, see 
+        :py:meth:`load`, so a profile found in the cache is created without
+        reading any snapshot. 
+    :type cache: :py:class:`..cache.ProfileCache`
     
     Calculation of dTe
     -------------------
@@ -203,13 +384,56 @@ class GTC_Loader:
     .. math::
         T_{e0\perp} = T_{e0\parallel} = T_{e0}
             
+    Derived quantities
+    -------------------
+    
+    Quantities calculated from the loaded fields, e.g. *dne_on_grid* and 
+    *dTe_perp_on_grid*, are cached after the first access, and dropped when 
+    the fields they depend on are assigned new values. If *lazy_derived* is 
+    set to True, they are returned as 
+    :py:class:`..storage.ComputedTimeSeries` and calculated one time step at 
+    a time when requested.
+    
+    Quantities on grid
+    -------------------
+    
+    :py:meth:`interpolate_on_grid` keeps the quantities on the previously 
+    used grids, so switching back to one of them doesn't interpolate again. 
+    At most *grid_cache_size* previous grids are kept, the least recently 
+    used ones are dropped first. Default is 2, set it to 0 to keep none. 
+    :py:meth:`clear_grid_cache` drops all of them.
     
     """
     
+    # number of previous grids whose quantities are kept
+    grid_cache_size = 2
+    
+    # fields that derived quantities depend on
+    grid = _SourceField('grid')
+    tsteps = _SourceField('tsteps')
+    HaveElectron = _SourceField('HaveElectron')
+    a_gtc = _SourceField('a_gtc')
+    Te0_gtc = _SourceField('Te0_gtc')
+    ne0_gtc = _SourceField('ne0_gtc')
+    a_on_grid = _SourceField('a_on_grid')
+    Te0_on_grid = _SourceField('Te0_on_grid')
+    ne0_on_grid = _SourceField('ne0_on_grid')
+    dpsi = _SourceField('dpsi')
+    dne_ad = _SourceField('dne_ad')
+    nane = _SourceField('nane')
+    dPe_perp = _SourceField('dPe_perp')
+    dPe_para = _SourceField('dPe_para')
+    dpsi_on_grid = _SourceField('dpsi_on_grid')
+    dne_ad_on_grid = _SourceField('dne_ad_on_grid')
+    nane_on_grid = _SourceField('nane_on_grid')
+    dPe_perp_on_grid = _SourceField('dPe_perp_on_grid')
+    dPe_para_on_grid = _SourceField('dPe_para_on_grid')
+    lazy_derived = _SourceField('lazy_derived', default=False)
+    
     def __init__(self, gtc_path, grid, tsteps=None, 
                  fname_pattern_2D=r'snap(?P<time>\d+)_fpsdp.json', 
                  fname_pattern_3D = r'PHI_(?P<time>\d+)_\d+.ncd', 
-                 Mode = 'full'):
+                 Mode = 'full', crop_margin = None, cache = None):
         """Initialize a GTC loader with the following parameters:
         
         :param string gtc_path: The path where GTC output files are located. 
@@ -241,12 +465,23 @@ class GTC_Loader:
             **least**: 
                 DO NOT load any GTC output files, only initialize the loader 
                 with initial parameters. This mode is mainly used for debug.
+        :param float crop_margin:
+            (Optional) if given, only GTC grid points around *grid* are kept.
+            In cm. See :py:meth:`load_grid`.
+        :param cache:
+            (Optional) profile cache used by :py:meth:`create_profile`. If 
+            given, loading is deferred until a profile is not found in the 
+            cache. See :py:meth:`load`.
+        :type cache: :py:class:`..cache.ProfileCache`
         """        
         
         
         self.path = gtc_path
         self.grid = grid
         self.tsteps = tsteps
+        self.crop_margin = crop_margin
+        self.cache = cache
+        self._loaded = False
         
         if isinstance(grid, Cartesian2D):
             print('2D grid detected.')
@@ -258,8 +493,13 @@ class GTC_Loader:
             # If any requested time steps are not there, raise an error and 
             # print out all existing time steps.
                 self.Mode = Mode
+                store_fname = os.path.join(self.path, SNAPSHOT_STORE)
                 try:
-                    self._time_all =check_time_availability(self.path, 
+                    if os.path.exists(store_fname):
+                        self._time_all = check_store_time_availability(\
+                                                    store_fname, self.tsteps)
+                    else:
+                        self._time_all =check_time_availability(self.path, 
                                                             self.tsteps,
                                                             fname_pattern_2D)
                 except GTC_Loader_Error as e:
@@ -275,6 +515,7 @@ class GTC_Loader:
         elif isinstance(grid, Cartesian3D):
             print('3D grid detected.')
             self.dimension = 3
+            self.Mode = Mode
             try:
                 self._time_all =check_time_availability(os.path.join(self.path,
                                                                     'phi_dir'),
@@ -289,7 +530,22 @@ class GTC_Loader:
             raise GTC_Loader_Error
             
         
-        if ((Mode == 'full') or (Mode == 'eq_only')):
+        # with a cache, files are only loaded when a profile is not cached
+        if cache is None:
+            self.load()
+            
+    def load(self):
+        """Load GTC output files and interpolate them onto *grid*, as chosen 
+        by *Mode*.
+        
+        Called at initialization, unless a *cache* is given. Then it's called
+        by :py:meth:`create_profile` and :py:meth:`interpolate_on_grid` only 
+        when needed. Call it explicitly before using the loaded quantities 
+        directly. Loading is done only once.
+        """
+        if self._loaded:
+            return
+        if ((self.Mode == 'full') or (self.Mode == 'eq_only')):
             # read gtc.in.out and gtc.out, obtain run specifications like: 
             # adiabatic/non-adiabatic electrons, electrostatic/electromagnetic,
             # time step, ion gyro-radius, and snap output frequency.
@@ -309,7 +565,7 @@ class GTC_Loader:
             # interpolate equilibrium quantities
             self.interpolate_eq()
             
-            if(Mode == 'full'):
+            if(self.Mode == 'full'):
                 # For fluctuations, 2D and 3D loaders are different
                 if(self.dimension == 2):
                     # 2D is simple, read snap{time}_fpsdp.json and interpolate 
@@ -331,7 +587,8 @@ class GTC_Loader:
         
                     # interpolate onto our 3D mesh
                     self.interpolate_fluc_3D()
-            
+        self._loaded = True
+
     def load_gtc_specifics(self):
         """ read relevant GTC simulation settings from gtc.in and gtc.out 
         files.
@@ -424,6 +681,12 @@ class GTC_Loader:
             :var double R0: R coordinate of magnetic axis
             :var double Z0: Z coordinate of magnetic axis
             
+            :var gtc_nodes: 
+                if *crop_margin* is given, indices of the kept GTC grid 
+                points, all the GTC grid quantities above are only given on
+                these points. Otherwise None.
+            :vartype gtc_nodes: 1D int array
+                
             :var Delaunay_gtc: 
                 trangulation of GTC grid on (R,Z) plane, 
                 created by :class:`Delaunay <scipy.spatial.Delaunay>`
@@ -451,9 +714,31 @@ class GTC_Loader:
         self.B0 = raw_grids['B0'] * b2cgs       
         self.R_gtc = np.array(raw_grids['R_gtc'])*self.R0
         self.Z_gtc = np.array(raw_grids['Z_gtc'])*self.R0
-        self.points_gtc = np.transpose(np.array([self.Z_gtc,self.R_gtc]))
         self.a_gtc = np.array(raw_grids['a_gtc'])
         self.theta_gtc = np.array(raw_grids['theta_gtc'])
+        
+        # GTC grid points far from our grid are dropped, fluctuations will 
+        # only be read on the kept points
+        self.gtc_nodes = None
+        if (self.crop_margin is not None) and (self.dimension == 2):
+            Zwant = self.grid.Z2D.ravel()
+            Rwant = self.grid.R2D.ravel()
+            self._crop_box = (Zwant.min(), Zwant.max(), 
+                              Rwant.min(), Rwant.max())
+            self.gtc_nodes = nodes_in_box(np.transpose([self.Z_gtc, 
+                                                        self.R_gtc]),
+                                          np.transpose([Zwant, Rwant]),
+                                          self.crop_margin)
+            if len(self.gtc_nodes) < 3:
+                raise GTC_Loader_Error('Too few GTC grid points around the \
+grid, try a larger crop_margin. {0} points found.'.format(len(self.gtc_nodes)))
+            print('GTC grid cropped to {0} of {1} points.'.format(\
+                                      len(self.gtc_nodes), len(self.R_gtc)))
+            self.R_gtc = self.R_gtc[self.gtc_nodes]
+            self.Z_gtc = self.Z_gtc[self.gtc_nodes]
+            self.a_gtc = self.a_gtc[self.gtc_nodes]
+            self.theta_gtc = self.theta_gtc[self.gtc_nodes]
+        self.points_gtc = np.transpose(np.array([self.Z_gtc,self.R_gtc]))
         self.R_eq = np.array(raw_grids['R_eq'])*self.R0
         self.Z_eq = np.array(raw_grids['Z_eq'])*self.R0
         self.points_eq = np.transpose(np.array([self.Z_eq,self.R_eq]))
@@ -690,24 +975,13 @@ class GTC_Loader:
         Rout = Rwant[out_mask]
         
         # boundary points are obtained by applying ConvexHull on equilibrium 
-        # grid points
-        hull = ConvexHull(self.points_eq)
-        p_boundary = self.points_eq[hull.vertices]
-        Z_boundary = p_boundary[:,0]
-        R_boundary = p_boundary[:,1]
-        
-        # Now let's calculate *a* on outside points, first, get the nearest 
-        # boundary point for each outside point
-        nearest_indices = []
-        for i in range(len(Zout)):
-            Z = Zout[i]
-            R = Rout[i]
-            nearest_indices.append(np.argmin((Z-Z_boundary)**2 + \
-                                   (R-R_boundary)**2) )
+        # grid points. Now let's calculate *a* on outside points, first, get 
+        # the nearest boundary point for each outside point
+        nearest_indices = NearestHullVertexFinder(self.points_eq)(Zout, Rout)
             
         # Then, calculate *a* based on the gradient at these nearest points
-        Zn = Z_boundary[nearest_indices]
-        Rn = R_boundary[nearest_indices]
+        Zn = self.points_eq[nearest_indices, 0]
+        Rn = self.points_eq[nearest_indices, 1]
         # The value *a* and its gradiant at this nearest point can by easily 
         # obtained            
         an = self.a_eq_interp(Zn,Rn)            
@@ -860,11 +1134,20 @@ been left isolated. Check the input R_eq and Z_eq mesh, and see how its convex\
         return (gradR,gradZ)
 
     
-    def load_fluctuations_2D(self, fname_format = 'snap{0:0>7}_fpsdp.json'):
+    def load_fluctuations_2D(self, fname_format = 'snap{0:0>7}_fpsdp.json',
+                             n_workers = 4):
         """ Read fluctuation data from **snap{time}_fpsdp.json** files
         Read data into an array with shape (NT,Ngrid_gtc), NT the number of 
         requested timesteps, corresponds to *self.tstep*, Ngrid_gtc is the GTC 
         grid number on each cross-section.
+        
+        If the binary store created by :py:func:`convert_snapshots` exists in
+        the GTC path, data is read from it directly. Otherwise, JSON files are
+        parsed by *n_workers* processes in parallel.
+        
+        If the GTC grid is cropped, see :py:meth:`load_grid`, only the data on
+        *gtc_nodes* is kept. Ngrid_gtc is then the number of kept points.
+        
         Create Attribute:
             :var phi: fluctuating electro-static potential on GTC grid for each 
                       requested time step, unit: V
@@ -892,15 +1175,49 @@ been left isolated. Check the input R_eq and Z_eq mesh, and see how its convex\
             self.nane = np.empty_like(self.phi)
         if self.isEM:
             self.A_para = np.empty_like(self.phi)
-            self.dTe_ad = np.empty_like(self.phi)
             self.dpsi = np.empty_like(self.phi)
         
         
-        for i in range(NT):
-            snap_fname = os.path.join(self.path,
-                                      fname_format.format(self.tsteps[i]))
-            with open(snap_fname,'r') as snap_file:
-                raw_snap = json.load(snap_file)
+        fields = ['phi', 'densityi', 'fluidne']
+        if self.HaveElectron:
+            fields += ['densitye', 'Pe_perp', 'Pe_para']
+        if self.isEM:
+            fields += ['apara', 'delta_psi']
+        
+        nodes = self.gtc_nodes
+        store_fname = os.path.join(self.path, SNAPSHOT_STORE)
+        if os.path.exists(store_fname):
+            with h5.File(store_fname, 'r') as store:
+                time_all = store['time'][()]
+                index = np.array([np.nonzero(time_all == t)[0][0] 
+                                  for t in self.tsteps])
+                # h5py selection requires increasing indices, repeated time 
+                # steps are read once
+                unique_index, inverse = np.unique(index, return_inverse=True)
+                snaps = [dict() for i in range(NT)]
+                for name in fields:
+                    if nodes is None:
+                        data = store[name][unique_index.tolist()]
+                    else:
+                        # only the range of the kept points is read
+                        data = store[name][unique_index.tolist(), 
+                                           nodes[0]:nodes[-1]+1]\
+                                          [:, nodes-nodes[0]]
+                    data = data[inverse]
+                    for i in range(NT):
+                        snaps[i][name] = data[i]
+        else:
+            snaps = PrefetchReader(read_snapshot, 
+                                   [(os.path.join(self.path, 
+                                       fname_format.format(t)), fields) 
+                                    for t in self.tsteps],
+                                   n_prefetch=n_workers, use_processes=True)
+            if nodes is not None:
+                snaps = (dict((name, data[nodes]) 
+                              for name, data in raw_snap.items())
+                         for raw_snap in snaps)
+        
+        for i, raw_snap in enumerate(snaps):
             # our phi is in energy unit, which is actually e*phi. It's 
 			# originally in eV, we'll cast it into erg.
             self.phi[i] = np.array(raw_snap['phi']) \
@@ -951,111 +1268,119 @@ special attention.', GTC_Loader_Warning)
         NZ = self.grid.NZ
         NR = self.grid.NR
         
-        points_on_grid =np.transpose( np.array([self.grid.Z2D,self.grid.R2D]),
-                                     (1,2,0))        
-        
-        self.phi_on_grid = np.empty((NT,NZ,NR))
+        # simplex search and barycentric weights are done once for all grid 
+        # points, all fields and time steps are then interpolated with one 
+        # sparse matrix product
+        points_on_grid = np.transpose(np.array([self.grid.Z2D.ravel(),
+                                                self.grid.R2D.ravel()]))
+        weights = barycentric_matrix(self.Delaunay_gtc, points_on_grid)
         
-        self.dPe_perp_on_grid = np.empty_like(self.phi_on_grid)
-        self.dPe_para_on_grid = np.empty_like(self.phi_on_grid)
-        self.dni_on_grid = np.empty_like(self.phi_on_grid)
-        self.dne_ad_on_grid = np.empty_like(self.phi_on_grid)
+        fields = ['phi', 'dPe_perp', 'dPe_para', 'dni', 'dne_ad']
         if self.HaveElectron:
-            self.nane_on_grid = np.empty_like(self.phi_on_grid)
+            fields.append('nane')
         if self.isEM:
-            self.A_para_on_grid = np.empty_like(self.phi_on_grid)
-            self.dpsi_on_grid = np.empty_like(self.phi_on_grid)
+            fields += ['A_para', 'dpsi']
+        # stacked values with shape (Ngrid_gtc, Nfield*NT)
+        values = np.concatenate([getattr(self, name) for name in fields]).T
+        on_grid = weights.dot(values).T.reshape((len(fields), NT, NZ, NR))
+        for i, name in enumerate(fields):
+            setattr(self, name+'_on_grid', on_grid[i])
+            
+    def invalidate_derived(self, name=None):
+        """drop cached derived quantities
         
+        Derived quantities, e.g. *dTe_perp_on_grid*, are dropped 
+        automatically when a field they depend on is assigned a new array. If
+        an array is modified in place, this method should be called.
         
-        for i in range(NT):
-            phi_interp = LinearNDInterpolator(self.Delaunay_gtc, self.phi[i],
-                                              fill_value = 0)
-            self.phi_on_grid[i] = phi_interp(points_on_grid)
-            
-            dPe_perp_interp = LinearNDInterpolator(self.Delaunay_gtc,
-                                                  self.dPe_perp[i], 
-                                                  fill_value=0)
-            self.dPe_perp_on_grid[i] = dPe_perp_interp(points_on_grid)
-
-            dPe_para_interp = LinearNDInterpolator(self.Delaunay_gtc,
-                                                  self.dPe_para[i],
-                                                  fill_value=0)
-            self.dPe_para_on_grid[i] = dPe_para_interp(points_on_grid)  
-            
-            dni_interp = LinearNDInterpolator(self.Delaunay_gtc,
-                                              self.dni[i], fill_value=0)
-            self.dni_on_grid[i] = dni_interp(points_on_grid)
-            
-            dne_ad_interp = LinearNDInterpolator(self.Delaunay_gtc,
-                                                 self.dne_ad[i], fill_value=0)
-            self.dne_ad_on_grid[i] = dne_ad_interp(points_on_grid)
-            
-            if self.HaveElectron:
-                nane_interp = LinearNDInterpolator(self.Delaunay_gtc,
-                                                   self.nane[i], fill_value=0)
-                self.nane_on_grid[i] = nane_interp(points_on_grid)
-            if self.isEM:   
-                A_para_interp = LinearNDInterpolator(self.Delaunay_gtc,
-                                                     self.A_para[i],
-                                                     fill_value=0)
-                self.A_para_on_grid[i] = A_para_interp(points_on_grid)
-
-                dpsi_interp = LinearNDInterpolator(self.Delaunay_gtc,
-                                                   self.dpsi[i],
-                                                   fill_value=0)
-
-                self.dpsi_on_grid[i] = dpsi_interp(points_on_grid)
-    @property
-    def dne(self):
+        :param string name: Optional, the field that has been changed. If None
+                            or 'lazy_derived', all derived quantities are 
+                            dropped.
+        """
+        derived = self.__dict__.get('_derived')
+        if not derived:
+            return
+        if name is None or name == 'lazy_derived':
+            derived.clear()
+            return
+        for key in list(derived.keys()):
+            if name in getattr(GTC_Loader, key).depends:
+                del derived[key]
+                
+    def _derived_at(self, name, time):
+        """return derived quantity *name* at *time*, using the cached whole 
+        series if *time* is None
+        """
+        if time is None:
+            return getattr(self, name)
+        return getattr(GTC_Loader, name).func(self, time)
+                
+    @staticmethod
+    def _at(array, time):
+        """return *array* at time step *time*, or the whole series if None
+        """
+        if time is None:
+            return array
+        return array[time]
+    
+    @derived_quantity('dne_ad', 'nane', 'HaveElectron')
+    def dne(self, time=None):
         """ total electron density perturbation on GTC mesh """
         try:
             if not self.HaveElectron:
-                return self.dne_ad
+                return self._at(self.dne_ad, time)
             else:
-                return self.dne_ad + self.nane
+                return self._at(self.dne_ad, time) + self._at(self.nane, time)
         except AttributeError as e:
             print('dne_on_grid is only available when fluctuations are loaded.\
  Use full mode in initialization to enable fluctuation loading.')
             raise e
             
-    @property         
-    def dne_on_grid(self):
+    @derived_quantity('dne_ad_on_grid', 'nane_on_grid', 'HaveElectron', 
+                      'grid')
+    def dne_on_grid(self, time=None):
         """ total electron density perturbation on grid
         """
         try:
             if not self.HaveElectron:
-                return self.dne_ad_on_grid
+                return self._at(self.dne_ad_on_grid, time)
             else:
-                return self.dne_ad_on_grid + self.nane_on_grid
+                return self._at(self.dne_ad_on_grid, time) + \
+                       self._at(self.nane_on_grid, time)
         except AttributeError as e:
             print('dne_on_grid is only available when fluctuations are loaded.\
  Use full mode in initialization to enable fluctuation loading.')
             raise e
             
-    @property
-    def ne_on_grid(self):
+    @derived_quantity('ne0_on_grid', 'dne_ad_on_grid', 'nane_on_grid', 
+                      'HaveElectron', 'grid')
+    def ne_on_grid(self, time=None):
         """ total electron density on grid"""
         try:
-            return self.ne0_on_grid + self.dne_on_grid
+            return self.ne0_on_grid + self._derived_at('dne_on_grid', time)
         except AttributeError:
             warnings.warn('fluctuation is no loaded, ne0 is returned.', 
                           GTC_Loader_Warning)
             return self.ne0_on_grid
     
-    def calculate_adiabatic_Te(self, mesh, tol=1e-14):
+    def calculate_adiabatic_Te(self, mesh, tol=1e-14, time=None):
         r""" Adiabatic Te fluctuation is calculated using perturbed flux 
         surface.
 
         .. math::
             T_{e, ad} = T_0(\psi + \delta \psi)-T_0(\psi)
+            
+        :param string mesh: 'GTC' or 'grid'
+        :param int time: Optional, index of the time step to calculate. If 
+                         None, all time steps are calculated.
         """
         if (mesh == 'GTC'):
-            psi = self.a_gtc + self.dpsi
+            psi = self.a_gtc + self._at(self.dpsi, time)
             Te = self.Te0_interp(psi)
             dTe = Te - self.Te0_gtc
             return dTe
         elif (mesh == 'grid'):
-            psi = self.a_on_grid +self.dpsi_on_grid
+            psi = self.a_on_grid + self._at(self.dpsi_on_grid, time)
             Te = self.Te0_interp(psi)
             dTe = Te - self.Te0_on_grid
             return dTe
@@ -1063,19 +1388,19 @@ special attention.', GTC_Loader_Warning)
             raise ValueError('mesh {0} not valid. options are "GTC" or \
 "grid"'.format(mesh)) 
 
-    @property
-    def dTe_ad(self):
+    @derived_quantity('a_gtc', 'dpsi', 'Te0_gtc')
+    def dTe_ad(self, time=None):
         """ Adiabatic Te fluctuation on GTC grid
         """
-        return self.calculate_adiabatic_Te('GTC')
+        return self.calculate_adiabatic_Te('GTC', time=time)
 
-    @property
-    def dTe_ad_on_grid(self):
+    @derived_quantity('a_on_grid', 'dpsi_on_grid', 'Te0_on_grid', 'grid')
+    def dTe_ad_on_grid(self, time=None):
         """ Adiabatic Te fluctuation on GTC grid
         """
-        return self.calculate_adiabatic_Te('grid')
+        return self.calculate_adiabatic_Te('grid', time=time)
         
-    def calculate_fluc_Te(self, component, mesh, tol=1e-14):
+    def calculate_fluc_Te(self, component, mesh, tol=1e-14, time=None):
         r"""
         Calculate electron temperature fluctuation based on pressure 
         perturbation and density perturbation read from GTC output data.
@@ -1116,79 +1441,172 @@ special attention.', GTC_Loader_Warning)
         
         .. math::
             T_{e0\perp} = T_{e0\parallel} = T_{e0}
+            
+        :param string component: 'perp' or 'para'
+        :param string mesh: 'GTC' or 'grid'
+        :param int time: Optional, index of the time step to calculate. If 
+                         None, all time steps are calculated.
         """
-        if mesh == 'GTC':
-            dT = np.zeros_like(self.dPe_perp)
-            if component == 'perp':
-                dPe = self.dPe_perp
-            elif component == 'para':
-                dPe = self.dPe_para
-            else:
-                raise ValueError('component {0} not valid. options are "perp" or \
+        if component == 'perp':
+            dPe = self.dPe_perp if mesh == 'GTC' else self.dPe_perp_on_grid
+        elif component == 'para':
+            dPe = self.dPe_para if mesh == 'GTC' else self.dPe_para_on_grid
+        else:
+            raise ValueError('component {0} not valid. options are "perp" or \
 "para"'.format(component))
-            for i, t in enumerate(self.tsteps):
-                dT[i] = (dPe[i] - self.Te0_gtc*self.nane)[i] / self.ne0_gtc
-            return dT
+        if time is None:
+            steps = range(len(self.tsteps))
+        else:
+            steps = [time]
+        if mesh == 'GTC':
+            dT = np.zeros((len(steps),)+dPe.shape[1:])
+            for j, i in enumerate(steps):
+                dT[j] = (dPe[i] - self.Te0_gtc*self.nane[i]) / self.ne0_gtc
         elif mesh == 'grid':
             in_idx = np.abs(self.ne0_on_grid) > tol
-            dT = np.zeros_like(self.dPe_perp_on_grid)
-            if component == 'perp':
-                dPe = self.dPe_perp_on_grid
-            elif component == 'para':
-                dPe = self.dPe_para_on_grid
-            else:
-                raise ValueError('component {0} not valid. options are "perp" or \
-"para"'.format(component))
-            for i, t in enumerate(self.tsteps):
-                dT[i][in_idx] = (dPe[i][in_idx] - (self.Te0_on_grid\
-                                 *self.nane_on_grid)[i][in_idx]) \
+            dT = np.zeros((len(steps),)+dPe.shape[1:])
+            for j, i in enumerate(steps):
+                dT[j][in_idx] = (dPe[i][in_idx] - (self.Te0_on_grid\
+                                 *self.nane_on_grid[i])[in_idx]) \
                                  / self.ne0_on_grid[in_idx]
-            return dT
         else:
             raise ValueError('mesh {0} not valid. options are "GTC" or \
 "grid"'.format(mesh))
+        if time is None:
+            return dT
+        return dT[0]
     
-    @property
-    def dTe_na_perp(self):
-        return self.calculate_fluc_Te('perp', 'GTC')        
+    @derived_quantity('dPe_perp', 'Te0_gtc', 'nane', 'ne0_gtc')
+    def dTe_na_perp(self, time=None):
+        return self.calculate_fluc_Te('perp', 'GTC', time=time)        
         
-    @property
-    def dTe_na_para(self):
-        return self.calculate_fluc_Te('para', 'GTC')
+    @derived_quantity('dPe_para', 'Te0_gtc', 'nane', 'ne0_gtc')
+    def dTe_na_para(self, time=None):
+        return self.calculate_fluc_Te('para', 'GTC', time=time)
     
-    @property
-    def dTe_na_perp_on_grid(self):
-        return self.calculate_fluc_Te('perp', 'grid')
-        
-    @property
-    def dTe_na_para_on_grid(self):
-        return self.calculate_fluc_Te('para', 'grid')
+    @derived_quantity('dPe_perp_on_grid', 'Te0_on_grid', 'nane_on_grid', 
+                      'ne0_on_grid', 'grid')
+    def dTe_na_perp_on_grid(self, time=None):
+        return self.calculate_fluc_Te('perp', 'grid', time=time)
+        
+    @derived_quantity('dPe_para_on_grid', 'Te0_on_grid', 'nane_on_grid', 
+                      'ne0_on_grid', 'grid')
+    def dTe_na_para_on_grid(self, time=None):
+        return self.calculate_fluc_Te('para', 'grid', time=time)
     
-    @property
-    def dTe_perp(self):
-        return self.dTe_ad + self.dTe_na_perp
-        
-    @property
-    def dTe_para(self):
-        return self.dTe_ad + self.dTe_na_para
-        
-    @property
-    def dTe_perp_on_grid(self):
-        return self.dTe_ad_on_grid + self.dTe_na_perp_on_grid
-        
-    @property
-    def dTe_para_on_grid(self):
-        return self.dTe_ad_on_grid + self.dTe_na_para_on_grid
+    @derived_quantity('a_gtc', 'dpsi', 'Te0_gtc', 'dPe_perp', 'nane', 
+                      'ne0_gtc')
+    def dTe_perp(self, time=None):
+        return self._derived_at('dTe_ad', time) + \
+               self._derived_at('dTe_na_perp', time)
+        
+    @derived_quantity('a_gtc', 'dpsi', 'Te0_gtc', 'dPe_para', 'nane', 
+                      'ne0_gtc')
+    def dTe_para(self, time=None):
+        return self._derived_at('dTe_ad', time) + \
+               self._derived_at('dTe_na_para', time)
+        
+    @derived_quantity('a_on_grid', 'dpsi_on_grid', 'Te0_on_grid', 
+                      'dPe_perp_on_grid', 'nane_on_grid', 'ne0_on_grid', 
+                      'grid')
+    def dTe_perp_on_grid(self, time=None):
+        return self._derived_at('dTe_ad_on_grid', time) + \
+               self._derived_at('dTe_na_perp_on_grid', time)
+        
+    @derived_quantity('a_on_grid', 'dpsi_on_grid', 'Te0_on_grid', 
+                      'dPe_para_on_grid', 'nane_on_grid', 'ne0_on_grid', 
+                      'grid')
+    def dTe_para_on_grid(self, time=None):
+        return self._derived_at('dTe_ad_on_grid', time) + \
+               self._derived_at('dTe_na_para_on_grid', time)
     
     def interpolate_on_grid(self, grid=None):
         """Interpolate required quantities on new grid. Useful for loading same
         simulation data for multiple diagnostics which requires different 
         grids.
+        
+        Data on GTC mesh and the triangulations are reused, only the 
+        interpolation onto the grid is redone. The quantities on grid are
+        kept for the last *grid_cache_size* grids that have been used, 
+        switching back to one of them doesn't interpolate again. After this 
+        call, ``self.grid`` is *grid*.
+        
+        :param grid: The new grid. If None, current grid is kept.
+        :type grid: :py:class:`Cartesian2D <...geometry.grid.Cartesian2D>`
         """
-        # TODO complete the interpolation function
-        pass
+        if (grid is None) or (grid is self.grid):
+            return
+        if not isinstance(grid, Cartesian2D):
+            raise NotImplementedError('Interpolation on {0} is not \
+implemented, only Cartesian2D grid is supported.'.format(type(grid).__name__))
+        self.load()
+        if getattr(self, 'gtc_nodes', None) is not None:
+            Zmin, Zmax, Rmin, Rmax = self._crop_box
+            if (grid.Z2D.min() < Zmin or grid.Z2D.max() > Zmax or 
+                grid.R2D.min() < Rmin or grid.R2D.max() > Rmax):
+                raise GTC_Loader_Error('New grid is outside the cropped GTC \
+grid. Create a new loader with the new grid.')
+        grid_cache = self.__dict__.setdefault('_grid_cache', OrderedDict())
+        grid_cache[self._grid_key(self.grid)] = self._grid_state()
+        
+        # derived quantities on the old grid are dropped here
+        self.grid = grid
+        state = grid_cache.pop(self._grid_key(grid), None)
+        if state is not None:
+            on_grid, derived = state
+            self.__dict__.update(on_grid)
+            self.__dict__.setdefault('_derived', {}).update(derived)
+        else:
+            self.check_grid_resolution()
+            self.interpolate_eq()
+            if self.Mode == 'full':
+                self.interpolate_fluc_2D()
+        while len(grid_cache) > self.grid_cache_size:
+            grid_cache.popitem(last=False)
+            
+    def clear_grid_cache(self):
+        """drop the quantities kept for previous grids by 
+        :py:meth:`interpolate_on_grid`
+        
+        Quantities on the current grid are kept.
+        """
+        self.__dict__.pop('_grid_cache', None)
+                
+    @staticmethod
+    def _grid_key(grid):
+        """hashable key identifies the coordinates of *grid*
+        """
+        return (type(grid).__name__, 
+                np.asarray(grid.Z1D).tobytes(), np.asarray(grid.R1D).tobytes())
+                
+    def _grid_state(self):
+        """return quantities on current grid, and the cached derived 
+        quantities depend on it
+        """
+        on_grid = dict((name, value) for name, value in self.__dict__.items()
+                       if name.endswith('_on_grid'))
+        derived = dict((name, value) for name, value 
+                       in self.__dict__.get('_derived', {}).items()
+                       if 'grid' in getattr(GTC_Loader, name).depends)
+        return on_grid, derived
         
-    def create_profile(self, diagnostic=None, grid=None):
+    def source_files(self):
+        """return paths of the GTC output files the profiles are created from
+        
+        All files in *self.path*, and in 'phi_dir' for 3D runs, are included.
+        """
+        dirs = [self.path]
+        if self.dimension == 3:
+            dirs.append(os.path.join(self.path, 'phi_dir'))
+        fnames = []
+        for d in dirs:
+            for fname in os.listdir(d):
+                fname = os.path.join(d, fname)
+                if os.path.isfile(fname):
+                    fnames.append(fname)
+        return fnames
+                
+    def create_profile(self, diagnostic=None, grid=None, cache=None):
         """Create required profile object for specific diagnostic
         
         :param diagnostc: Specify the synthetic diagnostic that uses the 
@@ -1198,6 +1616,14 @@ special attention.', GTC_Loader_Warning)
         :param grid: The grid on which all required profiles will be given. If 
                      not specified, ``self.grid`` will be used.
         :type grid: :py:class:`<...geometry.Grid.Grid>` derived class
+        :param cache: Optional, if given, the profile is read from *cache* 
+                      when the GTC output files, *grid* and loading options 
+                      are unchanged since it was created. Otherwise it's 
+                      created and stored in *cache*. Default is the *cache* 
+                      given at initialization. GTC output files are loaded 
+                      only if the profile is not cached and the loader was 
+                      created with a cache.
+        :type cache: :py:class:`..cache.ProfileCache`
         """
         if (diagnostic is None) or (diagnostic not in Available_Diagnostics):
             raise ValueError('Diagnostic not specified! Currently available \
@@ -1208,6 +1634,22 @@ special attention.', GTC_Loader_Warning)
 created.')
             return
             
+        if cache is None:
+            cache = self.cache
+        if cache is not None:
+            if grid is None:
+                grid = self.grid
+            options = ('GTC', diagnostic, self.Mode, 
+                       np.asarray(self.tsteps).tolist(), self.crop_margin)
+            return cache.get_or_create(self.source_files(), grid, options,
+                                       lambda: self._create_profile(diagnostic,
+                                                                    grid))
+        return self._create_profile(diagnostic, grid)
+        
+    def _create_profile(self, diagnostic, grid):
+        """create the profile for *diagnostic* on *grid* from the loaded data
+        """
+        self.load()
         if (diagnostic in ['ecei1d', 'ecei2d']):
             self.interpolate_on_grid(grid)
             if grid is None:
@@ -1,32 +1,75 @@
-from distutils.core import setup, Extension
+"""Build script for the Map_Mod_C extension used by GTS_Loader
+
+    python setup_Map_Mod_C.py build_ext --inplace
+
+netCDF and GSL are located in the following order:
+
+1. NETCDF_DIR and GSL_DIR environment variables, as set by the modules on
+   NERSC and PPPL clusters
+2. nc-config and gsl-config found on PATH
+3. pkg-config packages 'netcdf' and 'gsl'
+4. the compiler's default search paths, e.g. /usr or a conda environment
+
+Compiler flags default to '-O2', and can be replaced by setting MAP_MOD_C_CFLAGS,
+e.g. MAP_MOD_C_CFLAGS='-O0 -g' for debugging.
+"""
 import os
+import shlex
+import subprocess
+
+import numpy as np
+
+try:
+    from setuptools import setup, Extension
+except ImportError:
+    from distutils.core import setup, Extension
+
+
+def _run(command):
+    """return the stripped output of *command*, or None if it fails
+    """
+    try:
+        return subprocess.check_output(command,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def find_library(env_name, config_command, pkg_name):
+    """return (include_dirs, library_dirs) of a library, see module docstring
+    for the search order
+    """
+    prefix = os.environ.get(env_name)
+    if prefix is None:
+        prefix = _run([config_command, '--prefix'])
+    if prefix is not None:
+        return [os.path.join(prefix, 'include')], [os.path.join(prefix, 'lib')]
+
+    cflags = _run(['pkg-config', '--cflags-only-I', pkg_name])
+    libs = _run(['pkg-config', '--libs-only-L', pkg_name])
+    if cflags is not None and libs is not None:
+        return ([flag[2:] for flag in shlex.split(cflags)],
+                [flag[2:] for flag in shlex.split(libs)])
+
+    print('{0} not found, relying on default compiler paths.'.format(pkg_name))
+    return [], []
 
-My_Sys = 'NERSC'
 
+netcdf_include, netcdf_lib = find_library('NETCDF_DIR', 'nc-config', 'netcdf')
+gsl_include, gsl_lib = find_library('GSL_DIR', 'gsl-config', 'gsl')
 
-if(My_Sys == 'NERSC'):
-    netcdf_dir = os.environ['NETCDF_DIR']
-    gsl_dir = os.environ['GSL_DIR']
-    numpy_dir = os.environ['NUMPY_HOME']+'/lib/python/numpy/core'
-elif(My_Sys == 'PPPL'):
-    netcdf_dir = os.environ['NETCDF_DIR']
-    gsl_dir = os.environ['GSL_DIR']
-    numpy_dir = os.environ['NUMPY_HOME']    
-    
-#mpi_dir=os.environ['MPICH_DIR']
-#mpi_dir='/opt/cray/mpt/6.0.2/gni/mpich2-cray/81'
-#mpi_dir = '/opt/cray/mpt/5.6.4/gni/mpich2-pgi/119'  #for Hopper
+extra_compile_args = shlex.split(os.environ.get('MAP_MOD_C_CFLAGS', '-O2'))
 
 module_Map_C = Extension('Map_Mod_C',
                          sources = ['Mapper_Mod_C.c','esiZ120813.c','supplementary.c'],
-                         library_dirs = [gsl_dir+'/lib',netcdf_dir+'/lib'],
+                         library_dirs = gsl_lib + netcdf_lib,
+                         runtime_library_dirs = gsl_lib + netcdf_lib,
                          libraries = ['gsl','gslcblas','netcdf'],
-                         include_dirs = [netcdf_dir+'/include',gsl_dir+'/include',numpy_dir+'/include'],
-                         extra_compile_args=['-O0'])
+                         include_dirs = netcdf_include + gsl_include + [np.get_include()],
+                         extra_compile_args=extra_compile_args)
 
 
 setup(name = 'gts',
       version = '0.1',
       description = 'Provide functions that read GTS output and create desired quantities on grids.',
       ext_modules = [module_Map_C],)
-      #py_modules=['GTS_Loader'],)
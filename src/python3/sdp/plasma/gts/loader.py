@@ -3,9 +3,10 @@
 import Map_Mod_C as mmc
 import numpy as np
 from sdp.geometry import grid
+from sdp.io.forkpool import ForkPool, fork_available, shared_zeros
 import scipy.io.netcdf as nc
 from scipy.interpolate import NearestNDInterpolator
-from time import clock
+from time import perf_counter as clock
 
 class GTS_loader_Error(Exception):
     """Exception class for handling GTS loading errors
@@ -15,12 +16,52 @@ class GTS_loader_Error(Exception):
     def __str__(self):
         return repr(self.value)
 
+def _map_cross_section_block(context, index):
+    """worker of :py:func:`map_cross_sections`, maps one center cross-section and writes the fluctuations directly into the shared output array
+    """
+    out = context['out']
+    x, y, z = context['coordinates']
+    _get_cross_section(x, y, z, out[0,index], out[1,index], out[2,index], context['centers'][index])
+    return index
+
+def _get_cross_section(x, y, z, dne_ad, nane, nate, center):
+    """call Map_Mod_C for one center cross-section, equilibrium quantities and mismatch flags are written into scratch arrays, since they don't depend on the cross-section
+    """
+    eq = [np.zeros_like(x) for i in range(6)]
+    mismatch = np.zeros_like(x, dtype = 'int32')
+    mmc.get_GTS_profiles_(x, y, z, eq[0], eq[1], eq[2], eq[3], eq[4], eq[5], dne_ad, nane, nate, mismatch, center)
+
+def map_cross_sections(x, y, z, centers, dne_ad, nane, nate, n_workers=1):
+    """map fluctuations of several center cross-sections onto the grid, in parallel
+    
+    Map_Mod_C keeps its parameters in C global variables set by set_para_, so the workers of a :py:class:`sdp.io.forkpool.ForkPool` are forked after set_para_ has been called, and inherit the parameters. Each worker maps one cross-section at a time, and writes the result directly into output arrays in shared memory. Cross-sections are collected as they finish.
+    
+    :param x,y,z: coordinates of the grid points, as passed to get_GTS_profiles_
+    :type x,y,z: 3D arrays of float
+    :param centers: center cross-section numbers
+    :type centers: 1D array of int
+    :param dne_ad,nane,nate: output arrays, shape (len(centers),nt,nz,ny,nx), the i-th cross-section is filled with results of *centers[i]*
+    :param int n_workers: number of worker processes. If 1, or fork is not available on the platform, cross-sections are mapped one after another.
+    """
+    n_workers = min(n_workers, len(centers))
+    if n_workers <= 1 or not fork_available():
+        for i, center in enumerate(centers):
+            _get_cross_section(x, y, z, dne_ad[i], nane[i], nate[i], center)
+        return
+    out = shared_zeros((3,) + dne_ad.shape)
+    with ForkPool(n_workers, coordinates=(x, y, z), centers=centers, out=out) as pool:
+        for i in pool.imap_unordered(_map_cross_section_block, [(i,) for i in range(len(centers))]):
+            dne_ad[i] = out[0,i]
+            nane[i] = out[1,i]
+            nate[i] = out[2,i]
+            print(('Cross-section {0} mapped.'.format(centers[i])))
+
 class GTS_Loader:
     """GTS Loading class
     For each GTS run case, setup all the loading parameters, read out necessary data, and output to suited format.
     """
 
-    def __init__(self, grid, t0,dt,nt, fluc_file_path,eq_fname,prof_fname,gts_file_path, n_cross_section = 1, phi_fname_head = 'PHI.', den_fname_head = 'DEN.', n_boundary = 1001, amplification = 1):
+    def __init__(self, grid, t0,dt,nt, fluc_file_path,eq_fname,prof_fname,gts_file_path, n_cross_section = 1, phi_fname_head = 'PHI.', den_fname_head = 'DEN.', n_boundary = 1001, amplification = 1, n_workers = 1):
        """Initialize Loading Parameters:
         grid: sdp.geometry.Grid.Cartesian2D or Cartesian3D object, contains the output grid information.
         t0: int; Starting time of the sampling series, in simulation record step counts.
@@ -33,6 +74,7 @@ class GTS_Loader:
         phi_fname_head: string; The header letters of the phi record file before the toroidal plane number, usually "PHI."
         den_fname_head: string; The header letters of the density record file before the toroidal plane number, usually "DEN."
         gts_file_path: string; the directory where the PHI data files are stored.
+        n_workers: int; number of processes mapping the center cross-sections concurrently. Default to be 1, cross-sections are mapped one after another.
        """
        self.grid = grid
 
@@ -55,6 +97,7 @@ class GTS_Loader:
        self.t0,self.dt,self.nt = t0,dt,nt
        self.time_steps = self.t0 + np.arange(self.nt) *self.dt
        self.n_cross_section = n_cross_section
+       self.n_workers = n_workers
 
        self.fluc_file_path = fluc_file_path
        self.eq_fname = eq_fname
@@ -181,8 +224,7 @@ class GTS_Loader:
             dcross = int(np.floor(self.total_cross_section / self.n_cross_section))
             self.center_cross_sections = np.arange(self.n_cross_section) * dcross
 
-            for i in range(1,len(self.center_cross_sections)):
-                mmc.get_GTS_profiles_(x3d,y3d,z3d,self.ne0_on_grid,self.Te0_on_grid,self.Btol_on_grid,self.Bp_on_grid,self.BR_on_grid,self.BZ_on_grid, self.dne_ad_on_grid[i,...],self.nane_on_grid[i,...],self.nate_on_grid[i,...],self.mismatch,self.center_cross_sections[i])
+            map_cross_sections(x3d,y3d,z3d,self.center_cross_sections[1:],self.dne_ad_on_grid[1:],self.nane_on_grid[1:],self.nate_on_grid[1:],self.n_workers)
         
             self._fill_mismatched(self.mismatch)
 
@@ -211,8 +253,7 @@ class GTS_Loader:
             dcross = int(np.floor(self.total_cross_section / self.n_cross_section))
             self.center_cross_sections = np.arange(self.n_cross_section) * dcross
 
-            for i in range(1,len(self.center_cross_sections)):
-                mmc.get_GTS_profiles_(x2d,y2d,z2d,self.ne0_on_grid,self.Te0_on_grid,self.Bt_on_grid,self.Bp_on_grid,self.BR_on_grid,self.BZ_on_grid, self.dne_ad_on_grid[i,...],self.nane_on_grid[i,...],self.nate_on_grid[i,...],self.mismatch,self.center_cross_sections[i])
+            map_cross_sections(x2d,y2d,z2d,self.center_cross_sections[1:],self.dne_ad_on_grid[1:],self.nane_on_grid[1:],self.nate_on_grid[1:],self.n_workers)
             t1 = clock() 
             self._fill_mismatched(self.mismatch)
             t2 = clock()
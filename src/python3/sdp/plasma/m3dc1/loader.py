@@ -10,6 +10,7 @@ Created on Fri May 13 22:26:04 2016
 @author: lei
 """
 from os import path
+from functools import partial
 
 import numpy as np
 from scipy.io.netcdf import netcdf_file as ncfile
@@ -17,7 +18,58 @@ from scipy.io.netcdf import netcdf_file as ncfile
 from ...geometry.grid import Cartesian2D
 from ...settings.unitsystem import cgs
 from ...diagnostic.availdiags import Available_Diagnostics
+from ...io.prefetch import PrefetchReader
 from ..profile import ECEI_Profile
+from ..storage import ComputedTimeSeries
+
+
+def load_slice(fluc_file, equilibrium, names=('ne', 'te', 'bb'), tol=1e-14):
+    """Read one toroidal slice file and return the perturbations from 
+    equilibrium
+    
+    The netCDF3 file is memory mapped, so only the chosen variables are read, 
+    and they are not copied before the subtraction.
+    
+    :param string fluc_file: path to the 'C1.h5_NNNN_ufile.cdf' file
+    :param equilibrium: equilibrium values in cgs units, keys are the names 
+                        of the variables
+    :type equilibrium: dict of 2D arrays
+    :param names: names of the variables to read, chosen from 'ne', 'te' and 
+                  'bb'
+    :param float tol: total Te smaller than *tol* times the maximum Te is 
+                      set to this marginal positive value
+                      
+    :return: dictionary of perturbations in cgs units
+    :rtype: dict of 2D arrays
+    """
+    flucf = ncfile(fluc_file, 'r', mmap=True)
+    result = {}
+    for name in names:
+        data = flucf.variables[name].data
+        if name == 'ne':
+            # convert from m^-3 to cm^-3
+            result[name] = data*1e-6 - equilibrium[name]
+        elif name == 'te':
+            # Similar to equilibrium, any negative total Te should also be set
+            # to marginal positive value
+            Tef = np.maximum(data, tol*np.max(data))
+            result[name] = Tef*cgs['keV'] - equilibrium[name]
+        elif name == 'bb':
+            # convert from Tesla to Gauss
+            result[name] = data*1e4 - equilibrium[name]
+        else:
+            raise ValueError('Unknown variable {}.'.format(name))
+        del data
+    flucf.close()
+    return result
+    
+    
+def _load_slice_variable(fluc_files, name, equilibrium, tol, t):
+    """return the perturbation of variable *name* on slice *t*, used by the 
+    lazy fluctuation arrays
+    """
+    return load_slice(fluc_files[t], equilibrium, (name,), tol)[name]
+    
 
 class M3DC1_Loader(object):
     """Loader class for M3D-C1 code
@@ -28,18 +80,32 @@ class M3DC1_Loader(object):
     Initializaiton
     ===============
     
-    __init__(self, m3dpath, tor_slice=0)
+    __init__(self, m3dpath, tor_slice=0, lazy=False, n_workers=4)
+    
+    The equilibrium is always read at initialization. A profile cache given 
+    to :py:meth:`create_profile` only saves reading the slice files with 
+    *lazy* set to True, otherwise all slices are already read before the 
+    cache is checked.
     """
     
-    def __init__(self, m3dpath='./', tor_slice=1):
+    def __init__(self, m3dpath='./', tor_slice=1, lazy=False, n_workers=4):
         """
         :param str path: loading directory of M3DC1 files, default to be current
         :param int tor_slice: toroidal slice number to be loaded, used for 
                               fluctuations
+        :param bool lazy: if True, *dne*, *dTe* and *dB* are 
+                          :py:class:`..storage.ComputedTimeSeries`, each slice
+                          is read and subtracted from equilibrium when it is 
+                          requested. Default to be False, all slices are 
+                          loaded at initialization.
+        :param int n_workers: number of slice files read in parallel when 
+                              *lazy* is False.
         """
         
         self._path = m3dpath
         self._tor_slice = np.array(tor_slice)
+        self._lazy = lazy
+        self._n_workers = n_workers
         
         self._load_equilibrium()
         self._load_fluctuation()
@@ -81,50 +147,45 @@ class M3DC1_Loader(object):
         NR = self.grid.NR
         NZ = self.grid.NZ
         if self._tor_slice.ndim == 0:
-            fluc_file = path.join(self._path, 
-                             'C1.h5_{0:0>4}_ufile.cdf'.format(self._tor_slice))
-            flucf = ncfile(fluc_file, 'r')
-            
-            self.time = np.array([0])
-            self.dne = np.empty((1, NZ, NR))
-            self.dTe = np.empty_like(self.dne)
-            self.dB = np.empty_like(self.dne)
-            
-            Tef = np.copy(flucf.variables['te'].data)
-            # Similar to equilibrium, any negative total Te should also be set 
-            # to marginal positive value
-            Te_margin = tol*np.max(Tef)
-            Tef[Tef < Te_margin] = Te_margin        
-            
-            self.dne[0] = flucf.variables['ne'].data*1e-6 - self.ne0
-            self.dTe[0] = Tef*cgs['keV'] - self.Te0
-            self.dB[0] = flucf.variables['bb'].data*1e4 - self.B0
-            
+            tor_slices = [self._tor_slice]
         elif self._tor_slice.ndim == 1:
-            nt = len(self._tor_slice)
-            self.time = np.arange(nt)
-            self.dne = np.empty((nt, NZ, NR))
-            self.dTe = np.empty_like(self.dne)
-            self.dB = np.empty_like(self.dne)
-            
-            for i, tor in enumerate(self._tor_slice):
-                fluc_file = path.join(self._path, 
-                             'C1.h5_{0:0>4}_ufile.cdf'.format(tor))
-                flucf = ncfile(fluc_file, 'r')
-                Tef = np.copy(flucf.variables['te'].data)
-                # Similar to equilibrium, any negative total Te should also be
-                # set to marginal positive value
-                Te_margin = tol*np.max(Tef)
-                Tef[Tef < Te_margin] = Te_margin        
-                
-                self.dne[i] = flucf.variables['ne'].data*1e-6 - self.ne0
-                self.dTe[i] = Tef*cgs['keV'] - self.Te0
-                self.dB[i] = flucf.variables['bb'].data*1e4 - self.B0
+            tor_slices = self._tor_slice
         else:
             raise ValueError('invalid tor_slice dimension. Only 1D or scalar\
 are allowed. tor_slice shape: {}'.format(self._tor_slice.shape))
+        nt = len(tor_slices)
+        self.time = np.arange(nt)
+        fluc_files = [path.join(self._path, 
+                                'C1.h5_{0:0>4}_ufile.cdf'.format(tor)) 
+                      for tor in tor_slices]
+        self._fluc_files = fluc_files
+        equilibrium = {'ne':self.ne0, 'te':self.Te0, 'bb':self.B0}
         
-    def create_profile(self, diagnostic):
+        if self._lazy:
+            self.dne, self.dTe, self.dB = [ComputedTimeSeries(\
+                partial(_load_slice_variable, fluc_files, name, equilibrium, 
+                        tol), (nt, NZ, NR)) for name in ('ne', 'te', 'bb')]
+        else:
+            self.dne = np.empty((nt, NZ, NR))
+            self.dTe = np.empty_like(self.dne)
+            self.dB = np.empty_like(self.dne)
+            reader = PrefetchReader(load_slice, 
+                                    [(fluc_file, equilibrium, 
+                                      ('ne', 'te', 'bb'), tol) 
+                                     for fluc_file in fluc_files],
+                                    n_prefetch=self._n_workers)
+            for i, fluc in enumerate(reader):
+                self.dne[i] = fluc['ne']
+                self.dTe[i] = fluc['te']
+                self.dB[i] = fluc['bb']
+        
+    def source_files(self):
+        """return paths of the M3D-C1 files the profiles are created from
+        """
+        return [path.join(self._path, 'C1.h5_equ_ufile.cdf')] + \
+               list(self._fluc_files)
+        
+    def create_profile(self, diagnostic, cache=None):
         """Create required profile object for specific diagnostics
         
         :param diagnostic: Specify the synthetic diagnostic that uses the
@@ -134,11 +195,23 @@ are allowed. tor_slice shape: {}'.format(self._tor_slice.shape))
         :param grid: The grid on which all required profiles will be given. If 
                      not specified, ``self.grid`` will be used.
         :type grid: :py:class:`<...geometry.Grid.Grid>` derived class
+        :param cache: Optional, if given, the profile is read from *cache* 
+                      when the M3D-C1 files and toroidal slices are unchanged
+                      since it was created. Otherwise it's created and stored 
+                      in *cache*. Use it with *lazy* loader, so the slice 
+                      files are not read when the profile is cached.
+        :type cache: :py:class:`..cache.ProfileCache`
         """
         if (diagnostic is None) or (diagnostic not in Available_Diagnostics):
             raise ValueError('Diagnostic {} not found! Currently available \
             diagnostics are:\n{}'.format(diagnostic, Available_Diagnostics))
             
+        if cache is not None:
+            options = ('M3DC1', diagnostic, self._tor_slice.tolist())
+            return cache.get_or_create(self.source_files(), self.grid, 
+                                       options, 
+                                       lambda: self.create_profile(diagnostic))
+            
         if diagnostic in ['ecei1d', 'ecei2d']:
             
             return ECEI_Profile(self.grid, self.ne0, self.Te0, self.B0, 
@@ -11,13 +11,16 @@ Created on Mon Jan 18 13:27:04 2016
 @author: lei
 """
 import warnings
+import hashlib
+from collections import OrderedDict
 
 import numpy as np
-from scipy.interpolate import RegularGridInterpolator
 
 from ..geometry.grid import Grid
 from ..settings.unitsystem import UnitSystem, cgs
 from ..settings.exception import PlasmaWarning
+from ..math.interpolation import StackedGridInterpolator, \
+                                CubicSplineGridInterpolator, GridStencil
 
 class IonClass(object):
     """General class for a kind of ions
@@ -85,6 +88,30 @@ class PlasmaProfile(object):
                 format(self._name, str(self.unit_system),str(self.grid), 
                        self.physical_quantities())
         
+class _InterpolatedQuantity(object):
+    """Descriptor for profile quantities that have cached interpolators.
+    
+    Assigning a new value to the quantity drops its cached interpolator, so a
+    new one will be built on next use.
+    """
+    
+    def __init__(self, name):
+        self.name = name
+        
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        try:
+            return obj.__dict__[self.name]
+        except KeyError:
+            raise AttributeError('{} has no attribute {}'.\
+                                 format(obj.class_name, self.name))
+        
+    def __set__(self, obj, value):
+        obj.__dict__[self.name] = value
+        obj.invalidate_interps(self.name)
+        
+
 class ECEI_Profile(PlasmaProfile):
     """Plasma profile for synthetic Electron Cyclotron Emission Imaging.
     
@@ -92,7 +119,8 @@ class ECEI_Profile(PlasmaProfile):
     ---------------
 
     __init__(self, grid, ne0, Te0, B0, time=None, dne=None, dTe_para=None, 
-                 dTe_perp=None, dB=None, unitsystem = cgs)
+                 dTe_perp=None, dB=None, unitsystem = cgs, 
+                 interp_method='linear')
     
     :var ne0: equilibrium electron density
     :var Te0: equilibrium electron temperature
@@ -101,9 +129,32 @@ class ECEI_Profile(PlasmaProfile):
     :var Te_para:  *optional*, fluctuated electron temperature parallel to B
     :var Te_perp: *optional*, fluctuatied electron temperature perpendicular 
                   to B
+    :var string interp_method: interpolation method for all quantities. 
+                               'linear': multilinear interpolation. 
+                               'cubic': cubic B-spline interpolation, 
+                               coefficients are calculated once when the 
+                               interpolator is created. Cubic interpolation
+                               allows coarser grids for the same accuracy,
+                               and has continuous gradients.
+    :var dict interp_builds: number of interpolators created for each 
+                             quantity. Interpolators are cached, so normally
+                             each quantity is counted only once.
+    :var int stencil_cache_size: number of compiled interpolation stencils 
+                                 kept for recently used coordinate sets. 
+                                 Default to be 0, no stencil is cached. Useful
+                                 when the same coordinates are evaluated many
+                                 times, e.g. for every frequency and time 
+                                 step.
     
     These should all be passed in compatible with the ``grid`` specification.
     
+    Perturbed quantities can also be given as out-of-core storage, e.g. 
+    :py:class:`.storage.HDF5TimeSeries` or :py:class:`.storage.MemmapTimeSeries`
+    , then only the requested time steps are read from disk.
+
+    To use one copy of the profile in several processes, export it with
+    :py:class:`.shared.SharedProfile`.
+
     :raises AssertionError: if any of the above quantities are not compatible
     
     Methods
@@ -112,8 +163,17 @@ class ECEI_Profile(PlasmaProfile):
     Following methods are provided:
     
     setup_interps(self, equilibrium_only = False):
-        Create interpolators for plasma quantities. This is useful if repeated
-        call of "get_*" methods is required.
+        Create interpolators for plasma quantities in advance. Interpolators 
+        are otherwise created on first call of "get_*" methods, and then 
+        cached.
+        
+    invalidate_interps(self, name=None):
+        Drop cached interpolators. Needed only if the quantity arrays are 
+        modified in place.
+        
+    compile_stencil(self, coordinates, gradient=False):
+        Compile *coordinates* into a stencil, which can be passed to all 
+        "get_*" methods in place of the coordinates.
         
     get_ne0(self, coordinates):
         return ne0 interpolated at *coordinates*
@@ -138,6 +198,9 @@ class ECEI_Profile(PlasmaProfile):
         return dTe_perp interpolated at *coordinates*, for each time step in 
         *time*
         
+    get_value_and_gradient(self, name, coordinates, time=None):
+        return quantity *name* and its gradient interpolated at *coordinates*
+        
     get_ne(self, coordinates, eq_only=True, time=None):
         wrapper for getting total electron densities        
         
@@ -166,8 +229,32 @@ class ECEI_Profile(PlasmaProfile):
         return info string containing physical quantities included in the
         profile.
     """
+    
+    # interpolators for each interp_method
+    _interp_classes = {'linear': StackedGridInterpolator,
+                       'cubic': CubicSplineGridInterpolator}
+    
+    # quantities with cached interpolators
+    _equilibrium_quantities = ('ne0', 'Te0', 'B0')
+    _perturbed_quantities = ('dne', 'dTe_para', 'dTe_perp', 'dB')
+    
+    grid = _InterpolatedQuantity('grid')
+    ne0 = _InterpolatedQuantity('ne0')
+    Te0 = _InterpolatedQuantity('Te0')
+    B0 = _InterpolatedQuantity('B0')
+    dne = _InterpolatedQuantity('dne')
+    dTe_para = _InterpolatedQuantity('dTe_para')
+    dTe_perp = _InterpolatedQuantity('dTe_perp')
+    dB = _InterpolatedQuantity('dB')
+    
     def __init__(self, grid, ne0, Te0, B0, time=None, dne=None, dTe_para=None, 
-                 dTe_perp=None, dB=None, unitsystem = cgs):
+                 dTe_perp=None, dB=None, unitsystem = cgs, 
+                 interp_method='linear'):
+        self._interps = {}
+        self.interp_builds = {}
+        self._stencils = OrderedDict()
+        self.stencil_cache_size = 0
+        self.interp_method = interp_method
         assert isinstance(grid, Grid)
         assert isinstance(unitsystem, UnitSystem)
         # test if all equilibrium quantities has same shape as the grid
@@ -228,7 +315,8 @@ class ECEI_Profile(PlasmaProfile):
         """return a whole parameter dictionary that can initialize the profile
         """
         params = dict(grid=self.grid, ne0=self.ne0, Te0=self.Te0, B0=self.B0,
-                      unitsystem=self.unit_system)
+                      unitsystem=self.unit_system, 
+                      interp_method=self.interp_method)
         if self.has_dB:
             params['time'] = self.time
             params['dB'] = self.dB
@@ -246,61 +334,140 @@ class ECEI_Profile(PlasmaProfile):
         
         
         
+    @property
+    def interp_method(self):
+        """interpolation method, 'linear' or 'cubic'. Changing it drops all
+        the cached interpolators."""
+        return self._interp_method
+        
+    @interp_method.setter
+    def interp_method(self, method):
+        if method not in self._interp_classes:
+            raise ValueError('interp_method must be one of {}, got {}.'.\
+                             format(list(self._interp_classes.keys()), method))
+        self._interp_method = method
+        self.invalidate_interps()
+        
     def setup_interps(self, equilibrium_only = False):
         """setup interpolators for frequent evaluation of profile quantities on
         given locations.
         
+        Calling this method is optional, interpolators are created on first
+        use and cached anyway. Each perturbed quantity gets one interpolator 
+        for all its time steps, so the cell indices and weights of the 
+        requested locations are calculated only once for all the chosen time 
+        steps.
         """
-        mesh = self.grid.get_mesh()
-        self.Te0_sp = RegularGridInterpolator(mesh, self.Te0)
-        self.ne0_sp = RegularGridInterpolator(mesh, self.ne0)
-        self.B0_sp = RegularGridInterpolator(mesh, self.B0)
+        for name in self._equilibrium_quantities:
+            self._get_interp(name)
         if not equilibrium_only:
-            if (self.has_dne):
-                self.dne_sp = []
-                for i in range(len(self.time)):
-                    self.dne_sp.append(RegularGridInterpolator(mesh, 
-                                                         self.dne[i]))
-            if (self.has_dTe_para):
-                self.dTe_para_sp = []
-                for i in range(len(self.time)):
-                    self.dTe_para_sp.append( RegularGridInterpolator(mesh, 
-                                                         self.dTe_para[i]))
-            if (self.has_dTe_perp):
-                self.dTe_perp_sp = []
-                for i in range(len(self.time)):
-                    self.dTe_perp_sp.append( RegularGridInterpolator(mesh, 
-                                                         self.dTe_perp[i]))
-                                                         
-            if (self.has_dB):
-                self.dB_sp = []
-                for i in range(len(self.time)):
-                    self.dB_sp.append( RegularGridInterpolator(mesh, 
-                                                         self.dB[i]))
-
-    def get_ne0(self, coordinates):
-        """return ne0 interpolated at *coordinates*
+            for name in self._perturbed_quantities:
+                if getattr(self, 'has_'+name):
+                    self._get_interp(name)
+                    
+    def invalidate_interps(self, name=None):
+        """drop cached interpolators
+        
+        Interpolators are dropped automatically when a quantity is assigned a 
+        new array. If an array is modified in place, this method should be 
+        called to make sure the change is seen by all interpolators.
+        
+        :param string name: Optional, the quantity whose interpolator will be
+                            dropped, e.g. 'dne'. If None or 'grid', all 
+                            interpolators are dropped.
+        """
+        interps = self.__dict__.get('_interps')
+        if interps is None:
+            return
+        if name is None or name == 'grid':
+            interps.clear()
+            self._stencils.clear()
+        else:
+            interps.pop(name, None)
+            
+    def _get_interp(self, name):
+        """return the cached interpolator for quantity *name*, create one if
+        it doesn't exist.
+        
+        Number of interpolator creations for each quantity is counted in 
+        *self.interp_builds*.
+        """
+        try:
+            return self._interps[name]
+        except KeyError:
+            mesh = self.grid.get_mesh()
+            interp_class = self._interp_classes[self.interp_method]
+            interp = interp_class(mesh, getattr(self, name))
+            self._interps[name] = interp
+            self.interp_builds[name] = self.interp_builds.get(name, 0) + 1
+            return interp
+            
+    def compile_stencil(self, coordinates, gradient=False):
+        """compile *coordinates* into a reusable interpolation stencil
+        
+        The grid indices and weights of the coordinates are calculated once,
+        and stored as a sparse matrix. The returned stencil can be passed to 
+        all "get_*" methods in place of the coordinates, then each quantity 
+        and time step is interpolated by one sparse matrix-vector product.
+        
+        The stencil is valid as long as the grid and interp_method are not 
+        changed.
         
         :param coordinates: Coordinates given in (Z,Y,X) *(3D)* or (Z,R) 
                             *(2D)* , or (X,) *(1D)* order.
         :type coordinates: *dim* ndarrays, *dim* is the dimensionality of 
-                           *self.grid*  
+                           *self.grid*
+        :param bool gradient: if True, the stencil can also be used with 
+                              :py:meth:`get_value_and_gradient`.
+        
+        :rtype: :py:class:`sdp.math.interpolation.GridStencil`
+        """
+        points = self._get_points(coordinates, use_cache=False)
+        if isinstance(points, GridStencil):
+            return points
+        return self._get_interp('ne0').compile_stencil(points, gradient)
+        
+    def _get_points(self, coordinates, use_cache=True):
+        """convert *coordinates* into points with the spatial axis the last
+        
+        If stencil cache is enabled, the compiled stencil for the points is
+        returned instead.
         """
+        if isinstance(coordinates, GridStencil):
+            return coordinates
         coordinates = np.array(coordinates)
         assert self.grid.dimension == coordinates.shape[0]
         transpose_axes = list(range(1,coordinates.ndim))
         transpose_axes.append(0)
         points = np.transpose(coordinates, transpose_axes)
+        if not use_cache or self.stencil_cache_size <= 0:
+            return points
+        key = (points.shape, 
+               hashlib.sha1(np.ascontiguousarray(points).tobytes()).digest())
         try:
-            return self.ne0_sp(points)
-        except AttributeError:
-            print('ne0_sp has not been created. Temperary interpolator \
-generated. If this message shows up a lot of times, please consider calling \
-setup_interps function first.')
-            mesh = self.grid.get_mesh()
-            ne0_sp = RegularGridInterpolator(mesh, self.ne0)
-            return ne0_sp(points)
+            stencil = self._stencils[key]
+            self._stencils.move_to_end(key)
+        except KeyError:
+            stencil = self._get_interp('ne0').compile_stencil(points)
+            self._stencils[key] = stencil
+            while len(self._stencils) > self.stencil_cache_size:
+                self._stencils.popitem(last=False)
+        return stencil
             
+    def _get_equilibrium(self, name, coordinates):
+        """interpolate equilibrium quantity *name* at *coordinates*
+        """
+        return self._get_interp(name)(self._get_points(coordinates))
+
+    def get_ne0(self, coordinates):
+        """return ne0 interpolated at *coordinates*
+        
+        :param coordinates: Coordinates given in (Z,Y,X) *(3D)* or (Z,R) 
+                            *(2D)* , or (X,) *(1D)* order.
+        :type coordinates: *dim* ndarrays, *dim* is the dimensionality of 
+                           *self.grid*  
+        """
+        return self._get_equilibrium('ne0', coordinates)
 
     def get_Te0(self, coordinates):
         """return Te0 interpolated at *coordinates*
@@ -310,21 +477,7 @@ setup_interps function first.')
         :type coordinates: *dim* ndarrays, *dim* is the dimensionality of 
                            *self.grid*  
         """
-        coordinates = np.array(coordinates)
-        assert self.grid.dimension == coordinates.shape[0]
-        transpose_axes = list(range(1,coordinates.ndim))
-        transpose_axes.append(0)
-        points = np.transpose(coordinates, transpose_axes)
-        try:
-            return self.Te0_sp(points)
-        except AttributeError:
-            print('Te0_sp has not been created. Temperary interpolator \
-generated. If this message shows up a lot of times, please consider calling \
-setup_interps function first.')
-            mesh = self.grid.get_mesh()
-            Te0_sp = RegularGridInterpolator(mesh, self.Te0)
-            return Te0_sp(points)
-
+        return self._get_equilibrium('Te0', coordinates)
 
     def get_B0(self, coordinates):
         """return B0 interpolated at *coordinates*
@@ -334,21 +487,7 @@ setup_interps function first.')
         :type coordinates: *dim* ndarrays, *dim* is the dimensionality of 
                            *self.grid*  
         """
-        coordinates = np.array(coordinates)
-        assert self.grid.dimension == coordinates.shape[0]
-        transpose_axes = list(range(1,coordinates.ndim))
-        transpose_axes.append(0)
-        points = np.transpose(coordinates, transpose_axes)
-        try:
-            return self.B0_sp(points)
-        except AttributeError:
-            print('B0_sp has not been created. Temperary interpolator \
-generated. If this message shows up a lot of times, please consider calling \
-setup_interps function first.')
-            mesh = self.grid.get_mesh()
-            B0_sp = RegularGridInterpolator(mesh, self.B0)
-            return B0_sp(points)  
-            
+        return self._get_equilibrium('B0', coordinates)
 
     def get_dne(self, coordinates, time=None):
         """return dne interpolated at *coordinates*, for each time step
@@ -367,58 +506,8 @@ setup_interps function first.')
                 if time is scalar, the shape is (nc1, nc2, ..., ncn) only.
         """
         assert self.has_dne
-        coordinates = np.array(coordinates)
-        assert self.grid.dimension == coordinates.shape[0]
-        
-        if time is None:
-            time = np.arange(len(self.time))
+        return self._get_fluctuation('dne', coordinates, time)
 
-        time = np.array(time)        
-        
-        if time.ndim == 0:
-            result_shape = coordinates.shape[1:]    
-            result = np.empty(result_shape)        
-            
-            transpose_axes = list(range(1,coordinates.ndim))
-            transpose_axes.append(0)
-            points = np.transpose(coordinates, transpose_axes)
-            try:
-                result = self.dne_sp[time](points)
-                
-            except AttributeError:
-                print('dne_sp has not been created. Temperary interpolator \
-generated. If this message shows up a lot of times, please consider calling \
-setup_interps function first.')
-                mesh = self.grid.get_mesh()            
-                dne_sp = RegularGridInterpolator(mesh, self.dne[time])
-                result = dne_sp(points)
-            return result
-        elif time.ndim == 1:
-            result_shape = [i for i in coordinates.shape]
-            nt = len(time)
-            result_shape[0] = nt
-    
-            result = np.empty(result_shape)        
-            
-            transpose_axes = list(range(1,coordinates.ndim))
-            transpose_axes.append(0)
-            points = np.transpose(coordinates, transpose_axes)
-            try:
-                for i,t in enumerate(time):
-                    result[i] = self.dne_sp[t](points)
-                
-            except AttributeError:
-                print('dne_sp has not been created. Temperary interpolator \
-generated. If this message shows up a lot of times, please consider calling \
-setup_interps function first.')
-                mesh = self.grid.get_mesh()            
-                for i,t in enumerate(time):
-                    dne_sp = RegularGridInterpolator(mesh, self.dne[t])
-                    result[i] = dne_sp(points)
-            return result
-        else:
-            raise ValueError('time can only be int or 1D array of int.')
-            
     def get_dB(self, coordinates, time=None):
         """return dB interpolated at *coordinates*, for each time step
         
@@ -436,60 +525,7 @@ setup_interps function first.')
                 if time is scalar, the shape is (nc1, nc2, ..., ncn) only.
         """
         assert self.has_dB
-        coordinates = np.array(coordinates)
-        assert self.grid.dimension == coordinates.shape[0]
-        
-        if time is None:
-            time = np.arange(len(self.time))
-        
-        time = np.array(time)        
-        
-        if time.ndim == 0:
-            result_shape = coordinates.shape[1:]    
-            result = np.empty(result_shape)        
-            
-            transpose_axes = list(range(1,coordinates.ndim))
-            transpose_axes.append(0)
-            points = np.transpose(coordinates, transpose_axes)
-            try:
-                result = self.dB_sp[time](points)
-            except AttributeError:
-                print('dB_sp has not been created. Temperary interpolator \
-generated. If this message shows up a lot of times, please consider calling \
-setup_interps function first.')
-                mesh = self.grid.get_mesh()            
-                dB_sp = RegularGridInterpolator(mesh, self.dB[time])
-                result = dB_sp(points)
-            return result
-        
-        elif time.ndim == 1:
-            # Note that the first dimension in coordinates is the number of 
-            # spatial axis. We can simply overwrite it with time steps to get 
-            # the desired shape of result. 
-            result_shape = [i for i in coordinates.shape]
-            nt = len(time)
-            result_shape[0] = nt
-    
-            result = np.empty(result_shape)        
-            
-            transpose_axes = list(range(1,coordinates.ndim))
-            transpose_axes.append(0)
-            points = np.transpose(coordinates, transpose_axes)
-            try:
-                for i,t in enumerate(time):
-                    result[i] = self.dB_sp[t](points)
-            except AttributeError:
-                print('dB_sp has not been created. Temperary interpolator \
-generated. If this message shows up a lot of times, please consider calling \
-setup_interps function first.')
-                mesh = self.grid.get_mesh()            
-                for i,t in enumerate(time):
-                    dB_sp = RegularGridInterpolator(mesh, self.dB[t])
-                    result[i] = dB_sp(points)
-            return result
-        else:
-            raise ValueError('time can only be int or 1D array of int.')
-
+        return self._get_fluctuation('dB', coordinates, time)
 
     def get_dTe_perp(self, coordinates, time=None):
         """return dTe_perp interpolated at *coordinates*, for each time step
@@ -508,56 +544,8 @@ setup_interps function first.')
                 if time is scalar, the shape is (nc1, nc2, ..., ncn) only.
         """
         assert self.has_dTe_perp
-        coordinates = np.array(coordinates)
-        assert self.grid.dimension == coordinates.shape[0]
-        
-        if time is None:
-            time = np.arange(len(self.time)) 
-        time = np.array(time)
-        if time.ndim == 0:
-            result_shape = coordinates.shape[1:]    
-            result = np.empty(result_shape)        
-            
-            transpose_axes = list(range(1,coordinates.ndim))
-            transpose_axes.append(0)
-            points = np.transpose(coordinates, transpose_axes)
-            try:
-                result = self.dTe_perp_sp[time](points)
-            except AttributeError:
-                print('dTe_perp_sp has not been created. Temperary \
-interpolator generated. If this message shows up a lot of times, please \
-consider calling setup_interps function first.')
-                mesh = self.grid.get_mesh()            
-                dte_sp = RegularGridInterpolator(mesh, self.dTe_perp[time])
-                result = dte_sp(points)
-            return result
-                
-        elif time.ndim == 1:
-            result_shape = [i for i in coordinates.shape]
-            nt = len(time)
-            result_shape[0] = nt
-    
-            result = np.empty(result_shape)        
-            
-            transpose_axes = list(range(1,coordinates.ndim))
-            transpose_axes.append(0)
-            points = np.transpose(coordinates, transpose_axes)
-            try:
-                for i,t in enumerate(time):
-                    result[i] = self.dTe_perp_sp[t](points)
-            except AttributeError:
-                print('dTe_perp_sp has not been created. Temperary \
-interpolator generated. If this message shows up a lot of times, please \
-consider calling setup_interps function first.')
-                mesh = self.grid.get_mesh()            
-                for i,t in enumerate(time):
-                    dte_sp = RegularGridInterpolator(mesh, self.dTe_perp[t])
-                    result[i] = dte_sp(points)
-            return result
-        else:
-            raise ValueError('time can only be int or 1D array of int.')
+        return self._get_fluctuation('dTe_perp', coordinates, time)
 
-            
     def get_dTe_para(self, coordinates, time=None):
         """return dTe_para interpolated at *coordinates*, for each time step
         
@@ -575,56 +563,62 @@ consider calling setup_interps function first.')
                 if time is scalar, the shape is (nc1, nc2, ..., ncn) only.
         """
         assert self.has_dTe_para
-        coordinates = np.array(coordinates)
-        assert self.grid.dimension == coordinates.shape[0]
+        return self._get_fluctuation('dTe_para', coordinates, time)
+
+    def _get_fluctuation(self, name, coordinates, time):
+        """interpolate perturbed quantity *name* at *coordinates*, for each
+        time step in *time*
+        
+        See :py:meth:`get_dne` for the meaning of the arguments and the shape
+        of the returned array.
+        """
+        points = self._get_points(coordinates)
+        time = self._check_time(time)
+        interp = self._get_interp(name)
+        return interp(points, time)
         
+    def _check_time(self, time):
+        """return chosen time steps as an array, all steps if *time* is None
+        """
         if time is None:
-            time = np.arange(len(self.time))  
-
-        time = np.array(time)        
+            time = np.arange(len(self.time))
+        time = np.array(time)
+        if time.ndim > 1:
+            raise ValueError('time can only be int or 1D array of int.')
+        return time
         
-        if time.ndim == 0:
-            result_shape = coordinates.shape[1:]    
-            result = np.empty(result_shape)        
-            
-            transpose_axes = list(range(1,coordinates.ndim))
-            transpose_axes.append(0)
-            points = np.transpose(coordinates, transpose_axes)
-            try:
-                result = self.dTe_para_sp[time](points)
-            except AttributeError:
-                print('dTe_para_sp has not been created. Temperary \
-interpolator generated. If this message shows up a lot of times, please \
-consider calling setup_interps function first.')
-                mesh = self.grid.get_mesh()            
-                dte_sp = RegularGridInterpolator(mesh, self.dTe_para[time])
-                result = dte_sp(points)
-            return result        
-        elif time.ndim == 1:
-            result_shape = [i for i in coordinates.shape]
-            nt = len(time)
-            result_shape[0] = nt
-    
-            result = np.empty(result_shape)        
-            
-            transpose_axes = list(range(1,coordinates.ndim))
-            transpose_axes.append(0)
-            points = np.transpose(coordinates, transpose_axes)
-            try:
-                for i,t in enumerate(time):
-                    result[i] = self.dTe_para_sp[t](points)
-            except AttributeError:
-                print('dTe_para_sp has not been created. Temperary \
-interpolator generated. If this message shows up a lot of times, please \
-consider calling setup_interps function first.')
-                mesh = self.grid.get_mesh()            
-                for i,t in enumerate(time):
-                    dte_sp = RegularGridInterpolator(mesh, self.dTe_para[t])
-                    result[i] = dte_sp(points)
-            return result
+    def get_value_and_gradient(self, name, coordinates, time=None):
+        """return quantity *name* and its spatial gradient interpolated at 
+        *coordinates*
+        
+        Values and gradients are calculated from the same interpolation 
+        stencil. With interp_method 'cubic', the gradients are continuous.
+        
+        :param string name: name of the quantity, one of 'ne0', 'Te0', 'B0', 
+                            'dne', 'dTe_para', 'dTe_perp', 'dB'
+        :param coordinates: Coordinates given in (Z,Y,X) *(3D)* or (Z,R) 
+                            *(2D)* , or (X,) *(1D)* order.
+        :type coordinates: *dim* ndarrays, *dim* is the dimensionality of 
+                           *self.grid*
+        :param time: Optional, only used for perturbed quantities. See 
+                     :py:meth:`get_dne`.
+        :type time: array_like or scalar of int
+        
+        :return: (value, gradient). value is the same as returned by the 
+                 corresponding "get_*" method. gradient has shape 
+                 ``(dim,)+value.shape``, its components are the derivatives 
+                 in the same order as *coordinates*.
+        """
+        points = self._get_points(coordinates, use_cache=False)
+        if name in self._equilibrium_quantities:
+            return self._get_interp(name).value_and_gradient(points)
+        elif name in self._perturbed_quantities:
+            assert getattr(self, 'has_'+name)
+            time = self._check_time(time)
+            return self._get_interp(name).value_and_gradient(points, time)
         else:
-            raise ValueError('time can only be int or 1D array of int.')
-            
+            raise ValueError('Unknown quantity name: {}'.format(name))
+        
     def get_ne(self, coordinates, eq_only=True, time=None):
         """wrapper for getting electron densities
         
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+This module shares plasma profiles between processes through shared memory.
+
+A parallel diagnostic normally gives each worker its own copy of the plasma
+profile, either by pickling it or by rebuilding it from
+:py:attr:`..profile.PlasmaProfile.parameters`, so the profile arrays are held
+in memory once per worker. :py:class:`SharedProfile` copies all the arrays of
+a profile into one :py:class:`multiprocessing.shared_memory.SharedMemory`
+block. The handle itself is small and can be sent to the workers, where
+:py:meth:`SharedProfile.attach` returns a profile whose arrays are read-only
+views of the shared block.
+
+Any picklable profile can be shared. Its arrays are collected with pickle
+protocol 5 out-of-band buffers, so besides the plasma quantities the grid, the
+cached interpolators, including the spline coefficients of 'cubic'
+interpolators, and the compiled stencils are shared too. Perturbed quantities
+given as out-of-core storage, e.g. :py:class:`.storage.HDF5TimeSeries`, are
+not copied, each worker reads its own time steps from the file.
+
+Example::
+
+    shared = SharedProfile(profile)
+    # in the workers, *shared* is received as an argument
+    plasma = shared.attach()
+    plasma.get_Te0([Y2D, X2D])
+
+The block is freed when the exporting handle is garbage collected, or when
+:py:meth:`SharedProfile.unlink` is called. Profiles already attached in other
+processes remain valid until they are deleted.
+"""
+import pickle
+import weakref
+
+from ..io.sharedmem import create_memory, attach_memory
+
+# buffers are aligned for efficient vectorized access
+_ALIGNMENT = 64
+
+
+def _unlink_memory(shm):
+    """free the shared memory block created by the exporting handle
+    """
+    try:
+        shm.unlink()
+    except FileNotFoundError:
+        pass
+
+
+class SharedProfile(object):
+    """Handle of a plasma profile stored in shared memory
+
+    __init__(profile, setup_interps=True)
+
+    :param profile: the profile to be shared
+    :type profile: :py:class:`..profile.PlasmaProfile` derived class
+    :param bool setup_interps: if True, interpolators of *profile* are created
+                               before exporting, so the workers don't need to
+                               create their own. Only used if the profile has
+                               a ``setup_interps`` method.
+    :var string name: name of the shared memory block
+    :var int nbytes: size of the shared arrays in bytes
+
+    The handle can be pickled, and is sent to other processes in place of the
+    profile. Only the handle created by the exporting process frees the block.
+
+    Methods
+    --------
+
+    attach():
+        return a profile using the arrays in the shared memory block
+
+    unlink():
+        free the shared memory block
+    """
+
+    def __init__(self, profile, setup_interps=True):
+        if setup_interps and hasattr(profile, 'setup_interps'):
+            profile.setup_interps()
+        buffers = []
+        self._pickled = pickle.dumps(profile, protocol=5,
+                                     buffer_callback=buffers.append)
+        raws = [buf.raw() for buf in buffers]
+        self._layout = []
+        offset = 0
+        for raw in raws:
+            offset = -(-offset // _ALIGNMENT) * _ALIGNMENT
+            self._layout.append((offset, raw.nbytes))
+            offset += raw.nbytes
+        self.nbytes = offset
+        self._shm = create_memory(offset)
+        self.name = self._shm.name
+        buf = attach_memory(self.name, owner=True)
+        for raw, (start, nbytes) in zip(raws, self._layout):
+            buf[start:start+nbytes] = raw
+        del buf
+        self._finalizer = weakref.finalize(self, _unlink_memory, self._shm)
+
+    def __getstate__(self):
+        return dict(name=self.name, nbytes=self.nbytes,
+                    _pickled=self._pickled, _layout=self._layout)
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._shm = None
+        self._finalizer = None
+
+    def attach(self):
+        """return a profile using the arrays in the shared memory block
+
+        The arrays are read-only. Each call returns a new profile object, all
+        of them share the same memory. Each call maps the block separately,
+        also in the exporting process, and the mapping stays valid as long as
+        any of the returned arrays exists.
+        """
+        buf = attach_memory(self.name, owner=self._finalizer is not None).\
+              toreadonly()
+        buffers = [buf[start:start+nbytes] for start, nbytes in self._layout]
+        return pickle.loads(self._pickled, buffers=buffers)
+
+    def unlink(self):
+        """free the shared memory block
+
+        Only the exporting handle can free the block. Profiles already
+        attached remain valid, but no new profile can be attached.
+        """
+        if self._finalizer is None:
+            raise RuntimeError('Shared profile {} can only be freed by the \
+exporting process.'.format(self.name))
+        self._finalizer()
+
+    def __str__(self):
+        return 'Shared plasma profile: {} bytes in shared memory {}'.\
+               format(self.nbytes, self.name)
@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+"""
+This module provides out-of-core storage for time series of perturbed plasma
+quantities.
+
+Perturbed quantities in :py:class:`..profile.ECEI_Profile` are arrays with
+shape ``(nt, ...)``. For long simulation series these arrays can be much
+larger than the available memory. The storage classes here can be used in
+place of these arrays. They are backed by a ``.npy``/raw binary file
+(through :py:class:`numpy.memmap`) or by a HDF5 dataset, and only read the
+time steps that are actually requested. :py:class:`ComputedTimeSeries`
+calculates derived quantities one time step at a time in the same way. A small
+LRU window of recently used time steps is kept in memory.
+
+Example::
+
+    dne = HDF5TimeSeries('xgc_profile.h5', 'dne', window=4)
+    profile = ECEI_Profile(grid, ne0, Te0, B0, time=time, dne=dne)
+
+    # only time step 3 is read from disk
+    profile.get_dne(coordinates, time=3)
+
+"""
+from collections import OrderedDict
+
+import numpy as np
+import h5py as h5
+
+
+class TimeSeriesStorage(object):
+    """Base class for array-like storage of a time series read on demand
+
+    Indexing with an integer returns the corresponding time step as an
+    in-memory read-only ndarray. Other indexing returns a new ndarray
+    containing all the chosen time steps. The ``window`` most recently used
+    time steps are cached.
+
+    Derived classes must implement :py:meth:`_read`, which reads one time
+    step from the file.
+
+    :param shape: shape of the whole time series, first axis is time
+    :type shape: tuple of int
+    :param dtype: data type of the stored values
+    :param int window: number of time steps kept in memory
+    """
+
+    def __init__(self, shape, dtype, window=4):
+        assert window >= 1
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.window = window
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    def __len__(self):
+        return self.shape[0]
+
+    def _read(self, t):
+        raise NotImplementedError('Derived classes must implement _read \
+method.')
+
+    def _get_step(self, t):
+        """return time step *t*, either from the LRU window or from file
+        """
+        nt = self.shape[0]
+        if t < -nt or t >= nt:
+            raise IndexError('time step {} is out of range for {} time \
+steps.'.format(t, nt))
+        t = t % nt
+        try:
+            data = self._cache[t]
+            self._cache.move_to_end(t)
+            self.hits += 1
+        except KeyError:
+            data = np.array(self._read(t), dtype=self.dtype)
+            data.flags.writeable = False
+            self.misses += 1
+            self._cache[t] = data
+            while len(self._cache) > self.window:
+                self._cache.popitem(last=False)
+        return data
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            if len(key) == 0:
+                return self[:]
+            first, rest = key[0], key[1:]
+            if isinstance(first, (int, np.integer)):
+                return self[first][rest]
+            return self[first][(slice(None),) + rest]
+        if isinstance(key, (int, np.integer)):
+            return self._get_step(int(key))
+        steps = np.arange(self.shape[0])[key]
+        result = np.empty((len(steps),)+self.shape[1:], dtype=self.dtype)
+        for i, t in enumerate(steps):
+            result[i] = self._get_step(t)
+        return result
+
+    def __iter__(self):
+        for t in range(self.shape[0]):
+            yield self._get_step(t)
+
+    def __array__(self, dtype=None, copy=None):
+        result = self[:]
+        if dtype is not None:
+            result = result.astype(dtype)
+        return result
+
+    def max(self, axis=None, out=None, **kwargs):
+        """maximum value, calculated one time step at a time if axis is None
+        """
+        if axis is not None or out is not None:
+            return np.max(self[:], axis=axis, out=out, **kwargs)
+        return max([np.max(self._read(t)) for t in range(self.shape[0])])
+
+    def min(self, axis=None, out=None, **kwargs):
+        """minimum value, calculated one time step at a time if axis is None
+        """
+        if axis is not None or out is not None:
+            return np.min(self[:], axis=axis, out=out, **kwargs)
+        return min([np.min(self._read(t)) for t in range(self.shape[0])])
+
+    def clear_cache(self):
+        """drop all the cached time steps
+        """
+        self._cache.clear()
+
+    def cache_info(self):
+        """return a dictionary of the cache statistics
+        """
+        return dict(hits=self.hits, misses=self.misses, window=self.window,
+                    cached=list(self._cache.keys()))
+
+    def __str__(self):
+        return '{}: shape {}, dtype {}, LRU window {}'.\
+               format(self.__class__.__name__, self.shape, self.dtype,
+                      self.window)
+
+
+class MemmapTimeSeries(TimeSeriesStorage):
+    """Time series stored in a ``.npy`` file or a raw binary file
+
+    __init__(filename, shape=None, dtype=None, offset=0, window=4)
+
+    :param string filename: path to the file
+    :param shape: shape of the raw binary data. If None, file is treated as a
+                  ``.npy`` file and shape and dtype are read from its header.
+    :type shape: tuple of int
+    :param dtype: data type of the raw binary data, ignored for ``.npy``
+                  files. Default to be float64.
+    :param int offset: offset in bytes of the raw binary data in the file
+    :param int window: number of time steps kept in memory
+    """
+
+    def __init__(self, filename, shape=None, dtype=None, offset=0, window=4):
+        self.filename = filename
+        if shape is None:
+            self._memmap = np.load(filename, mmap_mode='r')
+        else:
+            if dtype is None:
+                dtype = np.float64
+            self._memmap = np.memmap(filename, dtype=dtype, mode='r',
+                                     offset=offset, shape=tuple(shape))
+        super(MemmapTimeSeries, self).__init__(self._memmap.shape,
+                                               self._memmap.dtype, window)
+
+    def _read(self, t):
+        return self._memmap[t]
+
+    def __getstate__(self):
+        # the mapped file is reopened in the new process instead of copied
+        state = self.__dict__.copy()
+        memmap = state.pop('_memmap')
+        state['_offset'] = memmap.offset
+        state['_fortran'] = memmap.flags.f_contiguous and \
+                            not memmap.flags.c_contiguous
+        return state
+
+    def __setstate__(self, state):
+        offset = state.pop('_offset')
+        order = 'F' if state.pop('_fortran') else 'C'
+        self.__dict__.update(state)
+        self._memmap = np.memmap(self.filename, dtype=self.dtype, mode='r',
+                                 offset=offset, shape=self.shape, order=order)
+
+    @classmethod
+    def from_array(cls, filename, data, window=4):
+        """write *data* into a ``.npy`` file one time step at a time, and
+        return the storage reading from it
+
+        :param string filename: path to the ``.npy`` file to be created
+        :param data: time series, first axis is time
+        :type data: ndarray or :py:class:`TimeSeriesStorage`
+        :param int window: number of time steps kept in memory
+        """
+        out = np.lib.format.open_memmap(filename, mode='w+',
+                                        dtype=data.dtype,
+                                        shape=tuple(data.shape))
+        for t in range(data.shape[0]):
+            out[t] = data[t]
+        out.flush()
+        del out
+        return cls(filename, window=window)
+
+
+class HDF5TimeSeries(TimeSeriesStorage):
+    """Time series stored in a HDF5 dataset
+
+    The file is opened on first read, and kept open until :py:meth:`close` is
+    called. For best performance, the dataset should be chunked with one time
+    step per chunk, as created by :py:meth:`from_array`.
+
+    __init__(filename, dataset, window=4)
+
+    :param string filename: path to the HDF5 file
+    :param string dataset: name of the dataset in the file
+    :param int window: number of time steps kept in memory
+    """
+
+    def __init__(self, filename, dataset, window=4):
+        self.filename = filename
+        self.dataset = dataset
+        self._file = None
+        with h5.File(filename, 'r') as f:
+            shape = f[dataset].shape
+            dtype = f[dataset].dtype
+        super(HDF5TimeSeries, self).__init__(shape, dtype, window)
+
+    def _read(self, t):
+        if self._file is None:
+            self._file = h5.File(self.filename, 'r')
+        return self._file[self.dataset][t]
+
+    def close(self):
+        """close the HDF5 file, it will be reopened on next read
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __getstate__(self):
+        # open file handles can not be pickled, reopen in the new process
+        state = self.__dict__.copy()
+        state['_file'] = None
+        return state
+
+    @classmethod
+    def from_array(cls, filename, dataset, data, compression=None,
+                   window=4):
+        """write *data* into a HDF5 dataset one time step at a time, and
+        return the storage reading from it
+
+        :param string filename: path to the HDF5 file, opened in append mode
+        :param string dataset: name of the dataset to be created
+        :param data: time series, first axis is time
+        :type data: ndarray or :py:class:`TimeSeriesStorage`
+        :param compression: Optional, compression filter passed to h5py,
+                            e.g. 'gzip'
+        :param int window: number of time steps kept in memory
+        """
+        shape = tuple(data.shape)
+        with h5.File(filename, 'a') as f:
+            dset = f.create_dataset(dataset, shape=shape, dtype=data.dtype,
+                                    chunks=(1,)+shape[1:],
+                                    compression=compression)
+            for t in range(shape[0]):
+                dset[t] = data[t]
+        return cls(filename, dataset, window=window)
+
+
+class ComputedTimeSeries(TimeSeriesStorage):
+    """Time series computed on demand, one time step at a time
+
+    Used for quantities derived from loaded data, so only the time steps that
+    are actually requested are calculated.
+
+    __init__(func, shape, dtype=np.float64, window=4)
+
+    :param func: function returns time step *t* as an array, called as
+                 ``func(t)``
+    :param shape: shape of the whole time series, first axis is time
+    :type shape: tuple of int
+    :param dtype: data type of the values
+    :param int window: number of time steps kept in memory
+    """
+
+    def __init__(self, func, shape, dtype=np.float64, window=4):
+        self.func = func
+        super(ComputedTimeSeries, self).__init__(shape, dtype, window)
+
+    def _read(self, t):
+        return self.func(t)
@@ -2,13 +2,21 @@
 """Load XGC output data, interpolate electron density perturbation onto desired Cartesian grid mesh. 
 """
 from ...geometry.grid import Cartesian2D,Cartesian3D
-from ...geometry.support import DelaunayTriFinder
+from ...geometry.support import DelaunayTriFinder, NearestHullVertexFinder, nodes_in_box
 from ...io.funcs import load_m
+from ...io.prefetch import PrefetchReader
+from ...io.forkpool import ForkPool, fork_available, shared_zeros
 from ...math.rungekutta import runge_kutta_explicit
+from ...math.interpolation import barycentric_matrix
+
+import os
+import hashlib
+import contextlib
 
 import numpy as np
 import h5py as h5
-from scipy.spatial import Delaunay, ConvexHull
+from scipy.spatial import Delaunay
+from scipy.sparse import csr_matrix
 from matplotlib.tri import Triangulation
 from matplotlib.tri import CubicTriInterpolator as cubic_interp
 from scipy.interpolate import griddata,CloughTocher2DInterpolator,interp1d,RectBivariateSpline
@@ -17,6 +25,162 @@ import scipy.io.netcdf as nc
 
 # some external functions
 
+def load_planes(dataset, planes, with_mean=False, block_nodes=65536, nodes=None):
+    """read chosen toroidal planes of a XGC 3D quantity, e.g. 'dpot', 'eden'
+    
+    The dataset is stored as (nnode, nplane). If only the planes are wanted, 
+    they are read with one hyperslab selection. If the mean value of the 
+    whole dataset is also wanted, the dataset is read once in blocks of 
+    *block_nodes* nodes, the mean value is accumulated and the chosen planes 
+    are picked out from each block.
+    
+    If *nodes* is given, only the range of nodes between the first and the last chosen node is read, unless the mean value is wanted, and only the chosen nodes are kept.
+    
+    :param dataset: HDF5 dataset with shape (nnode, nplane)
+    :type dataset: :py:class:`h5py.Dataset`
+    :param planes: chosen plane numbers, can be repeated and in any order
+    :type planes: 1D array of int
+    :param bool with_mean: if True, mean value of the whole dataset is also
+                           returned
+    :param int block_nodes: number of nodes read at a time when *with_mean*
+                            is True
+    :param nodes: Optional, sorted indices of the chosen nodes. If None, all nodes are read. If *with_mean* is True, all nodes are still read for the mean value, only the returned data is on the chosen nodes.
+    :type nodes: 1D array of int
+    
+    :return: data on chosen planes, with shape (len(planes), nnode), and the
+             mean value if *with_mean* is True. *nnode* is len(nodes) if *nodes* is given.
+    """
+    nnode, nplane = dataset.shape
+    planes = np.asarray(planes)
+    # h5py selection requires increasing indices
+    unique_planes, inverse = np.unique(planes, return_inverse=True)
+    if not with_mean:
+        if nodes is None:
+            first, last = 0, nnode
+        else:
+            first, last = nodes[0], nodes[-1]+1
+        if len(unique_planes) == nplane:
+            data = dataset[first:last]
+        else:
+            data = dataset[first:last, unique_planes]
+        if nodes is not None:
+            data = data[nodes-first]
+        return np.swapaxes(data, 0, 1)[inverse]
+    if nodes is None:
+        nodes = np.arange(nnode)
+    data = np.empty((len(unique_planes), len(nodes)), dtype=dataset.dtype)
+    total = 0.
+    for start in range(0, nnode, block_nodes):
+        stop = min(start+block_nodes, nnode)
+        block = dataset[start:stop]
+        total += np.sum(block, dtype=np.float64)
+        lo, hi = np.searchsorted(nodes, [start, stop])
+        data[:, lo:hi] = np.swapaxes(block[nodes[lo:hi]-start][:, unique_planes], 0, 1)
+    return data[inverse], total/(nnode*nplane)
+
+def load_fluctuation_file(flucf, quantities, planes=None, with_mean=False, nodes=None):
+    """read chosen quantities from one XGC 3D output file 'xgc.3d.NNNNN.h5'
+    
+    :param string flucf: file name
+    :param quantities: names of the quantities, e.g. ['dpot', 'eden']
+    :type quantities: list of strings
+    :param planes: Optional, chosen planes, see :py:func:`load_planes`. If 
+                   None, all planes are read.
+    :type planes: 1D array of int
+    :param bool with_mean: if True, mean value of each quantity is also 
+                           returned. Only used when *planes* is given.
+    :param nodes: Optional, sorted indices of the chosen mesh nodes, see :py:func:`load_planes`. If None, all nodes are read.
+    :type nodes: 1D array of int
+    
+    :return: dictionary contains data for each quantity, the values are the 
+             returns of :py:func:`load_planes`, or arrays with shape 
+             (nplane, nnode) if planes is None.
+    """
+    fluc_mesh = h5.File(flucf,'r')
+    result = {}
+    for name in quantities:
+        if planes is None:
+            if nodes is None:
+                result[name] = np.swapaxes(fluc_mesh[name][...],0,1)
+            else:
+                data = fluc_mesh[name][nodes[0]:nodes[-1]+1]
+                result[name] = np.swapaxes(data[nodes-nodes[0]],0,1)
+        else:
+            result[name] = load_planes(fluc_mesh[name], planes, with_mean, nodes=nodes)
+    fluc_mesh.close()
+    return result
+
+def _interpolate_block(context, step, rows, columns):
+    """worker of :py:class:`GridInterpolation`, interpolates one block of grid points and value columns of time step *step*, and writes it directly into the output array
+    """
+    values = context['values'][..., columns]
+    context['out'][columns, step, rows] = context['func'](values, rows).T
+
+class GridInterpolation(object):
+    """Interpolation of node values onto the grid points, one time step at a time
+
+    __init__(func, node_shape, n_points, n_column, nt, split_rows, n_workers=1)
+
+    Each time step has *n_column* independent value columns, e.g. quantities and cross sections. The interpolation of a time step is split into *n_workers* blocks, of grid points if *split_rows* is True, otherwise of columns, and the blocks are interpolated by the workers of a :py:class:`sdp.io.forkpool.ForkPool`. The pool is created once with the interpolation, and the workers inherit *func*. Node values of each time step are passed to them through a buffer in shared memory, and they write the results directly into :py:attr:`out`, which is also in shared memory.
+
+    :param func: called as ``func(values, rows)``, maps node values with shape node_shape+(m,) to the values on the grid points *rows*, with shape (n_rows, m)
+    :param tuple node_shape: shape of the node values of one column
+    :param int n_points: number of grid points
+    :param int n_column: number of value columns in each time step
+    :param int nt: number of time steps
+    :param bool split_rows: if True, blocks of grid points are given to the workers, otherwise blocks of columns.
+    :param int n_workers: number of worker processes. If 1, or fork is not available on the platform, the blocks are interpolated in this process.
+    :var out: interpolated values, shape (n_column, nt, n_points)
+    """
+
+    def __init__(self, func, node_shape, n_points, n_column, nt, split_rows, n_workers=1):
+        n_split = n_points if split_rows else n_column
+        n_block = max(min(n_workers, n_split), 1)
+        zeros = shared_zeros if n_block > 1 and fork_available() else np.zeros
+        self.out = zeros((n_column, nt, n_points))
+        self._values = zeros(tuple(node_shape)+(n_column,))
+        bounds = np.linspace(0, n_split, n_block+1).astype(int)
+        blocks = [slice(bounds[i], bounds[i+1]) for i in range(n_block)]
+        if split_rows:
+            self._blocks = [(block, slice(None)) for block in blocks]
+        else:
+            self._blocks = [(slice(None), block) for block in blocks]
+        self._pool = ForkPool(n_block, func=func, values=self._values, out=self.out)
+
+    def interpolate(self, step, values):
+        """interpolate the node *values* of time step *step*, with shape node_shape+(n_column,), into ``out[:, step]``
+        """
+        self._values[...] = values
+        self._pool.map(_interpolate_block, [(step,)+block for block in self._blocks])
+
+    def close(self):
+        """shut down the worker processes
+        """
+        self._pool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+class _SparseInterpolation(object):
+    """linear interpolation by a sparse weight matrix, used as *func* of :py:class:`GridInterpolation`
+
+    The rows of the matrix are picked out once for each block of grid points.
+    """
+
+    def __init__(self, weights):
+        self.weights = weights
+        self._row_blocks = {}
+
+    def __call__(self, values, rows):
+        key = (rows.start, rows.stop)
+        if key not in self._row_blocks:
+            self._row_blocks[key] = self.weights[rows]
+        return self._row_blocks[key].dot(values.reshape(self.weights.shape[1], -1))
+
 def get_interp_planes(my_xgc):
     """Get the plane numbers used for interpolation for each point 
     """
@@ -181,6 +345,84 @@ def find_interp_positions_v2_upgrade(my_xgc,Nstep = 10):
 
     return interp_positions
 
+
+# default directory for storing the traced field line maps, per user
+FIELDLINE_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.sdp_cache', 
+                                   'xgc_fieldline')
+
+def files_digest(fnames, block_size=1<<20):
+    """return the SHA-1 hex digest of the contents of files *fnames*
+    
+    Files are read in blocks of *block_size* bytes. Reading the XGC mesh and 
+    bfield files is much faster than tracing the field lines or interpolating 
+    the fluctuations, and unlike size and modification time, the contents 
+    don't change when the files are copied or touched.
+    
+    :param fnames: paths of the files, in a fixed order
+    :type fnames: list of strings
+    """
+    sha = hashlib.sha1()
+    for fname in fnames:
+        with open(fname, 'rb') as f:
+            for block in iter(lambda: f.read(block_size), b''):
+                sha.update(block)
+        # separates the files, so moving bytes from one to the next changes 
+        # the digest
+        sha.update(b'\0')
+    return sha.hexdigest()
+
+def fieldline_map_key(my_xgc, Nstep=10):
+    """hash key of the field line map of a XGC_Loader object
+    
+    The map depends only on the XGC mesh and bfield files, the 3D grid, the 
+    number and direction of the toroidal planes, and the tracing step number.
+    The files are identified by their contents, see :py:func:`files_digest`.
+    """
+    sha = hashlib.sha1()
+    sha.update(files_digest([my_xgc.mesh_file, my_xgc.bfield_file]).encode())
+    for coord in (my_xgc.grid.z3D, my_xgc.grid.r3D, my_xgc.grid.phi3D):
+        coord = np.ascontiguousarray(coord, dtype=np.float64)
+        sha.update(str(coord.shape).encode())
+        sha.update(coord.tobytes())
+    sha.update('{0} {1} {2}'.format(my_xgc.n_plane, my_xgc.CO_DIR, 
+                                    Nstep).encode())
+    return sha.hexdigest()
+
+def find_interp_positions_cached(my_xgc, Nstep=10, cache_dir=FIELDLINE_CACHE_DIR):
+    """Cached version of :py:func:`find_interp_positions_v2_upgrade`
+    
+    The traced field line map is saved in *cache_dir* as a .npy file, named 
+    by :py:func:`fieldline_map_key`. Later calls with the same mesh, bfield
+    file and grid load the map from disk instead of tracing the field lines 
+    again. Argument and return value are the same as 
+    find_interp_positions_v2_upgrade.
+    
+    :param string cache_dir: directory for the saved maps, default to be 
+                             :py:data:`FIELDLINE_CACHE_DIR`. If None, no cache
+                             is used.
+    """
+    if cache_dir is None:
+        return find_interp_positions_v2_upgrade(my_xgc, Nstep)
+    key = fieldline_map_key(my_xgc, Nstep)
+    fname = os.path.join(cache_dir, 'fieldline_{0}.npy'.format(key))
+    if os.path.exists(fname):
+        print('field line map loaded from {0}'.format(fname))
+        return np.load(fname)
+    interp_positions = find_interp_positions_v2_upgrade(my_xgc, Nstep)
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        # write to a temporary file first, so other processes never read a 
+        # partially written map
+        tmp_fname = '{0}.{1}.tmp'.format(fname, os.getpid())
+        with open(tmp_fname, 'wb') as f:
+            np.save(f, interp_positions)
+        os.replace(tmp_fname, fname)
+        print('field line map saved to {0}'.format(fname))
+    except OSError as e:
+        print('field line map can not be saved: {0}'.format(e))
+    return interp_positions
+
     
 def find_interp_positions_v2(my_xgc):
     """new version to find the interpolation positions. Using B field information and follows the exact field line.
@@ -414,7 +656,8 @@ class XGC_Loader():
     """
 
     def __init__(self,xgc_path,grid,time_steps,dn_amplifier = 1.0, n_cross_section = 1,equilibrium_mesh = '2D',Equilibrium_Only = False,Full_Load = True, Fluc_Only = True,Fluc_Filtering = False,
-                 load_ions = False):
+                 load_ions = False, n_prefetch = 2, 
+                 fieldline_cache_dir = FIELDLINE_CACHE_DIR, fluc_interp = 'linear', n_workers = 1, crop_margin = None, use_processes = False):
         """The main caller of all functions to prepare a loaded XGC profile.
 
             :param string xgc_path: the directory of all the XGC output files
@@ -428,6 +671,12 @@ class XGC_Loader():
             :param boolean Full_Load: A flag for debugging, default to be True, i.e. load all data when initializing, if set to be False, then only constants are set, no loading functions will be called during initialization, programmer can call them one by one afterwards.
             :param boolean Fluc_Only: A flag determining fluctuation loading method. Default to be True. Fluc_Only == True uses newer loading method to remove equilibrium relaxation effects. Fluc_Only == False uses old version and load all the calculated density deviations from the equilibrium.
             :param boolean Fluc_Filtering: A flag determining whether filter out the fluctuations that are larger than background equilibrium. If True, fluctuations will be filtered. Default to be False.
+            :param int n_prefetch: number of fluctuation files read ahead in background while the current time step is processed and interpolated onto the grid. Default to be 2. If 0, files are read one by one.
+            :param boolean use_processes: if True, fluctuation files are read ahead in background processes instead of threads, see :py:class:`sdp.io.prefetch.PrefetchReader`. Useful if reading is limited by the decompression holding the GIL. Default to be False.
+            :param string fieldline_cache_dir: directory where the traced field line maps for 3D grids are saved and reused, see :py:func:`find_interp_positions_cached`. Default to be :py:data:`FIELDLINE_CACHE_DIR`. If None, no map is saved and field lines are always traced.
+            :param string fluc_interp: interpolation method of fluctuations from XGC mesh onto the grid. 'linear' uses barycentric weights, which are calculated once for each grid and applied to all quantities and cross sections of a time step with one sparse matrix product. 'cubic' uses Clough-Tocher interpolation, which is smoother, but builds new interpolators for every time step and block of columns. Default to be 'linear'.
+            :param int n_workers: number of worker processes used for interpolating fluctuations onto the grid, see :py:class:`GridInterpolation`. Default to be 1, no extra process is used.
+            :param float crop_margin: if given, fluctuations are only read and interpolated on the mesh nodes around the grid, see :py:meth:`select_fluctuation_nodes`. In meter. With Fluc_Only False, the whole mesh is still read for the mean values, only the memory and the interpolation are reduced. Default to be None, fluctuations are loaded on the whole mesh.
         """
 
         print('Loading XGC output data')
@@ -448,6 +697,14 @@ class XGC_Loader():
         self.Equilibrium_Only = Equilibrium_Only
         self.Fluc_Only = Fluc_Only
         self.Fluc_Filtering = Fluc_Filtering
+        self.n_prefetch = n_prefetch
+        self.use_processes = use_processes
+        self.fieldline_cache_dir = fieldline_cache_dir
+        if fluc_interp not in ('cubic', 'linear'):
+            raise XGC_Loader_Error('fluc_interp must be "cubic" or "linear", got {0}.'.format(fluc_interp))
+        self.fluc_interp = fluc_interp
+        self.n_workers = n_workers
+        self.crop_margin = crop_margin
         
         print('from directory:'+ self.xgc_path)
         self.unit_dic = load_m(self.unit_file)
@@ -530,6 +787,8 @@ class XGC_Loader():
         if self.dimension == 2:
             if isinstance(grid,Cartesian2D):
                 self.grid = grid
+                if self.crop_margin is not None:
+                    self.reload_fluctuations()
                 self.interpolate_all_on_grid_2D()
             elif isinstance(grid,Cartesian3D):
                 self.dimension = 3
@@ -571,6 +830,8 @@ class XGC_Loader():
         else:
             if isinstance(grid,Cartesian3D):
                 self.grid = grid
+                if self.crop_margin is not None:
+                    self.reload_fluctuations()
                 self.interpolate_all_on_grid_3D()
             elif isinstance(grid,Cartesian2D):
                 self.dimension = 2
@@ -598,6 +859,69 @@ class XGC_Loader():
                 raise XGC_Loader_Error( 'NOT VALID GRID, please use either Cartesian3D or Cartesian2D grids.Grid NOT changed.')
                 
     
+    def reload_fluctuations(self):
+        """load equilibrium and fluctuations again after the grid is changed, needed when fluctuations are cropped around the old grid. Equilibrium is reloaded since fluctuation loading modifies *ne0* and *ni0*.
+        """
+        self.load_eq_2D3D()
+        if self.dimension == 2:
+            if (self.Fluc_Only):
+                self.load_fluctuations_2D_fluc_only()
+            else:
+                self.load_fluctuations_2D_all()
+        else:
+            if (self.Fluc_Only):
+                self.load_fluctuations_3D_fluc_only()
+            else:
+                self.load_fluctuations_3D_all()
+        self.calculate_dne_ad_2D3D()
+        print('fluctuations reloaded around the new grid.')
+
+    def select_fluctuation_nodes(self):
+        """choose the mesh nodes on which fluctuations are loaded and interpolated
+
+        If *crop_margin* is None, all nodes are chosen. Otherwise, only the nodes inside the bounding box of the wanted points, enlarged by *crop_margin* on each side, are chosen. For 2D grids the wanted points are the grid points. For 3D grids they are the field line traced positions on the neighbouring planes, see :py:func:`find_interp_positions_cached`, so the box also covers the field line excursions.
+
+        The readers only keep the values on the chosen nodes. When Fluc_Only is False, the mean value of each quantity over the whole mesh is needed, so :py:func:`load_planes` still reads every node, and cropping doesn't reduce the reading in this case.
+
+        Create Attributes:
+            fluc_nodes: sorted indices of the chosen nodes
+            fluc_Delaunay: triangulation of the chosen nodes, used by :py:meth:`interpolate_fluctuations`
+        """
+        n_node = len(self.mesh['R'])
+        if self.crop_margin is None:
+            self.fluc_nodes = np.arange(n_node)
+            self.fluc_Delaunay = self.Delaunay
+            return
+        if self.dimension == 2:
+            wanted = np.array([self.grid.Z2D.ravel(), self.grid.R2D.ravel()]).T
+        else:
+            interp_positions = self._get_interp_positions()
+            wanted = np.array([interp_positions[:,0].ravel(), interp_positions[:,1].ravel()]).T
+        self.fluc_nodes = nodes_in_box(self.points, wanted, self.crop_margin)
+        if len(self.fluc_nodes) < 3:
+            raise XGC_Loader_Error('Too few mesh nodes around the grid, try a larger crop_margin. {0} nodes found.'.format(len(self.fluc_nodes)))
+        self.fluc_Delaunay = Delaunay(self.points[self.fluc_nodes])
+        print('fluctuations cropped to {0} of {1} mesh nodes.'.format(len(self.fluc_nodes), n_node))
+
+    def _get_interp_positions(self):
+        """return the field line traced positions of the current 3D grid, see :py:func:`find_interp_positions_cached`
+
+        The positions are kept in *_interp_positions* together with the grid they are traced for, so field lines are traced only once for each grid, even without *fieldline_cache_dir*.
+        """
+        cached = getattr(self, '_interp_positions', None)
+        if cached is None or cached[0] is not self.grid:
+            cached = (self.grid, find_interp_positions_cached(self, cache_dir=self.fieldline_cache_dir))
+            self._interp_positions = cached
+        return cached[1]
+
+    @property
+    def _crop_nodes(self):
+        """the chosen nodes passed to the readers, None if fluctuations are not cropped
+        """
+        if self.crop_margin is None:
+            return None
+        return self.fluc_nodes
+
     def load_mesh_2D(self):
         """Load the R-Z data
 
@@ -699,6 +1023,42 @@ class XGC_Loader():
         self.CO_DIR = (np.sign(self.BPhi[0]) > 0)
         return 0
 
+    def fluctuation_file_name(self, time_step):
+        """return the name of the XGC 3D output file for *time_step*
+        """
+        return self.xgc_path + 'xgc.3d.'+str(time_step).zfill(5)+'.h5'
+
+    def fluctuation_quantities(self):
+        """return the names of the fluctuation quantities needed for loading
+        """
+        quantities = ['dpot']
+        if(self.HaveElectron):
+            quantities.append('eden')
+        if(self.load_ions):
+            quantities.append('iden')
+        return quantities
+
+    def fluctuation_reader(self, quantities=None, planes=None, with_mean=False):
+        """return an iterator over the fluctuation data of all time steps
+        
+        The next *self.n_prefetch* files are read on background threads, or processes if *self.use_processes* is True, while
+        the current time step is processed. See :py:func:`load_fluctuation_file` for the arguments and the content of each item.
+        
+        :rtype: :py:class:`sdp.io.prefetch.PrefetchReader`
+        """
+        if quantities is None:
+            quantities = self.fluctuation_quantities()
+        args_list = [(self.fluctuation_file_name(t), quantities, planes, with_mean, self._crop_nodes) for t in self.time_steps]
+        return PrefetchReader(load_fluctuation_file, args_list, n_prefetch=self.n_prefetch, use_processes=self.use_processes)
+
+    def load_n_plane(self):
+        """read the total number of toroidal planes from the first fluctuation file
+        """
+        fluc_mesh = h5.File(self.fluctuation_file_name(self.time_steps[0]),'r')
+        self.n_plane = fluc_mesh['dpot'].shape[1]
+        fluc_mesh.close()
+        return self.n_plane
+
     def load_fluctuations_2D_all(self):
         """Load non-adiabatic electron density and electrical static potential fluctuations
         the mean value of these two quantities on each time step is also calculated.
@@ -706,39 +1066,35 @@ class XGC_Loader():
         Note that for full-F runs, the purturbed electron density includes both turbulent fluctuations and equilibrium relaxation, this loading method doesn't differentiate them and will read all of them.
 
         """
+        self.select_fluctuation_nodes()
         if(self.HaveElectron):
-            self.nane = np.zeros( (self.n_cross_section,len(self.time_steps),len(self.mesh['R'])) )
+            self.nane = np.zeros( (self.n_cross_section,len(self.time_steps),len(self.fluc_nodes)) )
             self.nane_bar = np.zeros((len(self.time_steps)))
         if(self.load_ions):
-            self.dni = np.zeros( (self.n_cross_section,len(self.time_steps),len(self.mesh['R'])) )
+            self.dni = np.zeros( (self.n_cross_section,len(self.time_steps),len(self.fluc_nodes)) )
             self.dni_bar = np.zeros((len(self.time_steps)))
             
-        self.phi = np.zeros((self.n_cross_section,len(self.time_steps),len(self.mesh['R'])))
+        self.phi = np.zeros((self.n_cross_section,len(self.time_steps),len(self.fluc_nodes)))
         self.phi_bar = np.zeros((len(self.time_steps)))
-        for i in range(len(self.time_steps)):
-            flucf = self.xgc_path + 'xgc.3d.'+str(self.time_steps[i]).zfill(5)+'.h5'
-            fluc_mesh = h5.File(flucf,'r')
-            if (i == 0):
-                self.n_plane = fluc_mesh['dpot'].shape[1]
-                dn = int(self.n_plane/self.n_cross_section)
-                self.planes = np.arange(self.n_cross_section) * dn
-
-            self.phi_bar[i] = np.mean(fluc_mesh['dpot'][...])                
-            if(self.HaveElectron):
-                self.nane_bar[i] = np.mean(fluc_mesh['eden'][...])
-            if(self.load_ions):
-                self.dni_bar[i] = np.mean(fluc_mesh['iden'][...])
-            for j in range(self.n_cross_section):
-                self.phi[j,i] += np.swapaxes(fluc_mesh['dpot'][...][:,self.planes[j]],0,1)
-                self.phi[j,i] -= self.phi_bar[i]
-
+        self.dne_ad = np.zeros(self.phi.shape)
+        self.load_n_plane()
+        dn = int(self.n_plane/self.n_cross_section)
+        self.planes = np.arange(self.n_cross_section) * dn
+        #the equilibrium is not modified, so each time step is final once it is read, and is interpolated onto the grid while the next files are read.
+        names = self._fluctuation_names()
+        with self._interpolation_while_reading(names) as interpolation:
+            for i, fluc in enumerate(self.fluctuation_reader(planes=self.planes, with_mean=True)):
+                phi_planes, self.phi_bar[i] = fluc['dpot']
+                self.phi[:,i] = phi_planes - self.phi_bar[i]
                 if(self.HaveElectron):
-                    self.nane[j,i] += np.swapaxes(fluc_mesh['eden'][...][:,self.planes[j]],0,1)
-                    self.nane[j,i] -= self.nane_bar[i]
+                    nane_planes, self.nane_bar[i] = fluc['eden']
+                    self.nane[:,i] = nane_planes - self.nane_bar[i]
                 if(self.load_ions):
-                    self.dni[j,i] += np.swapaxes(fluc_mesh['iden'][...][:,self.planes[j]],0,1)
-                    self.dni[j,i] -= self.dni_bar[i]
-            fluc_mesh.close()
+                    dni_planes, self.dni_bar[i] = fluc['iden']
+                    self.dni[:,i] = dni_planes - self.dni_bar[i]
+                self._calculate_dne_ad_step(i)
+                if interpolation is not None:
+                    interpolation.interpolate(i, self._step_values(names, i))
 
 
         
@@ -762,73 +1118,51 @@ class XGC_Loader():
         and the effective equilibrium is given by: n0_eff = n0 + <delta_n>_zeta_t ,
         where n0 is the input equilibrium, and <...>_zeta_t denotes average over both toroidal and time.
         """
+        self.select_fluctuation_nodes()
         #first we load one file to obtain the total plane number used in the simulation
-        flucf = self.xgc_path + 'xgc.3d.'+str(self.time_steps[0]).zfill(5)+'.h5'
-        fluc_mesh = h5.File(flucf,'r')        
-        self.n_plane = fluc_mesh['dpot'].shape[1]
+        self.load_n_plane()
         dn = int(self.n_plane/self.n_cross_section)#dn is the increment between two chosen cross-sections, if total chosen number is greater than total simulation plane number, an error will occur.
         self.planes = np.arange(self.n_cross_section)*dn
 
         if(self.HaveElectron):
-            self.nane = np.zeros( (self.n_cross_section,len(self.time_steps),len(self.mesh['R'])))
-            nane_all = np.zeros( (self.n_plane, len(self.time_steps), len(self.mesh['R']) ) )
+            self.nane = np.zeros( (self.n_cross_section,len(self.time_steps),len(self.fluc_nodes)))
+            nane_avg_tor = np.zeros( (len(self.time_steps), len(self.fluc_nodes) ) )
         if(self.load_ions):
-            self.dni = np.zeros( (self.n_cross_section,len(self.time_steps),len(self.mesh['R'])))
-            dni_all = np.zeros( (self.n_plane, len(self.time_steps), len(self.mesh['R']) ) )
-        self.phi = np.zeros((self.n_cross_section,len(self.time_steps),len(self.mesh['R'])))
-        phi_all = np.zeros((self.n_plane,len(self.time_steps),len(self.mesh['R'])))
-
-        #after initializing the arrays to hold the data, we load the data from the first chosen step
-        for j in range(self.n_plane):
-            phi_all[j,0] += np.swapaxes(fluc_mesh['dpot'][...][:,j],0,1)
-            if(self.HaveElectron):
-                nane_all[j,0] += np.swapaxes(fluc_mesh['eden'][...][:,j],0,1)
-            if(self.load_ions):
-                dni_all[j,0] += np.swapaxes(fluc_mesh['iden'][...][:,j],0,1)
-        fluc_mesh.close()
-        
-        for i in range(1,len(self.time_steps)):
-            #now we load all the data from rest of the chosen time steps. 
-            flucf = self.xgc_path + 'xgc.3d.'+str(self.time_steps[i]).zfill(5)+'.h5'
-            fluc_mesh = h5.File(flucf,'r')
-                
-            for j in range(self.n_plane):
-                phi_all[j,i] += np.swapaxes(fluc_mesh['dpot'][...][:,j],0,1)
-                if(self.HaveElectron):
-                    nane_all[j,i] += np.swapaxes(fluc_mesh['eden'][...][:,j],0,1)
-                if(self.load_ions):
-                    dni_all[j,i] += np.swapaxes(fluc_mesh['iden'][...][:,j],0,1)
-            fluc_mesh.close()
-
-
+            self.dni = np.zeros( (self.n_cross_section,len(self.time_steps),len(self.fluc_nodes)))
+            dni_avg_tor = np.zeros( (len(self.time_steps), len(self.fluc_nodes) ) )
+        self.phi = np.zeros((self.n_cross_section,len(self.time_steps),len(self.fluc_nodes)))
+        phi_avg_tor = np.zeros((len(self.time_steps),len(self.fluc_nodes)))
 
-        #now, all data is ready, we need to pick the chosen cross sections and do some post process. Since XGC-1 has full-f capability, the deviation from input equilibrium is not only fluctuations induced by turbulences, but also relaxation of the equilibrium. Since we are only interested in the former part, we need to screen out the latter effect.[*] The way of doing this is as follows:
+        #we load the data from all the chosen steps. Each quantity is read from file only once, containing all planes. Since XGC-1 has full-f capability, the deviation from input equilibrium is not only fluctuations induced by turbulences, but also relaxation of the equilibrium. Since we are only interested in the former part, we need to screen out the latter effect.[*] The way of doing this is as follows:
         # Since the relaxation of equilibrium should be the same across the whole flux surface, it naturally is the same along toroidal direction. Given that no large n=0 mode exists in the turbulent spectra, the toroidal average of the calculated delta-n will mainly be the equilibrium relaxation. However, this effect might be important, so we keep the time-averaged relaxation effect to add it into the input equilibrium. The final formula for density fluctuation (as well as potential fluctuation) is then:
         #   n_tilde = delta_n - <delta_n>_zeta , where delta_n is the calculated result, and <...>_zeta denotes average in toroidal direction.
         # and the effective equilibrium is given by:
         #   n0_eff = n0 + <delta_n>_zeta_t , where n0 is the input equilibrium, and <...>_zeta_t denotes average over both toroidal and time.
 
-        # first, we calculate the n_tilde, note that we have adiabatic and non-adiabatic parts. The adiabatic part is given by the potential, and will be calculated later in calc_total_ne_2D3D.
-        phi_avg_tor = np.average(phi_all,axis = 0)
-        if(self.HaveElectron):
-            nane_avg_tor = np.average(nane_all,axis=0)
-        if(self.load_ions):
-            dni_avg_tor = np.average(dni_all,axis=0)
-        for j in range(self.n_cross_section):
-            self.phi[j,:,:] = phi_all[self.planes[j],:,:] - phi_avg_tor[:,:]
-            if(self.HaveElectron):
-                self.nane[j,:,:] = nane_all[self.planes[j],:,:] - nane_avg_tor[:,:]
-            if(self.load_ions):
-                self.dni[j,:,:] = dni_all[self.planes[j],:,:] - dni_avg_tor[:,:]
+        # first, we calculate the n_tilde for each time step, note that we have adiabatic and non-adiabatic parts. The adiabatic part is given by the potential, and will be calculated later in calculate_dne_ad_2D3D, since it depends on the modified equilibrium.
+        # n_tilde of each time step is final once the step is read, and is interpolated onto the grid while the next files are read. Filtered quantities depend on the modified equilibrium, and are interpolated later.
+        names = [name for name in self._fluctuation_names() if name == 'phi' or (name != 'dne_ad' and not self.Fluc_Filtering)]
+        with self._interpolation_while_reading(names) as interpolation:
+            for i, fluc in enumerate(self.fluctuation_reader()):
+                phi_avg_tor[i] = np.average(fluc['dpot'],axis = 0)
+                self.phi[:,i] = fluc['dpot'][self.planes] - phi_avg_tor[i]
+                if(self.HaveElectron):
+                    nane_avg_tor[i] = np.average(fluc['eden'],axis = 0)
+                    self.nane[:,i] = fluc['eden'][self.planes] - nane_avg_tor[i]
+                if(self.load_ions):
+                    dni_avg_tor[i] = np.average(fluc['iden'],axis = 0)
+                    self.dni[:,i] = fluc['iden'][self.planes] - dni_avg_tor[i]
+                if interpolation is not None:
+                    interpolation.interpolate(i, self._step_values(names, i))
 
         # then, we add the averaged relaxation modification to the input equilibrium
 
-        self.ne0[:] += np.average(phi_avg_tor,axis = 0)
+        self.ne0[self.fluc_nodes] += np.average(phi_avg_tor,axis = 0)
         if(self.HaveElectron):
-            self.ne0[:] += np.average(nane_avg_tor,axis = 0)
-        self.ni0[:] += np.average(phi_avg_tor,axis = 0)
+            self.ne0[self.fluc_nodes] += np.average(nane_avg_tor,axis = 0)
+        self.ni0[self.fluc_nodes] += np.average(phi_avg_tor,axis = 0)
         if(self.load_ions):
-            self.ni0[:] += np.average(dni_avg_tor,axis = 0)
+            self.ni0[self.fluc_nodes] += np.average(dni_avg_tor,axis = 0)
         
         
         return 0
@@ -840,48 +1174,43 @@ class XGC_Loader():
         the mean value of these two quantities on each time step is also calculated.
         for multiple cross-section runs, data is stored under each center_plane index.
         """
-        #similar to the 2D case, we first read one file to determine the total toroidal plane number in the simulation
-        flucf = self.xgc_path + 'xgc.3d.'+str(self.time_steps[0]).zfill(5)+'.h5'
-        fluc_mesh = h5.File(flucf,'r')
-
+        self.select_fluctuation_nodes()
+        #total toroidal plane number in the simulation has been read from the mesh file
         self.planes = np.unique(np.array([np.unique(self.prevplane),np.unique(self.nextplane)]))
         self.planeID = {self.planes[i]:i for i in range(len(self.planes))} #the dictionary contains the positions of each chosen plane, useful when we want to get the data on a given plane known only its plane number in xgc file.
         if(self.HaveElectron):
-            self.nane = np.zeros( (self.n_cross_section,len(self.time_steps),len(self.planes),len(self.mesh['R'])) )
+            self.nane = np.zeros( (self.n_cross_section,len(self.time_steps),len(self.planes),len(self.fluc_nodes)) )
             self.nane_bar = np.zeros((len(self.time_steps)))
 
         if(self.load_ions):
-            self.dni = np.zeros( (self.n_cross_section,len(self.time_steps),len(self.planes),len(self.mesh['R'])) )
+            self.dni = np.zeros( (self.n_cross_section,len(self.time_steps),len(self.planes),len(self.fluc_nodes)) )
             self.dni_bar = np.zeros((len(self.time_steps)))
 
-        self.phi = np.zeros( (self.n_cross_section,len(self.time_steps),len(self.planes),len(self.mesh['R'])) )
+        self.phi = np.zeros( (self.n_cross_section,len(self.time_steps),len(self.planes),len(self.fluc_nodes)) )
         self.phi_bar = np.zeros((len(self.time_steps)))
-        for i in range(len(self.time_steps)):
-            flucf = self.xgc_path + 'xgc.3d.'+str(self.time_steps[i]).zfill(5)+'.h5'
-            fluc_mesh = h5.File(flucf,'r')
-
-            if(i==0):
-                #self.n_plane = fluc_mesh['dpot'].shape[1]
-                dn = int(self.n_plane/self.n_cross_section)
-                self.center_planes = np.arange(self.n_cross_section)*dn
-
-            self.phi_bar[i] = np.mean(fluc_mesh['dpot'][...])
-            if (self.HaveElectron):
-                self.nane_bar[i] = np.mean(fluc_mesh['eden'][...])
-            if (self.load_ions):
-                self.dni_bar[i] = np.mean(fluc_mesh['iden'][...])
-                
-            for j in range(self.n_cross_section):
-                self.phi[j,i] += np.swapaxes(fluc_mesh['dpot'][...][:,(self.center_planes[j] + self.planes)%self.n_plane],0,1)
-                self.phi[j,i] -= self.phi_bar[i]
+        dn = int(self.n_plane/self.n_cross_section)
+        self.center_planes = np.arange(self.n_cross_section)*dn
+        # planes needed by all cross sections are read together, 
+        # ordered as (cross_section, plane)
+        cs_planes = (self.center_planes[:,np.newaxis] + self.planes[np.newaxis,:])%self.n_plane
+        cs_shape = (self.n_cross_section, len(self.planes), len(self.fluc_nodes))
+        self.dne_ad = np.zeros(self.phi.shape)
+        #the equilibrium is not modified, so each time step is final once it is read, and is interpolated onto the grid while the next files are read.
+        names = self._fluctuation_names()
+        with self._interpolation_while_reading(names) as interpolation:
+            for i, fluc in enumerate(self.fluctuation_reader(planes=cs_planes.ravel(), with_mean=True)):
+                phi_planes, self.phi_bar[i] = fluc['dpot']
+                self.phi[:,i] = phi_planes.reshape(cs_shape) - self.phi_bar[i]
                 if(self.HaveElectron):
-                    self.nane[j,i] += np.swapaxes(fluc_mesh['eden'][...][:,(self.center_planes[j] + self.planes)%self.n_plane],0,1)
-                    self.nane[j,i] -= self.nane_bar[i]
+                    nane_planes, self.nane_bar[i] = fluc['eden']
+                    self.nane[:,i] = nane_planes.reshape(cs_shape) - self.nane_bar[i]
                 if(self.load_ions):
-                    self.dni[j,i] += np.swapaxes(fluc_mesh['iden'][...][:,(self.center_planes[j] + self.planes)%self.n_plane],0,1)
-                    self.dni[j,i] -= self.dni_bar[i]
-            fluc_mesh.close()
-            
+                    dni_planes, self.dni_bar[i] = fluc['iden']
+                    self.dni[:,i] = dni_planes.reshape(cs_shape) - self.dni_bar[i]
+                self._calculate_dne_ad_step(i)
+                if interpolation is not None:
+                    interpolation.interpolate(i, self._step_values(names, i))
+
         return 0
 
     def load_fluctuations_3D_fluc_only(self):
@@ -892,11 +1221,9 @@ class XGC_Loader():
         
         for multiple cross-section runs, data is stored under each center_plane index.
         """
+        self.select_fluctuation_nodes()
         #similar to the 2D case, we first read one file to determine the total toroidal plane number in the simulation
-        flucf = self.xgc_path + 'xgc.3d.'+str(self.time_steps[0]).zfill(5)+'.h5'
-        fluc_mesh = h5.File(flucf,'r')
-
-        self.n_plane = fluc_mesh['dpot'].shape[1]
+        self.load_n_plane()
         dn = int(self.n_plane/self.n_cross_section)
         self.center_planes = np.arange(self.n_cross_section)*dn
 
@@ -905,48 +1232,37 @@ class XGC_Loader():
 
         #initialize the arrays
         if(self.HaveElectron):
-            self.nane = np.zeros( (self.n_cross_section,len(self.time_steps),len(self.planes),len(self.mesh['R'])) )
-            nane_all = np.zeros((self.n_plane,len(self.time_steps),len(self.mesh['R'])))
+            self.nane = np.zeros( (self.n_cross_section,len(self.time_steps),len(self.planes),len(self.fluc_nodes)) )
+            nane_avg_tor = np.zeros((len(self.time_steps),len(self.fluc_nodes)))
         if(self.load_ions):
-            self.dni = np.zeros( (self.n_cross_section,len(self.time_steps),len(self.planes),len(self.mesh['R'])) )
-            dni_all = np.zeros((self.n_plane,len(self.time_steps),len(self.mesh['R'])))
-        self.phi = np.zeros( (self.n_cross_section,len(self.time_steps),len(self.planes),len(self.mesh['R'])) )
-        phi_all = np.zeros((self.n_plane,len(self.time_steps),len(self.mesh['R'])))
-
-        #load all the rest of the files
-        for i in range(1,len(self.time_steps)):
-            flucf = self.xgc_path + 'xgc.3d.'+str(self.time_steps[i]).zfill(5)+'.h5'
-            fluc_mesh = h5.File(flucf,'r')
-            for j in range(self.n_plane):
-                phi_all[j,i] += np.swapaxes(fluc_mesh['dpot'][...][:,j],0,1)
-                if(self.HaveElectron):
-                    nane_all[j,i] += np.swapaxes(fluc_mesh['eden'][...][:,j],0,1)
-                if(self.load_ions):
-                    dni_all[j,i] += np.swapaxes(fluc_mesh['iden'][...][:,j],0,1)
-            fluc_mesh.close()
-
+            self.dni = np.zeros( (self.n_cross_section,len(self.time_steps),len(self.planes),len(self.fluc_nodes)) )
+            dni_avg_tor = np.zeros((len(self.time_steps),len(self.fluc_nodes)))
+        self.phi = np.zeros( (self.n_cross_section,len(self.time_steps),len(self.planes),len(self.fluc_nodes)) )
+        phi_avg_tor = np.zeros((len(self.time_steps),len(self.fluc_nodes)))
 
         #similar to the 2D case, we take care of the equilibrium relaxation contribution. See details in the comments in 2D loading function.
-        
-        phi_avg_tor = np.average(phi_all,axis = 0)
-        if self.HaveElectron:
-            nane_avg_tor = np.average(nane_all,axis=0)
-        if self.load_ions:
-            dni_avg_tor = np.average(dni_all,axis=0)
-
-        for j in range(self.n_cross_section):
-            self.phi[j,...] = np.swapaxes(phi_all[(self.center_planes[j] + self.planes)%self.n_plane,:,:],0,1) - phi_avg_tor[:,np.newaxis,:]
-            if self.HaveElectron:
-                self.nane[j,...] = np.swapaxes(nane_all[(self.center_planes[j] + self.planes)%self.n_plane,:,:],0,1) - nane_avg_tor[:,np.newaxis,:]
-            if self.load_ions:
-                self.dni[j,...] = np.swapaxes(dni_all[(self.center_planes[j] + self.planes)%self.n_plane,:,:],0,1) - dni_avg_tor[:,np.newaxis,:]
-
-        self.ne0[:] += np.average(phi_avg_tor,axis=0)
+        #load all the files, each quantity is read only once, containing all planes. The planes of each cross section are ordered as in *planes*.
+        cs_planes = (self.center_planes[:,np.newaxis] + self.planes[np.newaxis,:])%self.n_plane
+        names = [name for name in self._fluctuation_names() if name != 'dne_ad' and not self.Fluc_Filtering]
+        with self._interpolation_while_reading(names) as interpolation:
+            for i, fluc in enumerate(self.fluctuation_reader()):
+                phi_avg_tor[i] = np.average(fluc['dpot'],axis = 0)
+                self.phi[:,i] = fluc['dpot'][cs_planes] - phi_avg_tor[i]
+                if self.HaveElectron:
+                    nane_avg_tor[i] = np.average(fluc['eden'],axis = 0)
+                    self.nane[:,i] = fluc['eden'][cs_planes] - nane_avg_tor[i]
+                if self.load_ions:
+                    dni_avg_tor[i] = np.average(fluc['iden'],axis = 0)
+                    self.dni[:,i] = fluc['iden'][cs_planes] - dni_avg_tor[i]
+                if interpolation is not None:
+                    interpolation.interpolate(i, self._step_values(names, i))
+
+        self.ne0[self.fluc_nodes] += np.average(phi_avg_tor,axis=0)
         if self.HaveElectron:
-            self.ne0[:] += np.average(nane_avg_tor,axis=0)
-        self.ni0[:] += np.average(phi_avg_tor,axis=0)
+            self.ne0[self.fluc_nodes] += np.average(nane_avg_tor,axis=0)
+        self.ni0[self.fluc_nodes] += np.average(phi_avg_tor,axis=0)
         if self.load_ions:
-            self.ni0[:] += np.average(dni_avg_tor,axis=0)
+            self.ni0[self.fluc_nodes] += np.average(dni_avg_tor,axis=0)
             
         return 0
     
@@ -1013,25 +1329,37 @@ class XGC_Loader():
         """ If Fluc_Filtering is True, in order to avoid negative density, we set all the fluctuations larger than local equilibrium density to zero.
         Note that this rarely happens, and it only happens at locations very close to the edge where the equilibrium density is vanishing. This treatment should not strongly affect the physical results inside the separatrix.
         """
-        ne0 = self.ne0
-        te0 = self.te0
-        ni0 = self.ni0
-        inner_idx = np.where(te0>0)[0]
         self.dne_ad = np.zeros(self.phi.shape)
-        self.dne_ad[...,inner_idx] += ne0[inner_idx] * self.phi[...,inner_idx] /self.te0[inner_idx]
-        
+        for i in range(self.nt):
+            self._calculate_dne_ad_step(i)
         if(self.Fluc_Filtering):
-            ad_invalid_mask = np.absolute(self.dne_ad) > np.absolute(ne0)
-            self.dne_ad[ad_invalid_mask] = 0
-            
+            print('density fluctuations filtered.')
+
+    def _calculate_dne_ad_step(self, step):
+        """calculate the adiabatic electron response of time step *step* into *dne_ad*, and filter the density fluctuations of this step if *Fluc_Filtering* is True. See :py:meth:`calculate_dne_ad_2D3D`.
+        """
+        #fluctuations are only loaded on the chosen nodes
+        ne0 = self.ne0[self.fluc_nodes]
+        te0 = self.te0[self.fluc_nodes]
+        ni0 = self.ni0[self.fluc_nodes]
+        inner_idx = np.where(te0>0)[0]
+        dne_ad = np.zeros(self.phi[:,step].shape)
+        dne_ad[...,inner_idx] += ne0[inner_idx] * self.phi[:,step][...,inner_idx] /te0[inner_idx]
+
+        if(self.Fluc_Filtering):
+            ad_invalid_mask = np.absolute(dne_ad) > np.absolute(ne0)
+            dne_ad[ad_invalid_mask] = 0
+
             if(self.HaveElectron):
-                na_invalid_mask = np.absolute(self.nane) > np.absolute(ne0)
-                self.nane[na_invalid_mask] = 0
-    
+                nane = self.nane[:,step]
+                na_invalid_mask = np.absolute(nane) > np.absolute(ne0)
+                nane[na_invalid_mask] = 0
+
             if(self.load_ions):
-                ni_invalid_mask = np.absolute(self.dni) > np.absolute(ni0)
-                self.dni[ni_invalid_mask] = 0
-            print('density fluctuations filtered.')
+                dni = self.dni[:,step]
+                ni_invalid_mask = np.absolute(dni) > np.absolute(ni0)
+                dni[ni_invalid_mask] = 0
+        self.dne_ad[:,step] = dne_ad
 
     def interpolate_all_on_grid_2D(self):
         """ create all interpolated quantities on given grid. 
@@ -1056,21 +1384,12 @@ class XGC_Loader():
         Rout = R2D[out_mask]
         
         #boundary points are obtained by applying ConvexHull on equilibrium grid points
-        hull = ConvexHull(self.points)
-        p_boundary = self.points[hull.vertices]
-        Z_boundary = p_boundary[:,0]
-        R_boundary = p_boundary[:,1]
-        
         #Now let's calculate *psi* on outside points, first, get the nearest boundary point for each outside point
-        nearest_indices = []
-        for i in range(len(Zout)):
-            Z = Zout[i]
-            R = Rout[i]
-            nearest_indices.append (np.argmin((Z-Z_boundary)**2 + (R-R_boundary)**2) )
+        nearest_indices = NearestHullVertexFinder(self.points)(Zout,Rout)
             
         # Then, calculate *psi* based on the gradient at these nearest points
-        Zn = Z_boundary[nearest_indices]
-        Rn = R_boundary[nearest_indices]
+        Zn = self.points[nearest_indices,0]
+        Rn = self.points[nearest_indices,1]
         #The value *psi* and its gradiant at this nearest point can by easily obtained            
         psi_n = self.psi_interp(Zn,Rn)            
         gradpsi_Z,gradpsi_R = self.psi_interp.gradient(Zn,Rn)
@@ -1095,25 +1414,16 @@ class XGC_Loader():
         self.ne0_on_grid = self.ne0_sp(self.psi_on_grid)
         self.ni0_on_grid = self.ni0_sp(self.psi_on_grid)        
         
-        #fluctuations 
-        self.phi_on_grid = np.zeros((self.n_cross_section,len(self.time_steps),R2D.shape[0],R2D.shape[1]))
-        self.dne_ad_on_grid = np.zeros_like(self.phi_on_grid)
+        #fluctuations, the ones already interpolated while reading are reused
+        on_grid = self.interpolate_fluctuations(self._fluctuation_names())
+
+        self.phi_on_grid = on_grid['phi']
+        self.dne_ad_on_grid = on_grid['dne_ad']
         self.dni_ad_on_grid = np.zeros_like(self.phi_on_grid)
         if self.HaveElectron:
-            self.nane_on_grid = np.zeros_like(self.phi_on_grid)
+            self.nane_on_grid = on_grid['nane']
         if self.load_ions:
-            self.dni_on_grid = np.zeros_like(self.phi_on_grid)
-        
-
-
-        for i in range(self.n_cross_section):
-            for j in range(self.nt):
-                self.phi_on_grid[i,j,...] += CloughTocher2DInterpolator(self.Delaunay,self.phi[i,j,:],fill_value = 0)(np.array([Z2D,R2D]).transpose(1,2,0))
-                self.dne_ad_on_grid[i,j,...] += CloughTocher2DInterpolator(self.Delaunay,self.dne_ad[i,j,:],fill_value = 0)(np.array([Z2D,R2D]).transpose(1,2,0))
-                if(self.HaveElectron):
-                    self.nane_on_grid[i,j,...] += CloughTocher2DInterpolator(self.Delaunay,self.nane[i,j,:],fill_value = 0)(np.array([Z2D,R2D]).transpose(1,2,0))
-                if(self.load_ions):
-                    self.dni_on_grid[i,j,...] += CloughTocher2DInterpolator(self.Delaunay,self.dni[i,j,:],fill_value = 0)(np.array([Z2D,R2D]).transpose(1,2,0))
+            self.dni_on_grid = on_grid['dni']
 
         self.interp_check() # after the interpolation, check if the perturbations are interpolated within a reasonable error
 
@@ -1162,21 +1472,12 @@ class XGC_Loader():
             Rout = R2D[out_mask]
             
             #boundary points are obtained by applying ConvexHull on equilibrium grid points
-            hull = ConvexHull(self.points)
-            p_boundary = self.points[hull.vertices]
-            Z_boundary = p_boundary[:,0]
-            R_boundary = p_boundary[:,1]
-            
             #Now let's calculate *psi* on outside points, first, get the nearest boundary point for each outside point
-            nearest_indices = []
-            for i in range(len(Zout)):
-                Z = Zout[i]
-                R = Rout[i]
-                nearest_indices.append (np.argmin((Z-Z_boundary)**2 + (R-R_boundary)**2) )
+            nearest_indices = NearestHullVertexFinder(self.points)(Zout,Rout)
                 
             # Then, calculate *psi* based on the gradient at these nearest points
-            Zn = Z_boundary[nearest_indices]
-            Rn = R_boundary[nearest_indices]
+            Zn = self.points[nearest_indices,0]
+            Rn = self.points[nearest_indices,1]
             #The value *psi* and its gradiant at this nearest point can by easily obtained            
             psi_n = self.psi_interp(Zn,Rn)            
             gradpsi_Z,gradpsi_R = self.psi_interp.gradient(Zn,Rn)
@@ -1219,63 +1520,153 @@ class XGC_Loader():
         #ne fluctuations on 3D grid
         
         if(not self.Equilibrium_Only):
-            self.dne_ad_on_grid = np.zeros((self.n_cross_section,len(self.time_steps),r3D.shape[0],r3D.shape[1],r3D.shape[2]))
+            #the ones already interpolated while reading are reused
+            on_grid = self.interpolate_fluctuations(self._fluctuation_names())
+
+            self.dne_ad_on_grid = on_grid['dne_ad']
             if self.HaveElectron:
-                self.nane_on_grid = np.zeros(self.dne_ad_on_grid.shape)
+                self.nane_on_grid = on_grid['nane']
             if self.load_ions:
-                self.dni_on_grid = np.zeros(self.dni_ad_on_grid.shape)
-          
-            interp_positions = find_interp_positions_v2_upgrade(self)
-    
-            for k in range(self.n_cross_section):
-                print('center plane {0}.'.format(self.center_planes[k]))
-                for i in range(len(self.time_steps)):
-                    print('time step {0}'.format(self.time_steps[i]))
-                    #for each time step, first create the 2 arrays of quantities for interpolation
-                    prev = np.zeros( (self.grid.NZ,self.grid.NY,self.grid.NX) )
-                    next = np.zeros(prev.shape)
-
-                    #create index dictionary, for each key as plane number and value the corresponding indices where the plane is used as previous or next plane.
-                    prev_idx = {}
-                    next_idx = {}
-                    for j in range(len(self.planes)):
-                        prev_idx[j] = np.where(self.prevplane == self.planes[j] )
-                        next_idx[j] = np.where(self.nextplane == self.planes[j] )
-    
-                    #now interpolate adiabatic ne on each toroidal plane for the points using it as previous or next plane.
-                    for j in range(len(self.planes)):
-                        if(prev[prev_idx[j]].size != 0):
-                            prev[prev_idx[j]] = CloughTocher2DInterpolator(self.Delaunay,self.dne_ad[k,i,j,:], fill_value = 0)(np.array([interp_positions[0,0][prev_idx[j]], interp_positions[0,1][prev_idx[j]] ]).T )
-                        if(next[next_idx[j]].size != 0):
-                            next[next_idx[j]] = CloughTocher2DInterpolator(self.Delaunay,self.dne_ad[k,i,j,:], fill_value = 0)(np.array([interp_positions[1,0][next_idx[j]], interp_positions[1,1][next_idx[j]] ]).T )
-                    # on_grid adiabatic ne is then calculated by linearly interpolating values between these two planes
-                
-                    self.dne_ad_on_grid[k,i,...] = prev * interp_positions[1,2,...] + next * interp_positions[0,2,...]
+                self.dni_on_grid = on_grid['dni']
 
-    
-                    if self.HaveElectron:
-                        #non-adiabatic ne data as well:
-                        for j in range(len(self.planes)):
-                            if(prev[prev_idx[j]].size != 0):
-                                prev[prev_idx[j]] = CloughTocher2DInterpolator(self.Delaunay,self.nane[k,i,j,:], fill_value = 0)(np.array([interp_positions[0,0][prev_idx[j]], interp_positions[0,1][prev_idx[j]] ]).T )
-                            if(next[next_idx[j]].size != 0):
-                                next[next_idx[j]] = CloughTocher2DInterpolator(self.Delaunay,self.nane[k,i,j,:], fill_value = 0)(np.array([interp_positions[1,0][next_idx[j]], interp_positions[1,1][next_idx[j]] ]).T )
-                        self.nane_on_grid[k,i,...] = prev * interp_positions[1,2,...] + next * interp_positions[0,2,...]
-                        
-                    """   NOW WE WORK WITH IONS   """
-                        
-                    if self.load_ions:
-                        #for each time step, first create the 2 arrays of quantities for interpolation
-                        prev = np.zeros( (self.grid.NZ,self.grid.NY,self.grid.NX) )
-                        next = np.zeros(prev.shape)
-  
-                        for j in range(len(self.planes)):
-                            if(prev[prev_idx[j]].size != 0):
-                                prev[prev_idx[j]] = CloughTocher2DInterpolator(self.Delaunay,self.dni[k,i,j,:], fill_value = 0)(np.array([interp_positions[0,0][prev_idx[j]], interp_positions[0,1][prev_idx[j]] ]).T )
-                            if(next[next_idx[j]].size != 0):
-                                next[next_idx[j]] = CloughTocher2DInterpolator(self.Delaunay,self.dni[k,i,j,:], fill_value = 0)(np.array([interp_positions[1,0][next_idx[j]], interp_positions[1,1][next_idx[j]] ]).T )                           
-                        self.dni_on_grid[k,i,...] = prev * interp_positions[1,2,...] + next * interp_positions[0,2,...]
+    def _fluctuation_interpolation(self):
+        """return the interpolation from the chosen mesh nodes onto the current grid, as *func* and *split_rows* of :py:class:`GridInterpolation`
 
+        For 2D grids, the values are given on the chosen nodes, for 3D grids on the chosen nodes of each plane in *planes*, and the values on the previous and next planes are weighted by the field line traced positions, see :py:func:`find_interp_positions_cached`. 'linear' interpolation is one sparse matrix made of the barycentric weights, 'cubic' interpolation builds Clough-Tocher interpolators on the values of each plane. Points outside the mesh get 0.
+
+        The interpolation is kept in *_fluc_interpolation* together with the grid and the nodes it is made for, so the triangle lookup is done only once for each grid.
+        """
+        cached = getattr(self, '_fluc_interpolation', None)
+        if cached is not None and cached[0] is self.grid and cached[1] is self.fluc_Delaunay:
+            return cached[2]
+        delaunay = self.fluc_Delaunay
+        if self.dimension == 2:
+            points = np.array([self.grid.Z2D.ravel(), self.grid.R2D.ravel()]).T
+            if self.fluc_interp == 'linear':
+                result = (_SparseInterpolation(barycentric_matrix(delaunay, points)), True)
+            else:
+                func = lambda values, rows: CloughTocher2DInterpolator(delaunay, values, fill_value = 0)(points)
+                result = (func, False)
+        else:
+            interp_positions = self._get_interp_positions()
+            prevplane = self.prevplane.ravel()
+            nextplane = self.nextplane.ravel()
+            prev_weight = interp_positions[1,2].ravel()
+            next_weight = interp_positions[0,2].ravel()
+            n_points = prevplane.size
+            # for each toroidal plane, the points using it as previous or next plane
+            plane_points = []
+            for j in range(len(self.planes)):
+                prev_idx = np.nonzero(prevplane == self.planes[j])[0]
+                next_idx = np.nonzero(nextplane == self.planes[j])[0]
+                if (prev_idx.size == 0 and next_idx.size == 0):
+                    continue
+                Zwant = np.concatenate([interp_positions[0,0].ravel()[prev_idx], interp_positions[1,0].ravel()[next_idx]])
+                Rwant = np.concatenate([interp_positions[0,1].ravel()[prev_idx], interp_positions[1,1].ravel()[next_idx]])
+                idx = np.concatenate([prev_idx, next_idx])
+                weight = np.concatenate([prev_weight[prev_idx], next_weight[next_idx]])
+                plane_points.append((j, idx, weight, np.array([Zwant,Rwant]).T))
+            if self.fluc_interp == 'linear':
+                # weights of all planes are put in one matrix acting on the values of all planes
+                n_node = delaunay.npoints
+                rows, cols, data = [], [], []
+                for j, idx, weight, points in plane_points:
+                    plane_weights = barycentric_matrix(delaunay, points).tocoo()
+                    rows.append(idx[plane_weights.row])
+                    cols.append(plane_weights.col + j*n_node)
+                    data.append(plane_weights.data * weight[plane_weights.row])
+                weights = csr_matrix((np.concatenate(data), (np.concatenate(rows), np.concatenate(cols))), shape=(n_points, len(self.planes)*n_node))
+                result = (_SparseInterpolation(weights), True)
+            else:
+                def func(values, rows):
+                    on_grid = np.zeros((n_points, values.shape[-1]))
+                    for j, idx, weight, points in plane_points:
+                        # points may use the same plane as previous and next plane
+                        np.add.at(on_grid, idx, CloughTocher2DInterpolator(delaunay, values[j], fill_value = 0)(points) * weight[:,np.newaxis])
+                    return on_grid
+                result = (func, False)
+        self._fluc_interpolation = (self.grid, delaunay, result)
+        return result
+
+    def _grid_interpolation(self, names):
+        """return a :py:class:`GridInterpolation` of the fluctuation quantities *names* onto the current grid, with *n_workers* worker processes
+        """
+        func, split_rows = self._fluctuation_interpolation()
+        if self.dimension == 2:
+            node_shape = (len(self.fluc_nodes),)
+            n_points = self.grid.R2D.size
+        else:
+            node_shape = (len(self.planes), len(self.fluc_nodes))
+            n_points = self.grid.r3D.size
+        return GridInterpolation(func, node_shape, n_points, len(names)*self.n_cross_section, self.nt, split_rows, self.n_workers)
+
+    def _step_values(self, names, step):
+        """return the values of the fluctuation quantities *names* at time step *step*, as the node values of :py:class:`GridInterpolation`
+        """
+        values = np.array([getattr(self, name)[:,step] for name in names])
+        values = values.reshape((-1,)+values.shape[2:])
+        return np.moveaxis(values, 0, -1)
+
+    def _split_on_grid(self, names, on_grid):
+        """return the interpolated quantities *names* in *on_grid*, the output of :py:class:`GridInterpolation`, as a dictionary of arrays with shape (n_cross_section, nt) + grid shape
+
+        The arrays are views of *on_grid*.
+        """
+        if self.dimension == 2:
+            grid_shape = self.grid.R2D.shape
+        else:
+            grid_shape = self.grid.r3D.shape
+        n_cs = self.n_cross_section
+        return {name: on_grid[k*n_cs:(k+1)*n_cs].reshape((n_cs, self.nt)+grid_shape) for k, name in enumerate(names)}
+
+    def interpolate_fluctuations(self, names):
+        """interpolate fluctuation quantities from the chosen mesh nodes onto the current grid
+
+        All cross sections of all quantities are interpolated together, one time step at a time. With *n_workers* larger than 1, the worker processes are created once for all time steps, and write directly into the returned arrays, see :py:class:`GridInterpolation`.
+
+        Quantities already interpolated onto the current grid while the fluctuation files were read, see :py:meth:`_interpolation_while_reading`, are not interpolated again.
+
+        :param names: names of the attributes holding the values on the chosen nodes, e.g. ['phi','dne_ad'], with shape (n_cross_section, nt, len(fluc_nodes)) for 2D grids, and (n_cross_section, nt, len(planes), len(fluc_nodes)) for 3D grids.
+        :type names: list of string
+
+        :return: interpolated quantities with shape (n_cross_section, nt) + grid shape, 0 for points outside the mesh
+        :rtype: dictionary of arrays
+        """
+        on_grid = {}
+        cached = getattr(self, '_fluc_on_grid', None)
+        if cached is not None and cached[0] is self.grid and cached[1] is self.fluc_Delaunay:
+            on_grid.update((name, cached[2][name]) for name in names if name in cached[2])
+        names = [name for name in names if name not in on_grid]
+        if names:
+            with self._grid_interpolation(names) as interpolation:
+                for i in range(self.nt):
+                    interpolation.interpolate(i, self._step_values(names, i))
+            on_grid.update(self._split_on_grid(names, interpolation.out))
+        return on_grid
+
+    def _fluctuation_names(self):
+        """return the names of the fluctuation quantities interpolated onto the grid
+        """
+        names = ['phi','dne_ad'] if self.dimension == 2 else ['dne_ad']
+        if self.HaveElectron:
+            names.append('nane')
+        if self.load_ions:
+            names.append('dni')
+        return names
+
+    @contextlib.contextmanager
+    def _interpolation_while_reading(self, names):
+        """context of the loop reading the fluctuation files, yields a :py:class:`GridInterpolation` of the quantities *names*
+
+        The loop interpolates each time step as soon as its values are final, so the interpolation overlaps with the reading of the next files. At the end, the interpolated quantities are kept in *_fluc_on_grid* together with the grid and the nodes, and are used by :py:meth:`interpolate_fluctuations`. Yields None if nothing is interpolated while reading.
+        """
+        self._fluc_on_grid = None
+        if not names or (self.dimension == 3 and self.Equilibrium_Only):
+            yield None
+            return
+        with self._grid_interpolation(names) as interpolation:
+            yield interpolation
+        self._fluc_on_grid = (self.grid, self.fluc_Delaunay, self._split_on_grid(names, interpolation.out))
 
     def interp_check(self, tol = 0.2, toroidal_cross = 0, time = 0):
         """check if the interpolation has been carried out correctly
@@ -1307,8 +1698,8 @@ class XGC_Loader():
         Zmin = self.grid.Z1D[0]
         Zmax = self.grid.Z1D[-1]
 
-        R = self.mesh['R']
-        Z = self.mesh['Z']
+        R = self.mesh['R'][self.fluc_nodes]
+        Z = self.mesh['Z'][self.fluc_nodes]
 
         #find the index where original R,Z are inside the interpolated grid
 
@@ -1363,8 +1754,34 @@ class XGC_Loader():
         
         
         
-    def save(self,fname = 'xgc_profile.sav'):
-        """save the original and interpolated electron density fluctuations and useful equilibrium quantities to a local .npz file
+    def provenance_key(self):
+        """hash key of everything the interpolated profile depends on
+
+        The key is calculated from the contents of the mesh and bfield files, see :py:func:`files_digest`, the size and modification time of the fluctuation files, the time steps, the grid and the loading options. Fluctuation files that don't exist are skipped.
+        """
+        sha = hashlib.sha1()
+        sha.update(files_digest([self.mesh_file, self.bfield_file]).encode())
+        for t in self.time_steps:
+            fname = self.fluctuation_file_name(t)
+            if os.path.exists(fname):
+                stat = os.stat(fname)
+                sha.update('{0} {1} {2}'.format(t, stat.st_size, stat.st_mtime).encode())
+        for name, coord in self._grid_coordinates():
+            sha.update(name.encode())
+            sha.update(np.ascontiguousarray(coord, dtype=np.float64).tobytes())
+        sha.update(str((list(self.time_steps), self.n_cross_section, self.dn_amplifier, self.equilibrium_mesh, self.Fluc_Only, self.Fluc_Filtering, self.load_ions, self.fluc_interp, self.crop_margin)).encode())
+        return sha.hexdigest()
+
+    def _grid_coordinates(self):
+        """return the list of (name, 1D coordinates) pairs of the grid, as saved in profile files
+        """
+        if (self.dimension == 2):
+            return [('X1D', self.grid.R1D), ('Y1D', self.grid.Z1D)]
+        else:
+            return [('X1D', self.grid.X1D), ('Y1D', self.grid.Y1D), ('Z1D', self.grid.Z1D)]
+
+    def save(self,fname = 'xgc_profile.h5', compression = 'gzip'):
+        """save the original and interpolated electron density fluctuations and useful equilibrium quantities to a local HDF5 file
 
         for 2D instances,The arrays saved are:
             X1D: the 1D array of coordinates along R direction (major radius)
@@ -1372,7 +1789,7 @@ class XGC_Loader():
             X_origin: major radius coordinates on original scattered grid
             Y_origin: vertical coordinates on original scattered grid
            
-            dne_ad: the adiabatic electron density perturbation, in shape (NY,NX), where NX,NY are the dimensions of X1D, Y1D respectively
+            dne_ad: the adiabatic electron density perturbation, in shape (n_cross_section,nt,NY,NX), where NX,NY are the dimensions of X1D, Y1D respectively
             nane: (if non-adiabatic electron is on in XGC simulation)the non-adiabatic electron density perturbation. same shape as dne_ad
 
             dne_ad_org: the adiabatic electron density perturbation on original grid
@@ -1382,49 +1799,156 @@ class XGC_Loader():
             Te0: equilibrium electron temperature
             Ti0: equilibrium ion temperature
             B0: equilibrium magnetic field (toroidal)
+            time_steps: the loaded time steps
             
         for 3D instances, in addition to the arrays above, one coordinate is also saved:
             Z1D: 1D coordinates along R cross Z direction.
 
             BX: radial magnetic field
             BY: vertical magnetic field
+
+        The fluctuations are chunked and written one cross section and one time step at a time, so they can be read back partially, see :py:meth:`load`. They are copied from the interpolated arrays, which are still created in memory as a whole by the interpolation methods. The dimension, equilibrium mesh and :py:meth:`provenance_key` are saved as file attributes.
+
+        NOTE: the default file name was 'xgc_profile.sav' in older versions, which saved 'xgc_profile.sav.npz'. :py:meth:`load` falls back to that file if the new default doesn't exist.
+
+        :param string fname: file name, relative to *xgc_path*
+        :param compression: compression filter passed to h5py, default to be 'gzip'. If None, data is not compressed.
         """
         file_name = self.xgc_path + fname
         saving_dic = {
-            'dne_ad':self.dne_ad_on_grid,
             'ne0':self.ne0_on_grid,
-            'dne_ad_org':self.dne_ad,
-            'X_origin':self.mesh['R'],
-            'Y_origin':self.mesh['Z'],
+            'X_origin':self.mesh['R'][self.fluc_nodes],
+            'Y_origin':self.mesh['Z'][self.fluc_nodes],
             'Te0':self.te0_on_grid,
             'Ti0':self.ti0_on_grid,
-            'psi':self.psi_on_grid.data
+            'psi':np.ma.getdata(self.psi_on_grid),
+            'time_steps':np.asarray(self.time_steps)
+            }
+        fluc_dic = {
+            'dne_ad':self.dne_ad_on_grid,
+            'dne_ad_org':self.dne_ad
             }
         if (self.HaveElectron):
-            saving_dic['nane'] = self.nane_on_grid
-            saving_dic['nane_org'] = self.nane
+            fluc_dic['nane'] = self.nane_on_grid
+            fluc_dic['nane_org'] = self.nane
+        saving_dic.update(self._grid_coordinates())
         if (self.dimension == 2):
-            saving_dic['X1D'] = self.grid.R1D
-            saving_dic['Y1D'] = self.grid.Z1D
-            saving_dic['B0'] = self.B_on_grid.data
+            saving_dic['B0'] = np.ma.getdata(self.B_on_grid)
         else:
-            saving_dic['X1D'] = self.grid.X1D
-            saving_dic['Y1D'] = self.grid.Y1D
-            saving_dic['Z1D'] = self.grid.Z1D
-            
             if self.equilibrium_mesh == '3D':            
                 saving_dic['B0'] = self.BZ_on_grid
                 saving_dic['BX'] = self.BX_on_grid
                 saving_dic['BY'] =  self.BY_on_grid
             elif self.equilibrium_mesh == '2D':
-                saving_dic['B0'] = self.BPhi_on_grid.data
-                saving_dic['BR'] = self.BR_on_grid.data
-                saving_dic['BZ'] = self.BZ_on_grid.data
-        np.savez(file_name,**saving_dic)
-
-    def load(self, filename = 'xgc_profile.sav'):
+                saving_dic['B0'] = np.ma.getdata(self.BPhi_on_grid)
+                saving_dic['BR'] = np.ma.getdata(self.BR_on_grid)
+                saving_dic['BZ'] = np.ma.getdata(self.BZ_on_grid)
+
+        with h5.File(file_name,'w') as f:
+            f.attrs['dimension'] = self.dimension
+            f.attrs['equilibrium_mesh'] = self.equilibrium_mesh
+            f.attrs['provenance'] = self.provenance_key()
+            for name, data in saving_dic.items():
+                f.create_dataset(name, data = np.asarray(data))
+            for name, data in fluc_dic.items():
+                shape = tuple(data.shape)
+                dset = f.create_dataset(name, shape = shape, dtype = data.dtype, chunks = (1,1)+shape[2:], compression = compression)
+                for k in range(shape[0]):
+                    for i in range(shape[1]):
+                        dset[k,i] = data[k,i]
+        print('profile saved to {0}'.format(file_name))
+
+    def load(self, filename = 'xgc_profile.h5', lazy = False):
         """load the previously saved xgc profile data file.
-        The geometry information needs to be the same, otherwise an error will be raised.
+        The dimension, equilibrium mesh and grid coordinates need to be the same as this loader, otherwise an error will be raised. If the saved provenance key differs from :py:meth:`provenance_key`, a warning is printed.
+
+        Files with .npz extension saved by older versions are also accepted, without geometry checking. If *filename* is the default 'xgc_profile.h5' and doesn't exist, 'xgc_profile.sav.npz' in the same directory, the default of older versions, is loaded instead.
+
+        :param string filename: path to the saved file
+        :param bool lazy: if True, the fluctuation arrays are kept as h5py datasets, and only the slices actually used are read from disk, e.g. ``dne_ad_on_grid[0, 100:200]``. The file stays open until :py:meth:`close_profile` is called. *ne_on_grid* is not created in lazy mode. Default to be False.
+        """
+        if not os.path.exists(filename) and os.path.basename(filename) == 'xgc_profile.h5':
+            legacy_filename = os.path.join(os.path.dirname(filename), 'xgc_profile.sav.npz')
+            if os.path.exists(legacy_filename):
+                print('{0} not found, loading {1} saved by an older version.'.format(filename, legacy_filename))
+                filename = legacy_filename
+        if filename.endswith('.npz') or (not h5.is_hdf5(filename) and os.path.exists(filename+'.npz')):
+            if not filename.endswith('.npz'):
+                filename += '.npz'
+            self._load_npz(filename)
+            return
+
+        f = h5.File(filename,'r')
+        try:
+            dimension = int(f.attrs['dimension'])
+            equilibrium_mesh = f.attrs['equilibrium_mesh']
+            if isinstance(equilibrium_mesh, bytes):
+                equilibrium_mesh = equilibrium_mesh.decode()
+            if(dimension != self.dimension):
+                raise XGC_Loader_Error('Geometry incompatible! Trying to load {0}d data onto {1}d grid.\nMake sure the geometry setup is the same as the data file.'.format(dimension,self.dimension))
+            if(dimension == 3 and equilibrium_mesh != self.equilibrium_mesh):
+                raise XGC_Loader_Error('Equilibrium mesh doesn\'t match! {0} mesh is expected while {1} mesh is loaded.'.format(self.equilibrium_mesh,equilibrium_mesh))
+            for name, coord in self._grid_coordinates():
+                saved = f[name][()]
+                if (saved.shape != np.shape(coord) or not np.allclose(saved, coord)):
+                    raise XGC_Loader_Error('Grid doesn\'t match! {0} in {1} is different from the grid of this loader.'.format(name,filename))
+            self.provenance = f.attrs['provenance']
+            if isinstance(self.provenance, bytes):
+                self.provenance = self.provenance.decode()
+            if (self.provenance != self.provenance_key()):
+                print('Warning: {0} was created from different XGC files, time steps or loading options.'.format(filename))
+        except:
+            f.close()
+            raise
+
+        self.mesh = {'R':f['X_origin'][()],'Z':f['Y_origin'][()]}
+        self.ne0_on_grid = f['ne0'][()]
+        self.psi_on_grid = f['psi'][()]
+        self.te_on_grid = f['Te0'][()]
+        self.ti_on_grid = f['Ti0'][()]
+        fluc_names = [name for name in ('dne_ad','dne_ad_org','nane','nane_org') if name in f]
+        if lazy:
+            fluc = dict((name, f[name]) for name in fluc_names)
+        else:
+            fluc = dict((name, f[name][()]) for name in fluc_names)
+        self.dne_ad = fluc['dne_ad_org']
+        self.dne_ad_on_grid = fluc['dne_ad']
+        if 'nane' in fluc:
+            self.HaveElectron = True
+            self.nane = fluc['nane_org']
+            self.nane_on_grid = fluc['nane']
+        if not lazy:
+            self.ne_on_grid = self.ne0_on_grid[np.newaxis,np.newaxis,...] + self.dne_ad_on_grid
+            if 'nane' in fluc:
+                self.ne_on_grid += self.nane_on_grid
+
+        if dimension == 2:
+            self.B_on_grid = f['B0'][()]
+        elif equilibrium_mesh == '3D':
+            self.BZ_on_grid = f['B0'][()]
+            self.BX_on_grid = f['BX'][()]
+            self.BY_on_grid = f['BY'][()]
+            self.B_on_grid = np.sqrt(self.BX_on_grid**2 + self.BY_on_grid**2 + self.BZ_on_grid**2) 
+        elif equilibrium_mesh == '2D':
+            self.BPhi_on_grid = f['B0'][()]
+            self.BR_on_grid = f['BR'][()]
+            self.BZ_on_grid = f['BZ'][()]
+            self.B_on_grid = np.sqrt(self.BPhi_on_grid**2 + self.BR_on_grid**2 + self.BZ_on_grid**2)
+
+        if lazy:
+            self._profile_file = f
+        else:
+            f.close()
+
+    def close_profile(self):
+        """close the profile file kept open by a lazy :py:meth:`load`
+        """
+        if getattr(self, '_profile_file', None) is not None:
+            self._profile_file.close()
+            self._profile_file = None
+
+    def _load_npz(self, filename):
+        """load a xgc profile saved by older versions in .npz format.
         WARNING: Currently no serious checking is performed. The user is responsible to make sure the XGC_Loader object is initialized properly to load the corresponding saving file. 
         """
 
@@ -1441,7 +1965,7 @@ class XGC_Loader():
             dimension = 2
         if(dimension != self.dimension):
             raise XGC_Loader_Error('Geometry incompatible! Trying to load {0}d data onto {1}d grid.\nMake sure the geometry setup is the same as the data file.'.format(dimension,self.dimension))
-        if(equilibrium_mesh != self.equilibrium_mesh):
+        if(dimension == 3 and equilibrium_mesh != self.equilibrium_mesh):
             raise XGC_Loader_Error('Equilibrium mesh doesn\'t match! {0} mesh is expected while {1} mesh is loaded.'.format(self.equilibrium_mesh,equilibrium_mesh))
         #======== NEED MORE DETAILED GEOMETRY CHECKING HERE! CURRENT VERSION DOESN'T GUARANTEE SAME GRID. ERRORS WILL OCCUR WHEN READ SAVED FILE WITH A DIFFERENT GRID.
         #=============================================#
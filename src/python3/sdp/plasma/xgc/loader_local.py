@@ -13,10 +13,15 @@ on the distance to the previous/next plane.
 
 from sdp.io.funcs import parse_num
 
+import hashlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 import h5py as h5
 from scipy.interpolate import splrep, splev
 from scipy.interpolate import LinearNDInterpolator, CloughTocher2DInterpolator
+from scipy.spatial import Delaunay
 from .loader import load_m, XGC_Loader_Error
 from sdp.math.rungekutta import runge_kutta_explicit
 
@@ -82,11 +87,15 @@ class XGC_Loader_local():
     :param float shift: Shift for phi (default value assumed that plane number 0 is at phi=0)
     :param str kind: Order of the interpolation method (linear or cubic))
     :param int plane: Index of the plane where the shift needs to be done
+    :param int fieldline_cache_bytes: Memory limit, in bytes, of the traced field lines kept for the recently used point sets. Default to be 64 MB (0 disables the cache)
+    :param bool preload: If True, the next time step is read and its interpolants are computed in a background thread\
+    while the current one is used (see :func:`load_next_time_step`)
 
     For more detail about the shift, look at the code in :func:`get_interp_planes_local <sdp.plasma.xgc.load_XGC_local.get_interp_planes_local>`
     """
 
-    def __init__(self,xgc_path,t_start,t_end,dt,limits,dphi,shift=0,kind='linear',plane=0):
+    def __init__(self,xgc_path,t_start,t_end,dt,limits,dphi,shift=0,kind='linear',plane=0,
+                 fieldline_cache_bytes=2**26,preload=True):
         """Copy all the input values and call all the functions that compute the equilibrium and the first
         time step.
         """
@@ -102,6 +111,14 @@ class XGC_Loader_local():
         self.ne_input_file = xgc_path+'ne_input.in'
         self.shift = shift
         self.kind = kind
+        # traced field lines for each point set, they depend only on the geometry
+        self.fieldline_cache_bytes = fieldline_cache_bytes
+        self._fieldlines = OrderedDict()
+        self._fieldline_nbytes = 0
+        # double buffer: the time step loaded in background is kept as (index, future)
+        self.preload = preload
+        self._executor = None
+        self._pending = None
         
         print('from directory:'+ self.xgc_path)
         self.unit_dic = load_m(self.unit_file)
@@ -154,6 +171,12 @@ class XGC_Loader_local():
         phi = np.linspace(tempmin,tempmax,100)
         phi[phi<0] += 2*np.pi
         self.refprevplane,self.refnextplane = get_interp_planes_local(self,phi)
+        # list of all planes of interest
+        self.planes = np.unique(np.array([np.unique(self.refprevplane),
+                                          np.unique(self.refnextplane)]))
+        #the dictionary contains the positions of each chosen plane,
+        # useful when we want to get the data on a given plane known only its plane number in xgc file.
+        self.planeID = {self.planes[i]:i for i in range(len(self.planes))}
         print('interpolation planes obtained.')
         
         self.load_eq_3D()
@@ -165,6 +188,8 @@ class XGC_Loader_local():
         """ Load all the quantities for the next time step.
         
         The old quantities are overwritten.
+        If *preload* is True, the following time step is then read and its interpolants computed
+        in a background thread, so the next call only swaps the buffers.
         
         :param bool increase: Define if the time step should be increase or not
         :param int t: Time step to load (index in self.time)
@@ -178,12 +203,57 @@ class XGC_Loader_local():
             raise XGC_Loader_Error('The time step is bigger than the ones\
             requested')
         
-
-        self.load_fluctuations_3D_all()        
-        print('fluctuations loaded.')
+        pending, self._pending = self._pending, None
+        if pending is not None and pending[0] == self.current:
+            self.phi,self.nane,self.interpfluc = pending[1].result()
+            print('fluctuations and interpolant preloaded.')
+        else:
+            if pending is not None:
+                pending[1].cancel()
+            self.load_fluctuations_3D_all()        
+            print('fluctuations loaded.')
         
-        self.compute_interpolant()
-        print('interpolant computed')
+            self.compute_interpolant()
+            print('interpolant computed')
+
+        if self.preload and self.current+1 < len(self.time_steps):
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1)
+            self._pending = (self.current+1,
+                             self._executor.submit(self._load_time_step,self.current+1))
+        else:
+            # last time step, the background thread is not needed anymore
+            self.close()
+
+    def close(self):
+        """ Stop the background thread used for preloading the next time step
+
+        It is called automatically when the last time step is loaded. A new thread is started if
+        another time step is loaded afterwards.
+        """
+        if self._pending is not None:
+            self._pending[1].cancel()
+            self._pending = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def _load_time_step(self,index):
+        """ Read the fluctuations of the time step *index* and compute their interpolants,
+        without changing the current ones (run in the background by :func:`load_next_time_step`)
+
+        :returns: Potential, non-adiabatic density and the list of interpolants
+        :rtype: tuple(np.array[Nplanes,N],np.array[Nplanes,N],list)
+        """
+        phi,nane = self.read_fluctuations(index)
+        return phi,nane,self.build_interpolants(phi,nane)
+
+    def __getstate__(self):
+        # the background thread can not be sent to other processes
+        state = self.__dict__.copy()
+        state['_executor'] = None
+        state['_pending'] = None
+        return state
         
             
     def load_mesh_psi_3D(self):
@@ -296,6 +366,8 @@ class XGC_Loader_local():
         
             print('Zlimits: [',np.min(self.points[:,1]),np.max(self.points[:,1]),']')
             print('Rlimits: [',np.min(self.points[:,0]),np.max(self.points[:,0]),']')
+        # the triangulation is shared by the interpolants of all the planes and time steps
+        self._triangulation = Delaunay(self.points)
         return 0
 
 
@@ -309,39 +381,47 @@ class XGC_Loader_local():
         this loading method doesn't differentiate them and will read all of them.
         
         """
-        # list of all planes of interest
-        self.planes = np.unique(np.array([np.unique(self.refprevplane),
-                                          np.unique(self.refnextplane)]))
-        self.planeID = {self.planes[i]:i for i in range(len(self.planes))}
-        #the dictionary contains the positions of each chosen plane,
-        # useful when we want to get the data on a given plane known only its plane number in xgc file.
+        self.phi,self.nane = self.read_fluctuations(self.current)
+            
+        return 0
+
+    def read_fluctuations(self,index):
+        """ Read the potential and the non-adiabatic electron density of the time step *index*
+        on the planes of interest (see :func:`load_fluctuations_3D_all`)
+
+        No attribute is changed, so it can run in the background thread.
+
+        :param int index: Index of the time step in self.time_steps
+        :returns: Potential and non-adiabatic density
+        :rtype: tuple(np.array[Nplanes,N],np.array[Nplanes,N])
+        """
         # the last dimension is for the mesh position
-        self.nane = np.zeros( (len(self.planes),
-                               len(self.points[:,0])) )
+        nane = np.zeros( (len(self.planes),
+                          len(self.points[:,0])) )
         
-        self.phi = np.zeros( (len(self.planes),
-                              len(self.points[:,0])) )
+        phi = np.zeros( (len(self.planes),
+                         len(self.points[:,0])) )
         
-        flucf = self.xgc_path + 'xgc.3d.'+str(self.time_steps[self.current]).zfill(5)+'.h5'
+        flucf = self.xgc_path + 'xgc.3d.'+str(self.time_steps[index]).zfill(5)+'.h5'
         fluc_mesh = h5.File(flucf,'r')
 
         if self.lim:
-            self.phi += np.swapaxes(
+            phi += np.swapaxes(
                 fluc_mesh['dpot'][self.ind,:][:,(self.planes)%self.n_plane],0,1)
             
-            self.nane += np.swapaxes(
+            nane += np.swapaxes(
                 fluc_mesh['eden'][self.ind,:][:,(self.planes)%self.n_plane],0,1)
 
         else:
-            self.phi += np.swapaxes(
+            phi += np.swapaxes(
                 fluc_mesh['dpot'][:,:][:,(self.planes)%self.n_plane],0,1)
             
-            self.nane += np.swapaxes(
+            nane += np.swapaxes(
                 fluc_mesh['eden'][:,:][:,(self.planes)%self.n_plane],0,1)
             
         fluc_mesh.close()
             
-        return 0
+        return phi,nane
 
     def load_eq_3D(self):
         """Load equilibrium profiles and compute the interpolant
@@ -413,17 +493,31 @@ class XGC_Loader_local():
             density
         """
         # list of interpolant
-        self.interpfluc = []
+        self.interpfluc = self.build_interpolants(self.phi,self.nane)
+
+    def build_interpolants(self,phi,nane):
+        """ Compute the interpolants of the potential and non-adiabatic density on each plane
+
+        The triangulation of the mesh is computed once in :func:`load_mesh_psi_3D` and shared by all
+        the planes and time steps.
+
+        :param np.array[Nplanes,N] phi: Potential
+        :param np.array[Nplanes,N] nane: Non-adiabatic electron density
+        :returns: One interpolant for each plane
+        :rtype: list
+        """
+        interpfluc = []
         for j in range(len(self.planes)):
             # computation of interpolant
             if self.kind == 'linear':
-                self.interpfluc.append(
-                    LinearNDInterpolator(self.points,np.array([self.phi[j,:],self.nane[j,:]]).T,fill_value=np.nan))
+                interpfluc.append(
+                    LinearNDInterpolator(self._triangulation,np.array([phi[j,:],nane[j,:]]).T,fill_value=np.nan))
             elif self.kind == 'cubic':
-                self.interpfluc.append(
-                    CloughTocher2DInterpolator(self.points,np.array([self.phi[j,:],self.nane[j,:]]).T,fill_value=np.nan))
+                interpfluc.append(
+                    CloughTocher2DInterpolator(self._triangulation,np.array([phi[j,:],nane[j,:]]).T,fill_value=np.nan))
             else:
                 raise NameError("The method '{}' is not defined".format(self.kind))
+        return interpfluc
     
 
     def find_interp_positions(self,r,z,phi,prev_,next_):
@@ -579,6 +673,87 @@ class XGC_Loader_local():
         return interp_positions
 
 
+    def field_line_positions(self,r,z,phi,prev_,next_):
+        """Memoized version of :func:`find_interp_positions`, also returns psi along the field line.
+
+        The result depends only on the geometry, so it is computed once for each set of points and reused
+        for all the time steps. The most recently used point sets are kept, up to *fieldline_cache_bytes*.
+
+        :param np.array[N] r: R coordinates
+        :param np.array[N] z: Z coordinates
+        :param np.array[N] phi: Phi coordinates
+        :param np.array[N] prev_: Previous planes
+        :param np.array[N] next_: Next planes
+
+        :returns: Positions on the previous/next planes (see :func:`find_interp_positions`) and psi interpolated along the field line
+        :rtype: tuple(np.array[2,3,N],np.array[N])
+        """
+        key = None
+        if self.fieldline_cache_bytes > 0:
+            sha = hashlib.sha1()
+            for coord in (r,z,phi):
+                sha.update(np.ascontiguousarray(coord,dtype=float).tobytes())
+            key = (r.shape, self.dphi, self.shift, sha.digest())
+            try:
+                result = self._fieldlines[key]
+                self._fieldlines.move_to_end(key)
+                return result
+            except KeyError:
+                pass
+
+        # find_interp_positions changes phi in place
+        interp_positions = self.find_interp_positions(r,z,np.copy(phi),prev_,next_)
+        psi = self.psi_interp(interp_positions[0,0,...],interp_positions[0,1,...])
+        psin= self.psi_interp(interp_positions[1,0,...],interp_positions[1,1,...])
+        psi = psin * interp_positions[1,2,...] + psi * interp_positions[0,2,...]
+        interp_positions.flags.writeable = False
+        psi.flags.writeable = False
+        result = (interp_positions,psi)
+
+        nbytes = interp_positions.nbytes + psi.nbytes
+        if key is not None and nbytes <= self.fieldline_cache_bytes:
+            self._fieldlines[key] = result
+            self._fieldline_nbytes += nbytes
+            while self._fieldline_nbytes > self.fieldline_cache_bytes:
+                old_positions,old_psi = self._fieldlines.popitem(last=False)[1]
+                self._fieldline_nbytes -= old_positions.nbytes + old_psi.nbytes
+        return result
+
+    def clear_fieldline_cache(self):
+        """ Remove all the memoized field lines (needed if the geometry is changed)
+        """
+        self._fieldlines.clear()
+        self._fieldline_nbytes = 0
+
+    def interpolate_on_planes(self,planes,r,z):
+        """ Evaluate the fluctuation interpolants of the current time step on the poloidal planes
+
+        The points are sorted once by plane, and each interpolant is evaluated on a contiguous slice.
+        Points on planes that are not loaded get 0.
+
+        :param np.array[N] planes: Plane of each point
+        :param np.array[N] r: R coordinates on the plane
+        :param np.array[N] z: Z coordinates on the plane
+
+        :returns: Potential and non-adiabatic density for each point
+        :rtype: np.array[N,2]
+        """
+        # index of the planes in self.planes (sorted), -1 if not loaded
+        j = np.searchsorted(self.planes,planes)
+        j[j == len(self.planes)] = 0
+        j[self.planes[j] != planes] = -1
+        order = np.argsort(j,kind='stable')
+        # offsets of each plane in the sorted points
+        offsets = np.searchsorted(j[order],np.arange(-1,len(self.planes)+1))
+        values = np.zeros((planes.shape[0],2))
+        for k in range(len(self.planes)):
+            start,stop = offsets[k+1],offsets[k+2]
+            if start == stop:
+                continue
+            ind = order[start:stop]
+            values[ind] = self.interpfluc[k](r[ind],z[ind])
+        return values
+
     def interpolate_data(self,pos,timestep,quant,eq,check=True):
         """ Interpolate the data to the position wanted
         
@@ -630,38 +805,21 @@ class XGC_Loader_local():
         if not eq:
             if ne_bool:
                 ne = np.zeros(r.shape[0])
-                interp_positions = self.find_interp_positions(r,z,phi,prevplane,nextplane)
+                interp_positions,psi = self.field_line_positions(r,z,phi,prevplane,nextplane)
                 if self.lim:
                     ind = (self.Zmax > interp_positions[0,1]) & (interp_positions[0,1] > self.Zmin)
                     ind = ind & ((self.Zmax > interp_positions[1,1]) & (interp_positions[1,1] > self.Zmin))
                     ind = ind & (self.Rmax > interp_positions[0,0]) & (interp_positions[0,0] > self.Rmin)
                     ind = ind & (self.Rmax > interp_positions[1,0]) & (interp_positions[1,0] > self.Rmin)
                 
-                #create index dictionary, for each key as plane number and
-                # value the corresponding indices where the plane is used as previous or next plane.
-                prev_idx = {}
-                next_idx = {}
-                for j in range(len(self.planes)):
-                    prev_idx[j] = np.where(prevplane == self.planes[j] )
-                    next_idx[j] = np.where(nextplane == self.planes[j] )
-
-                #for each time step, first create the 2 arrays of quantities for interpolation
-                prevn = np.zeros((r.shape[0],2))
-                nextn = np.zeros((prevn.shape[0],2))
-                
-                for j in range(len(self.planes)):
-                    # interpolation on the poloidal planes
-                    prevn[prev_idx[j]] = self.interpfluc[j](
-                        interp_positions[0,0][prev_idx[j]], interp_positions[0,1][prev_idx[j]])
-                    
-                    nextn[next_idx[j]] = self.interpfluc[j](
-                        interp_positions[1,0][next_idx[j]], interp_positions[1,1][next_idx[j]])
+                # interpolation on the poloidal planes, the previous and next plane points are done together
+                values = self.interpolate_on_planes(np.concatenate([prevplane,nextplane]),
+                                                    interp_positions[:,0].flatten(),interp_positions[:,1].flatten())
+                prevn = values[:r.shape[0]]
+                nextn = values[r.shape[0]:]
                 # interpolation along the field line
                 phi_pot = prevn[:,0] * interp_positions[1,2,...] + nextn[:,0] * interp_positions[0,2,...]
                 ne = prevn[:,1] * interp_positions[1,2,...] + nextn[:,1] * interp_positions[0,2,...]
-                psi = self.psi_interp(interp_positions[0,0,...],interp_positions[0,1,...])
-                psin= self.psi_interp(interp_positions[1,0,...],interp_positions[1,1,...])
-                psi = psin * interp_positions[1,2,...] + psi * interp_positions[0,2,...]
                 ne = self.calc_total_ne_3D(psi,ne,phi_pot)
 
                 if self.lim:
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the local parallel runs of
+:py:class:`sdp.diagnostic.ecei.ecei2d.imaging.ECEImagingSystem`
+"""
+import numpy as np
+import pytest
+
+import sdp.plasma.analytic.testparameter as tp
+from sdp.settings.unitsystem import cgs
+from sdp.io.forkpool import fork_available
+from sdp.diagnostic.ecei.ecei2d.imaging import ECEImagingSystem
+from sdp.diagnostic.ecei.ecei2d.detector2d import GaussianAntenna
+
+c = cgs['c']
+keV = cgs['keV']
+
+
+def _create_system(**kwargs):
+    tp.set_parameter2D(Te_0=10*keV, Te_shape='uniform', ne_shape='Hmode',
+                       NR=100, NZ=40, DownLeft=(-40, 100),
+                       UpRight=(40, 300), timesteps=np.arange(2))
+    plasma = tp.create_profile2D(fluctuation=True)
+    omegas = np.array([0.9, 1.0])*8e11
+    detectors = [GaussianAntenna(omega_list=[omega], k_list=[omega/c],
+                                 power_list=[1.], waist_x=175, waist_y=0,
+                                 w_0y=2) for omega in omegas]
+    system = ECEImagingSystem(plasma, detectors=detectors, max_harmonic=2,
+                              max_power=2, **kwargs)
+    system.set_coords([np.linspace(-40, 20, 9), np.linspace(-20, 20, 9),
+                       np.linspace(251, 150, 20)])
+    return system
+
+
+@pytest.mark.skipif(not fork_available(),
+                    reason='local parallel runs need fork')
+def test_local_parallel_run_equals_serial():
+    serial = _create_system()
+    parallel = _create_system(parallel=True, n_workers=2)
+    try:
+        for system in (serial, parallel):
+            system.auto_adjust_mesh(fine_coeff=0.4, mute=True)
+            system.diagnose(time=[0, 1], mute=True)
+        assert np.allclose(parallel.Te, serial.Te)
+        # the channels are updated, and the meshes set in the workers raise
+        # the stencil cache size of the plasma in this process
+        assert np.array_equal(parallel.X1Ds[1], serial.X1Ds[1])
+        assert parallel.plasma.stencil_cache_size == \
+            serial.plasma.stencil_cache_size
+        # the workers are kept for later runs
+        pool = parallel._pool
+        parallel.diagnose(time=[1], mute=True)
+        assert parallel._pool is pool
+        assert np.allclose(parallel.Te[:, 0], serial.Te[:, 1])
+    finally:
+        parallel.close()
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of :py:mod:`sdp.io.forkpool`
+"""
+import os
+
+import numpy as np
+import pytest
+
+from sdp.io.forkpool import ForkPool, fork_available, shared_zeros
+
+
+def _fill_row(context, i):
+    context['out'][i] = context['values'][i] * 2
+    return i, os.getpid()
+
+
+@pytest.mark.parametrize('n_workers', [1, 3])
+def test_workers_write_into_shared_array(n_workers):
+    values = np.random.RandomState(0).rand(6, 5)
+    out = shared_zeros(values.shape)
+    with ForkPool(n_workers, values=values, out=out) as pool:
+        done = list(pool.imap_unordered(_fill_row, [(i,) for i in range(6)]))
+    assert sorted(i for i, pid in done) == list(range(6))
+    assert np.array_equal(out, values * 2)
+    if n_workers > 1 and fork_available():
+        assert os.getpid() not in set(pid for i, pid in done)
+    else:
+        assert set(pid for i, pid in done) == {os.getpid()}
+
+
+def test_map_keeps_order():
+    with ForkPool(2, values=np.arange(4), out=shared_zeros(4)) as pool:
+        assert [i for i, pid in pool.map(_fill_row, [(3,), (0,), (2,)])] == \
+               [3, 0, 2]
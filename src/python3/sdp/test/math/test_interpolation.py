@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of :py:func:`sdp.math.interpolation.barycentric_matrix`
+"""
+import numpy as np
+import pytest
+from scipy.spatial import Delaunay
+from scipy.interpolate import LinearNDInterpolator
+
+from sdp.math.interpolation import barycentric_matrix
+
+
+@pytest.mark.parametrize('ndim', [2, 3])
+def test_matches_linear_nd_interpolator(ndim):
+    rng = np.random.RandomState(0)
+    delaunay = Delaunay(rng.rand(300, ndim))
+    # fields stacked in the trailing dimensions, e.g. quantities and times
+    values = rng.rand(300, 3, 4)
+    # points around the unit box, many of them outside the convex hull
+    xi = rng.rand(500, ndim)*1.4 - 0.2
+    outside = delaunay.find_simplex(xi) < 0
+    assert 0 < outside.sum() < len(xi)
+
+    weights = barycentric_matrix(delaunay, xi)
+    result = weights.dot(values.reshape(300, -1)).reshape(500, 3, 4)
+    expected = LinearNDInterpolator(delaunay, values, fill_value=0)(xi)
+
+    assert weights.shape == (500, 300)
+    assert np.allclose(result, expected, rtol=1e-12, atol=1e-12)
+    assert np.all(result[outside] == 0)
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Round trip tests of :py:class:`sdp.plasma.cache.ProfileCache`
+"""
+import os
+
+import numpy as np
+
+from sdp.geometry.grid import Cartesian2D
+from sdp.plasma.profile import ECEI_Profile
+from sdp.plasma.cache import ProfileCache
+from sdp.plasma.storage import HDF5TimeSeries
+
+
+def _create_profile():
+    grid = Cartesian2D(DownLeft=(-10, 100), UpRight=(10, 200), NR=20, NZ=10)
+    rng = np.random.RandomState(0)
+    dTe = rng.rand(3, 10, 20)
+    return ECEI_Profile(grid, rng.rand(10, 20), rng.rand(10, 20),
+                        rng.rand(10, 20), time=np.arange(3),
+                        dne=rng.rand(3, 10, 20), dTe_para=dTe,
+                        dTe_perp=dTe)
+
+
+def test_store_and_load(tmp_path):
+    source = tmp_path / 'source.dat'
+    source.write_bytes(b'simulation output')
+    cache = ProfileCache(str(tmp_path / 'cache'))
+    profile = _create_profile()
+    created = []
+
+    def create():
+        created.append(1)
+        return profile
+
+    args = ([str(source)], profile.grid, {'option': 1})
+    cache.get_or_create(*args, create=create)
+    loaded = cache.get_or_create(*args, create=create)
+
+    assert len(created) == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert isinstance(loaded.dne, HDF5TimeSeries)
+    for name in ('ne0', 'Te0', 'B0', 'time'):
+        assert np.array_equal(getattr(loaded, name), getattr(profile, name))
+    for name in ('dne', 'dTe_para', 'dTe_perp'):
+        assert np.array_equal(getattr(loaded, name)[:],
+                              getattr(profile, name))
+    assert not loaded.has_dB
+    loaded.dne.close()
+
+
+def test_mtime_change_is_a_miss(tmp_path):
+    source = tmp_path / 'source.dat'
+    source.write_bytes(b'simulation output')
+    cache = ProfileCache(str(tmp_path / 'cache'), lazy=False)
+    profile = _create_profile()
+    args = ([str(source)], profile.grid, {'option': 1})
+
+    key = cache.key(*args)
+    cache.store(key, profile)
+    assert key in cache
+
+    stat = os.stat(str(source))
+    os.utime(str(source), (stat.st_atime, stat.st_mtime + 10))
+    assert cache.key(*args) != key
+    assert cache.load(cache.key(*args), profile.grid) is None
+
+    cache.clear()
+    assert key not in cache
@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of :py:class:`sdp.plasma.gtc.loader.GTC_Loader`
+"""
+import os
+import json
+import types
+
+import numpy as np
+import pytest
+
+from sdp.geometry.grid import Cartesian2D
+from sdp.plasma.profile import ECEI_Profile
+from sdp.plasma.cache import ProfileCache
+from sdp.plasma.storage import ComputedTimeSeries
+from sdp.plasma.gtc.loader import GTC_Loader, convert_snapshots, \
+                                  SNAPSHOT_STORE, GTC_to_cgs
+
+N_GTC = 200
+
+
+def _write_snapshots(path, tsteps, seed=0):
+    """write snapshot files with random fields on *N_GTC* points"""
+    rng = np.random.RandomState(seed)
+    fields = ['phi', 'densityi', 'fluidne', 'densitye', 'Pe_perp',
+              'Pe_para', 'apara', 'delta_psi']
+    for t in tsteps:
+        snap = dict((name, rng.rand(N_GTC).tolist()) for name in fields)
+        with open(str(path / 'snap{0:0>7}_fpsdp.json'.format(t)), 'w') as f:
+            json.dump(snap, f)
+
+
+def test_cached_profile_is_created_without_loading(tmp_path, monkeypatch):
+    _write_snapshots(tmp_path, [10, 20])
+    grid = Cartesian2D(DownLeft=(-10, 100), UpRight=(10, 200), NR=20, NZ=10)
+    cache = ProfileCache(str(tmp_path / 'cache'))
+    rng = np.random.RandomState(1)
+    profile = ECEI_Profile(grid, rng.rand(10, 20), rng.rand(10, 20),
+                           rng.rand(10, 20))
+
+    loader = GTC_Loader(str(tmp_path) + '/', grid, [10, 20], cache=cache)
+    monkeypatch.setattr(GTC_Loader, '_create_profile',
+                        lambda self, diagnostic, grid: profile)
+    loader.create_profile('ecei2d')
+    monkeypatch.undo()
+
+    # with a cache, nothing is loaded at initialization, and a cached profile
+    # doesn't need the loaded data
+    def load(self):
+        raise AssertionError('GTC output files loaded')
+    monkeypatch.setattr(GTC_Loader, 'load', load)
+    loader = GTC_Loader(str(tmp_path) + '/', grid, [10, 20], cache=cache)
+    cached = loader.create_profile('ecei2d')
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert np.array_equal(cached.Te0, profile.Te0)
+
+    # a changed snapshot is a miss, and loads the output files
+    _write_snapshots(tmp_path, [20], seed=2)
+    with pytest.raises(AssertionError):
+        loader.create_profile('ecei2d')
+
+
+def _grid(R_min):
+    return Cartesian2D(DownLeft=(-10, R_min), UpRight=(10, R_min+100),
+                       NR=20, NZ=10)
+
+
+def _grid_loader(monkeypatch):
+    """return a loader with loaded data, whose interpolation onto a grid 
+    creates new random arrays, and the list of grids interpolated on"""
+    interpolated = []
+    rng = np.random.RandomState(0)
+
+    def interpolate_eq(self):
+        interpolated.append(self.grid)
+        self.ne0_on_grid = rng.rand(*self.grid.R2D.shape)
+
+    def interpolate_fluc_2D(self):
+        self.nane_on_grid = rng.rand(2, *self.grid.R2D.shape)
+
+    monkeypatch.setattr(GTC_Loader, 'interpolate_eq', interpolate_eq)
+    monkeypatch.setattr(GTC_Loader, 'interpolate_fluc_2D',
+                        interpolate_fluc_2D)
+    monkeypatch.setattr(GTC_Loader, 'check_grid_resolution', lambda self: None)
+    loader = GTC_Loader.__new__(GTC_Loader)
+    loader.Mode = 'full'
+    loader._loaded = True
+    loader.grid = _grid(100)
+    loader.interpolate_eq()
+    loader.interpolate_fluc_2D()
+    return loader, interpolated
+
+
+def test_switching_back_reuses_grid_quantities(monkeypatch):
+    loader, interpolated = _grid_loader(monkeypatch)
+    grid_A = loader.grid
+    ne0_A, nane_A = loader.ne0_on_grid, loader.nane_on_grid
+
+    grid_B = _grid(110)
+    loader.interpolate_on_grid(grid_B)
+    assert interpolated == [grid_A, grid_B]
+    assert loader.ne0_on_grid is not ne0_A
+
+    loader.interpolate_on_grid(_grid(100))
+    assert len(interpolated) == 2
+    assert loader.ne0_on_grid is ne0_A
+    assert loader.nane_on_grid is nane_A
+
+
+def test_grid_cache_drops_least_recently_used(monkeypatch):
+    loader, interpolated = _grid_loader(monkeypatch)
+    loader.grid_cache_size = 1
+    for R_min in (110, 120, 110, 100):
+        loader.interpolate_on_grid(_grid(R_min))
+    # grid 100 was dropped when 120 was used, 110 was kept
+    assert [grid.R1D[0] for grid in interpolated] == [100, 110, 120, 100]
+    assert len(loader._grid_cache) == 1
+
+    loader.clear_grid_cache()
+    loader.interpolate_on_grid(_grid(110))
+    assert len(interpolated) == 5
+
+
+DERIVED = ['dne', 'dne_on_grid', 'ne_on_grid', 'dTe_ad', 'dTe_ad_on_grid',
+           'dTe_na_perp', 'dTe_na_para', 'dTe_na_perp_on_grid',
+           'dTe_na_para_on_grid', 'dTe_perp', 'dTe_para', 'dTe_perp_on_grid',
+           'dTe_para_on_grid']
+
+
+def _fields_loader(lazy_derived=False):
+    """return a loader with random fields on GTC mesh and on grid"""
+    rng = np.random.RandomState(0)
+    nt, n, shape = 3, N_GTC, (10, 12)
+    loader = GTC_Loader.__new__(GTC_Loader)
+    loader.lazy_derived = lazy_derived
+    loader.grid = _grid(100)
+    loader.tsteps = list(range(nt))
+    loader.HaveElectron = True
+    loader.Te0_interp = lambda a: a**2
+    loader.phi = rng.rand(nt, n)
+    loader.a_gtc = rng.rand(n)
+    loader.Te0_gtc = rng.rand(n) + 1
+    loader.ne0_gtc = rng.rand(n) + 1
+    loader.a_on_grid = rng.rand(*shape)
+    loader.Te0_on_grid = rng.rand(*shape) + 1
+    loader.ne0_on_grid = rng.rand(*shape)
+    loader.ne0_on_grid[0] = 0
+    for name in ('dpsi', 'dne_ad', 'nane', 'dPe_perp', 'dPe_para'):
+        setattr(loader, name, rng.rand(nt, n))
+        setattr(loader, name + '_on_grid', rng.rand(nt, *shape))
+    return loader
+
+
+def test_derived_quantity_is_cached_until_source_is_assigned():
+    loader = _fields_loader()
+    dTe_perp = loader.dTe_perp_on_grid
+    assert loader.dTe_perp_on_grid is dTe_perp
+    assert not dTe_perp.flags.writeable
+
+    # fields on GTC mesh are not used on grid
+    loader.Te0_gtc = loader.Te0_gtc * 2
+    assert loader.dTe_perp_on_grid is dTe_perp
+
+    loader.dPe_perp_on_grid = loader.dPe_perp_on_grid * 2
+    updated = loader.dTe_perp_on_grid
+    assert updated is not dTe_perp
+    assert not np.allclose(updated, dTe_perp)
+    assert np.allclose(updated, loader.dTe_ad_on_grid
+                       + loader.calculate_fluc_Te('perp', 'grid'))
+
+
+def test_invalidate_derived_drops_dependent_quantities():
+    loader = _fields_loader()
+    for name in ('dne', 'dne_on_grid', 'dTe_ad', 'dTe_perp'):
+        getattr(loader, name)
+
+    # e.g. after nane is modified in place
+    loader.invalidate_derived('nane')
+    assert set(loader._derived) == {'dne_on_grid', 'dTe_ad'}
+    loader.invalidate_derived('grid')
+    assert set(loader._derived) == {'dTe_ad'}
+    loader.invalidate_derived()
+    assert not loader._derived
+
+
+def test_lazy_derived_equals_eager():
+    eager = _fields_loader()
+    lazy = _fields_loader(lazy_derived=True)
+    for name in DERIVED:
+        expected = getattr(eager, name)
+        value = getattr(lazy, name)
+        assert isinstance(value, ComputedTimeSeries)
+        assert value.shape == expected.shape
+        assert np.allclose(value[:], expected), name
+        assert np.allclose(value[1], expected[1]), name
+
+
+def _snapshot_loader(path, tsteps, nodes):
+    """return a loader ready to load fluctuations from *path*"""
+    loader = GTC_Loader.__new__(GTC_Loader)
+    loader.path = path
+    loader.tsteps = tsteps
+    loader.gtc_nodes = nodes
+    n = N_GTC if nodes is None else len(nodes)
+    loader.R_gtc = np.zeros(n)
+    loader.HaveElectron = True
+    loader.isEM = False
+    loader.ne0_gtc = np.linspace(1, 2, n)
+    loader.ions = [types.SimpleNamespace(charge=1)]
+    loader.Te0_1D = [3.]
+    return loader
+
+
+@pytest.mark.parametrize('nodes', [None, np.arange(20, 150, 3)])
+def test_snapshot_store_round_trip(tmp_path, nodes):
+    _write_snapshots(tmp_path, [10, 20, 30, 40])
+    path = str(tmp_path) + '/'
+    # repeated and unordered time steps
+    tsteps = [30, 10, 30, 40]
+    from_json = _snapshot_loader(path, tsteps, nodes)
+    from_json.load_fluctuations_2D(n_workers=2)
+
+    convert_snapshots(path, n_workers=2)
+    assert os.path.exists(os.path.join(path, SNAPSHOT_STORE))
+    from_store = _snapshot_loader(path, tsteps, nodes)
+    from_store.load_fluctuations_2D()
+
+    for name in ('phi', 'dni', 'dne_ad', 'nane', 'dPe_perp', 'dPe_para'):
+        assert np.array_equal(getattr(from_store, name),
+                              getattr(from_json, name)), name
+    assert np.array_equal(from_store.phi[0], from_store.phi[2])
+
+
+def _write_grid(path, seed=0):
+    """write a grid file with *N_GTC* random points on a disk, R and Z are
+    in unit of R0"""
+    rng = np.random.RandomState(seed)
+    r = 0.5*np.sqrt(rng.rand(N_GTC))
+    theta = 2*np.pi*rng.rand(N_GTC)
+    R_eq, Z_eq = np.meshgrid(np.linspace(0.9, 2.1, 7),
+                             np.linspace(-0.6, 0.6, 7))
+    raw_grids = dict(R0=1., Z0=0., B0=1., R_gtc=(1.5 + r*np.cos(theta)),
+                     Z_gtc=r*np.sin(theta), a_gtc=2*r, theta_gtc=theta,
+                     R_eq=R_eq.ravel(), Z_eq=Z_eq.ravel(),
+                     a_eq=2*np.hypot(R_eq-1.5, Z_eq).ravel())
+    with open(str(path / 'grid_fpsdp.json'), 'w') as f:
+        json.dump(dict((key, np.asarray(value).tolist())
+                       for key, value in raw_grids.items()), f)
+
+
+def test_cropped_fluctuations_equal_uncropped(tmp_path):
+    _write_grid(tmp_path)
+    _write_snapshots(tmp_path, [10, 20])
+    R0 = GTC_to_cgs['length']
+    grid = Cartesian2D(DownLeft=(-0.1*R0, 1.4*R0), UpRight=(0.1*R0, 1.6*R0),
+                       NR=12, NZ=10)
+    fields = ['phi', 'dPe_perp', 'dPe_para', 'dni', 'dne_ad', 'nane']
+    on_grid = []
+    # the margin is several times the spacing of GTC grid points, so all the
+    # triangles used by the grid points are kept
+    for crop_margin in (None, 0.2*R0):
+        loader = _snapshot_loader(str(tmp_path) + '/', [10, 20], None)
+        loader.grid = grid
+        loader.dimension = 2
+        loader.crop_margin = crop_margin
+        loader.load_grid()
+        loader.ne0_gtc = 1 + loader.a_gtc
+        loader.load_fluctuations_2D(n_workers=1)
+        loader.interpolate_fluc_2D()
+        on_grid.append([getattr(loader, name+'_on_grid') for name in fields])
+    assert len(loader.gtc_nodes) < N_GTC // 2
+
+    for name, cropped, full in zip(fields, on_grid[1], on_grid[0]):
+        assert np.allclose(cropped, full, rtol=1e-12,
+                           atol=1e-12*np.max(np.abs(full))), name
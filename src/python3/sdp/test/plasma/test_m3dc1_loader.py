@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of :py:class:`sdp.plasma.m3dc1.loader.M3DC1_Loader`
+"""
+import numpy as np
+import pytest
+from scipy.io.netcdf import netcdf_file as ncfile
+
+from sdp.plasma.m3dc1.loader import M3DC1_Loader
+from sdp.plasma.storage import ComputedTimeSeries
+
+NR, NZ = 12, 16
+
+
+def _write_ufile(filename, rng, with_mesh=False):
+    """write a netCDF3 file in the format of the fwr2d ufiles, with random
+    ne, te and bb, some of te negative"""
+    f = ncfile(filename, 'w')
+    f.createDimension('r', NR)
+    f.createDimension('z', NZ)
+    if with_mesh:
+        rr = f.createVariable('rr', 'd', ('r',))
+        rr[:] = np.linspace(1, 2, NR)
+        zz = f.createVariable('zz', 'd', ('z',))
+        zz[:] = np.linspace(-0.5, 0.5, NZ)
+    for name, value in (('ne', 1e19 + 1e18*rng.rand(NZ, NR)),
+                        ('te', rng.rand(NZ, NR) - 0.1),
+                        ('bb', 2 + rng.rand(NZ, NR))):
+        var = f.createVariable(name, 'd', ('z', 'r'))
+        var[:] = value
+    f.close()
+
+
+@pytest.mark.parametrize('tor_slice', [2, [3, 0, 3, 1]])
+def test_lazy_fluctuations_equal_eager(tmp_path, tor_slice):
+    rng = np.random.RandomState(0)
+    _write_ufile(str(tmp_path / 'C1.h5_equ_ufile.cdf'), rng, with_mesh=True)
+    for tor in range(4):
+        _write_ufile(str(tmp_path / 'C1.h5_{0:0>4}_ufile.cdf'.format(tor)),
+                     rng)
+    path = str(tmp_path) + '/'
+
+    eager = M3DC1_Loader(path, tor_slice, n_workers=2)
+    lazy = M3DC1_Loader(path, tor_slice, lazy=True)
+    for name in ('dne', 'dTe', 'dB'):
+        expected = getattr(eager, name)
+        value = getattr(lazy, name)
+        assert isinstance(value, ComputedTimeSeries)
+        assert value.shape == expected.shape == (len(eager.time), NZ, NR)
+        assert np.array_equal(value[:], expected), name
+        assert np.array_equal(value[-1], expected[-1]), name
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of :py:class:`sdp.plasma.shared.SharedProfile` across processes
+"""
+import pickle
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from sdp.geometry.grid import Cartesian2D
+from sdp.plasma.profile import ECEI_Profile
+from sdp.plasma.shared import SharedProfile
+
+# run in a new interpreter, which has its own resource tracker like an
+# ipcluster engine
+_ATTACH = """
+import pickle, sys
+shared = pickle.load(sys.stdin.buffer)
+plasma = shared.attach()
+pickle.dump((plasma.ne0.copy(), plasma.Te0.copy()), sys.stdout.buffer)
+"""
+
+
+def _create_profile():
+    grid = Cartesian2D(DownLeft=(-10, 100), UpRight=(10, 200), NR=20, NZ=10)
+    rng = np.random.RandomState(0)
+    return ECEI_Profile(grid, rng.rand(10, 20), rng.rand(10, 20),
+                        rng.rand(10, 20))
+
+
+def _attach_in_new_process(shared):
+    result = subprocess.run([sys.executable, '-c', _ATTACH],
+                            input=pickle.dumps(shared),
+                            stdout=subprocess.PIPE, check=True)
+    return pickle.loads(result.stdout)
+
+
+def test_attach_from_two_processes():
+    profile = _create_profile()
+    shared = SharedProfile(profile)
+    try:
+        for i in range(2):
+            ne0, Te0 = _attach_in_new_process(shared)
+            assert np.array_equal(ne0, profile.ne0)
+            assert np.array_equal(Te0, profile.Te0)
+    finally:
+        shared.unlink()
+
+
+def test_attached_profile_outlives_unlink():
+    profile = _create_profile()
+    shared = SharedProfile(profile)
+    plasma = shared.attach()
+    assert not plasma.Te0.flags.writeable
+    shared.unlink()
+    assert np.array_equal(plasma.Te0, profile.Te0)
+    with pytest.raises(FileNotFoundError):
+        shared.attach()
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""
+Round trip tests of the out-of-core time series in :py:mod:`sdp.plasma.storage`
+"""
+import pickle
+
+import numpy as np
+
+from sdp.plasma.storage import MemmapTimeSeries, HDF5TimeSeries
+
+
+def test_memmap_round_trip(tmp_path):
+    data = np.random.RandomState(0).rand(5, 4, 3)
+    series = MemmapTimeSeries.from_array(str(tmp_path / 'dne.npy'), data,
+                                         window=2)
+    assert series.shape == data.shape
+    assert np.array_equal(series[3], data[3])
+    assert np.array_equal(series[1:4, 2], data[1:4, 2])
+    assert np.array_equal(np.asarray(series), data)
+    assert series.cache_info()['cached'] == [3, 4]
+
+
+def test_memmap_pickle_reopens_file(tmp_path):
+    data = np.asfortranarray(np.random.RandomState(1).rand(200, 20, 30))
+    series = MemmapTimeSeries.from_array(str(tmp_path / 'dne.npy'), data)
+    pickled = pickle.dumps(series)
+    # the mapped data is not carried in the pickle
+    assert len(pickled) < data.nbytes // 100
+    copy = pickle.loads(pickled)
+    assert isinstance(copy._memmap, np.memmap)
+    assert np.array_equal(copy[:], data)
+
+
+def test_hdf5_pickle_round_trip(tmp_path):
+    data = np.random.RandomState(2).rand(4, 6, 5)
+    series = HDF5TimeSeries.from_array(str(tmp_path / 'profile.h5'), 'dne',
+                                       data)
+    assert np.array_equal(series[2], data[2])
+    copy = pickle.loads(pickle.dumps(series))
+    assert np.array_equal(copy[:], data)
+    series.close()
+    copy.close()
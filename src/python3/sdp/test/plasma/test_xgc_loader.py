@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of :py:class:`sdp.plasma.xgc.loader.XGC_Loader`
+"""
+import os
+import shutil
+
+import numpy as np
+import h5py as h5
+import pytest
+
+from sdp.geometry.grid import Cartesian2D, Cartesian3D
+from sdp.plasma.xgc.loader import XGC_Loader, fieldline_map_key, \
+                                  find_interp_positions_cached
+
+
+@pytest.fixture(scope='module')
+def xgc_path(tmp_path_factory):
+    """write a small XGC run on a disk shaped mesh, with smooth
+    fluctuations on 4 planes and 2 time steps"""
+    path = str(tmp_path_factory.mktemp('xgc')) + '/'
+    rng = np.random.RandomState(0)
+    nnode, nboundary, nplane = 1000, 64, 4
+    r = 0.5*np.sqrt(rng.rand(nnode-nboundary))
+    theta = 2*np.pi*rng.rand(nnode-nboundary)
+    theta_b = np.linspace(0, 2*np.pi, nboundary, endpoint=False)
+    R = np.concatenate([1.5 + r*np.cos(theta), 1.5 + 0.5*np.cos(theta_b)])
+    Z = np.concatenate([r*np.sin(theta), 0.5*np.sin(theta_b)])
+    with h5.File(path+'xgc.mesh.h5', 'w') as f:
+        f['coordinates/values'] = np.array([R, Z]).T
+        f['psi'] = (R-1.5)**2 + Z**2
+        f['nextnode'] = np.arange(nnode)
+    with h5.File(path+'xgc.bfield.h5', 'w') as f:
+        f['node_data[0]/values'] = np.array([-0.01*Z, 0.01*(R-1.5),
+                                             np.ones(nnode)]).T
+    psi = np.linspace(0, 0.3, 50)
+    with h5.File(path+'xgc.oneddiag.h5', 'w') as f:
+        f['psi_mks'] = psi[np.newaxis]
+        for species in ('i', 'e'):
+            f[species+'_perp_temperature_1d'] = \
+                                        (1000*(1-psi/0.3) + 100)[np.newaxis]
+            f[species+'_gc_density_1d'] = (1e19*(1-psi/0.3) + 1e18)[np.newaxis]
+    with open(path+'units.m', 'w') as f:
+        f.write('sml_dt = 1e-7;\ndiag_1d_period = 10;\npsi_x = 0.25;\n')
+    phi = 2*np.pi*np.arange(nplane)/nplane
+    for t in (1, 2):
+        with h5.File(path+'xgc.3d.{0:0>5}.h5'.format(t), 'w') as f:
+            wave = np.sin(4*R[:, None] + 2*Z[:, None] + phi + 0.3*t)
+            f['dpot'] = 10*wave + 0.5*t
+            f['eden'] = 1e17*np.cos(3*R[:, None] - 2*Z[:, None] + phi
+                                    - 0.2*t) + 1e16*t
+            f['iden'] = 1e17*wave
+    return path
+
+
+def _grid(dimension):
+    if dimension == 2:
+        return Cartesian2D(DownLeft=(-0.15, 1.35), UpRight=(0.15, 1.65),
+                           NR=12, NZ=10)
+    return Cartesian3D(Xmin=1.35, Xmax=1.65, Ymin=-0.15, Ymax=0.15,
+                       Zmin=-0.05, Zmax=0.05, NX=8, NY=6, NZ=3)
+
+
+@pytest.mark.parametrize('Fluc_Only', [True, False])
+@pytest.mark.parametrize('dimension', [2, 3])
+def test_cropped_fluctuations_equal_uncropped(xgc_path, tmp_path, dimension,
+                                              Fluc_Only):
+    grid = _grid(dimension)
+    time_steps = np.array([1, 2])
+    cache_dir = str(tmp_path)
+    full = XGC_Loader(xgc_path, grid, time_steps, Fluc_Only=Fluc_Only,
+                      fieldline_cache_dir=cache_dir)
+    # the margin is several times the mesh spacing, so all the triangles
+    # used by the grid points are kept
+    cropped = XGC_Loader(xgc_path, grid, time_steps, Fluc_Only=Fluc_Only,
+                         crop_margin=0.1, fieldline_cache_dir=cache_dir)
+    assert len(cropped.fluc_nodes) < len(full.fluc_nodes) // 2
+
+    names = ['dne_ad_on_grid', 'nane_on_grid', 'ne0_on_grid', 'ni0_on_grid']
+    if dimension == 2:
+        names.append('phi_on_grid')
+    for name in names:
+        expected = getattr(full, name)
+        assert np.allclose(getattr(cropped, name), expected, rtol=1e-12,
+                           atol=1e-12*np.max(np.abs(expected))), name
+
+
+def test_fieldline_map_is_cached_by_file_contents(xgc_path, tmp_path,
+                                                  monkeypatch):
+    cache_dir = str(tmp_path / 'fieldline')
+    loader = XGC_Loader(xgc_path, _grid(3), np.array([1]),
+                        fieldline_cache_dir=cache_dir)
+    key = fieldline_map_key(loader)
+    fname = 'fieldline_{0}.npy'.format(key)
+    assert os.listdir(cache_dir) == [fname]
+    interp_positions = loader._get_interp_positions()
+    assert np.array_equal(np.load(os.path.join(cache_dir, fname)),
+                          interp_positions)
+
+    # saved map is loaded without tracing the field lines
+    def trace(my_xgc, Nstep=10):
+        raise AssertionError('field lines traced')
+    monkeypatch.setattr('sdp.plasma.xgc.loader.'
+                        'find_interp_positions_v2_upgrade', trace)
+    assert np.array_equal(find_interp_positions_cached(loader,
+                                                       cache_dir=cache_dir),
+                          interp_positions)
+
+    # a copied and touched mesh file has the same key, changed content not
+    mesh_copy = str(tmp_path / 'xgc.mesh.h5')
+    shutil.copy(loader.mesh_file, mesh_copy)
+    os.utime(mesh_copy, (0, 0))
+    loader.mesh_file = mesh_copy
+    assert fieldline_map_key(loader) == key
+    with h5.File(mesh_copy, 'a') as f:
+        f['psi'][0] = f['psi'][0] + 1
+    assert fieldline_map_key(loader) != key